@@ -0,0 +1,442 @@
+"""
+ESOM Finance RAG Chatbot ASGI Server
+------------------------------------
+An asyncio-native variant of the Flask server in esom_simple_rag.py exposing
+the same /api/chat and /api/health contract.
+
+Each chat request runs retrieval in a thread pool while the glossary and
+market lookups run on the event loop, so a slow encode never blocks other
+connections. Requests that exceed their deadline receive a 504 and requests
+whose client disconnects are cancelled. /api/chat/stream sends the answer
+as server-sent events while it is generated and /api/chat/batch answers a
+list of queries as NDJSON, without a deadline.
+
+Run with an ASGI server, for example:
+    python esom_asgi.py --port 5001
+    uvicorn esom_asgi:app --port 5001
+"""
+
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from datetime import datetime
+
+import esom_simple_rag as rag_server
+
+logger = logging.getLogger(__name__)
+
+# Largest request body accepted by /api/chat and by /api/chat/batch
+MAX_BODY_BYTES = 1 << 20
+MAX_BATCH_BODY_BYTES = 16 << 20
+
+
+class RequestError(Exception):
+    """Raised for requests that are answered with an error status."""
+
+    def __init__(self, status: int, payload: dict, headers: list = None):
+        super().__init__(payload.get("error"))
+        self.status = status
+        self.payload = payload
+        self.headers = headers or []
+
+
+class ClientDisconnected(Exception):
+    """Raised when the client goes away before its response is ready."""
+
+
+class RequestJobs(Executor):
+    """Executor that submits one request's jobs to the shared pool and keeps track of them.
+
+    A job keeps running after its request gives up on it (deadline or
+    disconnect), so the request's in-flight slot is only released once all
+    of its jobs have finished.
+    """
+
+    def __init__(self, executor: Executor):
+        self._executor = executor
+        self.futures = []
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = self._executor.submit(fn, *args, **kwargs)
+        self.futures.append(future)
+        return future
+
+
+class ChatApp:
+    """ASGI application serving the ESOM Finance chat API."""
+
+    def __init__(self, request_timeout: float = 10.0, max_in_flight: int = 64,
+                 executor_workers: int = 8):
+        self.request_timeout = request_timeout
+        self.max_in_flight = max_in_flight
+        self.executor = ThreadPoolExecutor(max_workers=executor_workers, thread_name_prefix="rag-retrieval")
+        self.in_flight = 0
+        self.routes = {
+            ("GET", "/api/health"): self.health,
+            ("POST", "/api/chat"): self.chat,
+            ("GET", "/api/metrics"): self.metrics,
+        }
+        # Handlers that send their own (streamed) response
+        self.stream_routes = {
+            ("POST", "/api/chat/stream"): self.chat_stream,
+            ("POST", "/api/chat/batch"): self.chat_batch,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        method = scope["method"]
+        if method == "OPTIONS":
+            # CORS preflight, mirroring flask_cors defaults
+            await self._send(send, 200, b"", [
+                (b"access-control-allow-methods", b"GET, POST, OPTIONS"),
+                (b"access-control-allow-headers", b"content-type"),
+            ], content_type=None)
+            return
+
+        stream_handler = self.stream_routes.get((method, scope["path"]))
+        handler = self.routes.get((method, scope["path"]))
+        if handler is None and stream_handler is None:
+            await self._send_json(send, 404, {"error": "Not found"})
+            return
+
+        try:
+            if stream_handler is not None:
+                await stream_handler(receive, send)
+                return
+            status, payload = await handler(receive)
+            if isinstance(payload, str):
+                await self._send(send, status, payload.encode("utf-8"),
+                                 content_type=b"text/plain; version=0.0.4; charset=utf-8")
+            else:
+                await self._send_json(send, status, payload)
+        except RequestError as e:
+            await self._send_json(send, e.status, e.payload, e.headers)
+        except ClientDisconnected:
+            logger.info(f"Client disconnected from {scope['path']} before the response was ready")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # Load in the background so health checks can report progress
+                if rag_server.rag_system is None and rag_server.rag_loader is None:
+                    rag_server.initialize_rag(background=True)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def health(self, receive):
+        """Health check that returns a 200 status once the RAG system is ready"""
+        if rag_server.rag_system is None:
+            return 503, {
+                "status": rag_server.rag_state,
+                "message": "ESOM Finance API is starting"
+            }
+
+        return 200, {
+            "status": "ok",
+            "state": rag_server.rag_state,
+            "message": "ESOM Finance API is running"
+        }
+
+    async def metrics(self, receive):
+        """Prometheus metrics, as served by the Flask app"""
+        return 200, rag_server.render_metrics(rag_server.rag_system)
+
+    async def _admit(self, receive, parse, max_body_bytes: int = MAX_BODY_BYTES):
+        """Check readiness and load, then parse the request body with ``parse(rag_system, data)``.
+
+        An admitted request holds an in-flight slot, which the caller must
+        release with ``_release`` once it is done.
+        """
+        rag_system = rag_server.rag_system
+        if rag_system is None:
+            raise RequestError(503, {
+                "error": "RAG system is not ready",
+                "state": rag_server.rag_state
+            }, [(b"retry-after", b"5")])
+
+        # Shed load instead of queueing requests that would miss their deadline
+        if self.in_flight >= self.max_in_flight:
+            raise RequestError(503, {"error": "Server is overloaded"}, [(b"retry-after", b"1")])
+
+        # Take the slot before the first await, so that requests arriving
+        # while the body is read cannot all pass the check above
+        self.in_flight += 1
+        try:
+            data = await self._read_json(receive, max_body_bytes)
+            try:
+                return (rag_system,) + parse(rag_system, data)
+            except ValueError as e:
+                raise RequestError(400, {"error": str(e)})
+        except BaseException:
+            self.in_flight -= 1
+            raise
+
+    async def chat(self, receive):
+        """Handle a chat request within the configured deadline."""
+        rag_system, message, user_id, chat_history, filters = await self._admit(receive, rag_server.parse_chat_request)
+
+        jobs = RequestJobs(self.executor)
+        start_time = time.perf_counter()
+        try:
+            response_data = await self._run_cancellable(
+                rag_system.agenerate_response(message, chat_history, executor=jobs, filters=filters,
+                                              user_id=user_id),
+                receive)
+        except ClientDisconnected:
+            raise
+        except asyncio.TimeoutError:
+            logger.warning(f"Query from {user_id} exceeded the {self.request_timeout:.1f}s deadline")
+            raise RequestError(504, {"error": "Request deadline exceeded"})
+        except Exception as e:
+            logger.error(f"Error processing chat request: {e}")
+            raise RequestError(500, {
+                "error": "An error occurred while processing your request",
+                "message": str(e)
+            })
+        finally:
+            self._release(jobs)
+
+        rag_system.stage_latency.observe("request", time.perf_counter() - start_time)
+        rag_server.log_chat_request(user_id, message, time.perf_counter() - start_time)
+
+        return 200, {
+            "response": response_data["answer"],
+            "sources": response_data["sources"],
+            "glossary_terms": response_data["glossary_terms"],
+            "market_data": response_data["market_data"],
+            "timestamp": datetime.now().isoformat()
+        }
+
+    async def chat_stream(self, receive, send):
+        """Stream a chat answer as server-sent events within the configured deadline."""
+        rag_system, message, user_id, chat_history, filters = await self._admit(
+            receive, rag_server.parse_chat_request)
+        
+        jobs = RequestJobs(self.executor)
+        start_time = time.perf_counter()
+        try:
+            events = rag_system.stream_response(message, chat_history, filters, user_id)
+            started = await self._stream(receive, send, jobs, self._sse_chunks(events), b"text/event-stream",
+                                         lambda error: rag_server.format_sse("error", error).encode("utf-8"),
+                                         self.request_timeout)
+        finally:
+            self._release(jobs)
+        
+        if started:
+            rag_system.stage_latency.observe("request", time.perf_counter() - start_time)
+            rag_server.log_chat_request(user_id, message, time.perf_counter() - start_time)
+    
+    async def chat_batch(self, receive, send):
+        """Answer a list of queries as NDJSON lines, in input order.
+        
+        Batches have no deadline: they run until done or until the client
+        disconnects.
+        """
+        rag_system, messages, ids, filters = await self._admit(
+            receive, rag_server.parse_batch_request, MAX_BATCH_BODY_BYTES)
+        
+        jobs = RequestJobs(self.executor)
+        try:
+            lines = rag_server.batch_lines(rag_system, messages, ids, filters)
+            await self._stream(receive, send, jobs, (line.encode("utf-8") for line in lines),
+                               b"application/x-ndjson", lambda error: (json.dumps(error) + "\n").encode("utf-8"))
+        finally:
+            self._release(jobs)
+    
+    def _release(self, jobs: RequestJobs):
+        """Free a request's in-flight slot once the executor jobs it started have finished."""
+        pending = [future for future in jobs.futures if not future.done()]
+        if not pending:
+            self.in_flight -= 1
+            return
+        
+        loop = asyncio.get_running_loop()
+        remaining = [len(pending)]
+        
+        def finished():
+            remaining[0] -= 1
+            if not remaining[0]:
+                self.in_flight -= 1
+        
+        # Done callbacks run in the worker thread; count on the event loop
+        for future in pending:
+            future.add_done_callback(lambda _: loop.call_soon_threadsafe(finished))
+    
+    @staticmethod
+    def _sse_chunks(events):
+        """Encode (event, data) pairs from ``stream_response`` as server-sent events."""
+        try:
+            for event, data in events:
+                if event == "done":
+                    data["timestamp"] = datetime.now().isoformat()
+                yield rag_server.format_sse(event, data).encode("utf-8")
+        finally:
+            events.close()
+    
+    async def _stream(self, receive, send, executor: Executor, chunks, content_type: bytes, encode_error,
+                      timeout: float = None) -> bool:
+        """Send the byte strings of the iterator ``chunks`` as a streamed response.
+        
+        Each step of ``chunks`` runs in ``executor``, within ``timeout``
+        seconds overall when given. Errors and deadline overruns before the
+        first chunk get a regular error response; later ones end the stream
+        with ``encode_error(payload)``. Returns whether the response started.
+        """
+        loop = asyncio.get_running_loop()
+        disconnect = asyncio.ensure_future(self._wait_for_disconnect(receive))
+        deadline = loop.time() + timeout if timeout is not None else None
+        step = None
+        started = False
+        try:
+            while True:
+                step = loop.run_in_executor(executor, next, chunks, None)
+                remaining = max(0.0, deadline - loop.time()) if deadline is not None else None
+                done, _ = await asyncio.wait({step, disconnect}, timeout=remaining,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if disconnect in done:
+                    raise ClientDisconnected()
+                if step in done:
+                    try:
+                        chunk = step.result()
+                    except Exception as e:
+                        logger.error(f"Error streaming response: {e}")
+                        error = {"error": "An error occurred while processing your request"}
+                        if not started:
+                            raise RequestError(500, error)
+                        await self._send_chunk(send, encode_error(error))
+                        break
+                else:
+                    logger.warning(f"Streamed response exceeded the {timeout:.1f}s deadline")
+                    error = {"error": "Request deadline exceeded"}
+                    if not started:
+                        raise RequestError(504, error)
+                    await self._send_chunk(send, encode_error(error))
+                    break
+                step = None
+                if chunk is None:
+                    break
+                
+                if not started:
+                    await send({"type": "http.response.start", "status": 200, "headers": [
+                        (b"content-type", content_type),
+                        (b"cache-control", b"no-cache"),
+                        (b"access-control-allow-origin", b"*"),
+                    ]})
+                    started = True
+                await self._send_chunk(send, chunk)
+        finally:
+            disconnect.cancel()
+            # A generator cannot be closed while a step is running in the executor
+            if step is not None and not step.done():
+                step.add_done_callback(lambda _: chunks.close())
+            else:
+                chunks.close()
+        
+        if started:
+            await send({"type": "http.response.body", "body": b""})
+        return started
+    
+    @staticmethod
+    async def _send_chunk(send, body: bytes):
+        await send({"type": "http.response.body", "body": body, "more_body": True})
+    
+    async def _run_cancellable(self, coro, receive):
+        """Await ``coro`` under the request deadline, cancelling it if the client disconnects."""
+        task = asyncio.ensure_future(coro)
+        disconnect = asyncio.ensure_future(self._wait_for_disconnect(receive))
+        try:
+            done, _ = await asyncio.wait({task, disconnect}, timeout=self.request_timeout,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if task in done:
+                return task.result()
+            if disconnect in done:
+                raise ClientDisconnected()
+            raise asyncio.TimeoutError()
+        finally:
+            task.cancel()
+            disconnect.cancel()
+
+    @staticmethod
+    async def _wait_for_disconnect(receive):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    @staticmethod
+    async def _read_json(receive, max_body_bytes: int = MAX_BODY_BYTES):
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise ClientDisconnected()
+            body += message.get("body", b"")
+            if len(body) > max_body_bytes:
+                raise RequestError(413, {"error": "Request body too large"})
+            if not message.get("more_body", False):
+                break
+        if not body:
+            return None
+        try:
+            return json.loads(body)
+        except ValueError:
+            raise RequestError(400, {"error": "Request body is not valid JSON"})
+
+    @staticmethod
+    async def _send_json(send, status: int, payload: dict, headers: list = None):
+        await ChatApp._send(send, status, json.dumps(payload).encode("utf-8"), headers)
+
+    @staticmethod
+    async def _send(send, status: int, body: bytes, headers: list = None,
+                    content_type: bytes = b"application/json"):
+        response_headers = [
+            (b"content-length", str(len(body)).encode("ascii")),
+            (b"access-control-allow-origin", b"*"),
+        ]
+        if content_type is not None:
+            response_headers.append((b"content-type", content_type))
+        response_headers.extend(headers or [])
+        await send({"type": "http.response.start", "status": status, "headers": response_headers})
+        await send({"type": "http.response.body", "body": body})
+
+
+app = ChatApp()
+
+
+if __name__ == '__main__':
+    parser = rag_server.build_arg_parser('ESOM Finance RAG Chatbot ASGI Server')
+    parser.add_argument('--request-timeout', type=float, default=10.0,
+                        help='Seconds a chat request may take before it is answered with a 504')
+    parser.add_argument('--max-in-flight', type=int, default=64,
+                        help='Concurrent chat requests accepted before new ones are rejected with a 503')
+    parser.add_argument('--executor-workers', type=int, default=8,
+                        help='Threads running query encoding and retrieval')
+
+    args = parser.parse_args()
+    rag_server.configure_rag_options(args)
+
+    try:
+        import uvicorn
+    except ImportError:
+        logger.error("uvicorn is required to run the ASGI server: pip install uvicorn")
+        raise SystemExit(1)
+
+    if args.profile:
+        rag_server.profiler.start()
+    app = ChatApp(request_timeout=args.request_timeout, max_in_flight=args.max_in_flight,
+                  executor_workers=args.executor_workers)
+    if not args.fast_start and not rag_server.initialize_rag():
+        logger.error("Failed to initialize RAG system. Exiting.")
+        raise SystemExit(1)
+
+    logger.info(f"Starting ASGI server on {args.host}:{args.port}")
+    uvicorn.run(app, host=args.host, port=args.port)
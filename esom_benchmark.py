@@ -0,0 +1,418 @@
+"""
+ESOM Finance RAG Benchmarks
+---------------------------
+Benchmarks for the RAG server in esom_simple_rag.py:
+
+1. A synthetic corpus generator that grows the dummy documents to any size.
+2. Microbenchmarks of document loading, retrieval, glossary lookup and
+   response generation.
+3. An HTTP load generator for /api/chat reporting latency percentiles and
+   QPS at several concurrency levels.
+
+Results are printed as JSON so runs can be compared to catch regressions.
+Everything runs offline: documents are embedded with a small hashing model
+instead of a downloaded sentence-transformers model.
+
+Usage:
+    python esom_benchmark.py --documents 5000 --output results.json
+    python esom_benchmark.py --documents 5000 --baseline results.json
+    python esom_benchmark.py --url http://localhost:5001 --concurrency 1,8,32
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import zlib
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+import esom_simple_rag as rag_server
+from esom_simple_rag import DOCUMENT_TYPES, DUMMY_DOCUMENTS, INDEX_BACKENDS, RETRIEVAL_MODES, EMBEDDING_DTYPES
+from esom_simple_rag import SimpleRAG, tokenize
+
+logger = logging.getLogger(__name__)
+
+# Bumped when the layout of the result JSON changes
+RESULT_FORMAT_VERSION = 1
+
+# Building blocks of synthetic documents and queries
+TOPICS = [
+    "monetary policy", "inflation", "repo rate", "GDP growth", "unemployment", "fiscal deficit",
+    "bond yields", "the stock market", "SENSEX", "NIFTY", "foreign exchange reserves", "crude oil",
+    "gold prices", "credit growth", "the current account", "trade balance", "consumer demand",
+    "capital expenditure", "tax revenue", "the rupee"
+]
+ACTORS = [
+    "The Reserve Bank of India", "The central bank", "The finance ministry", "Analysts",
+    "Foreign investors", "Commercial banks", "The statistics office", "Economists"
+]
+FIGURE_SENTENCES = [
+    "{actor} reported that {topic} moved by {pct:.2f}% in Q{quarter} {year}.",
+    "{actor} expects {topic} to stay near {pct:.1f}% through {year}.",
+    "The repo rate stood at {rate:.2f}% while {topic} rose {pct:.1f}%.",
+    "{topic_title} reached {value:,} points in {month} {year}."
+]
+PROSE_SENTENCES = [
+    "{actor} noted that {topic} remains closely linked to {topic2}.",
+    "Changes in {topic} tend to feed through to {topic2} with a lag of several quarters.",
+    "{actor} argued that tighter conditions in {topic} could weigh on {topic2}.",
+    "Historical data show that {topic} is more volatile than {topic2} during downturns."
+]
+TITLE_TEMPLATES = ["Outlook for {topic}", "{topic_title} and {topic2}", "Notes on {topic}"]
+QUERY_TEMPLATES = [
+    "What is the impact of {topic} on {topic2}?",
+    "How did {topic} change in Q{quarter} {year}?",
+    "Explain the relationship between {topic} and {topic2}",
+    "latest news on {topic}",
+    "What is {topic}?"
+]
+MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August",
+          "September", "October", "November", "December"]
+
+
+class HashingEmbeddingModel:
+    """Deterministic hashed bag-of-words embeddings standing in for sentence-transformers.
+
+    Texts sharing words get similar vectors, which is enough to exercise
+    retrieval realistically without downloading a model.
+    """
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+        self.model_name = f"hashing-stub-{dim}"
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, texts: List[str], **kwargs) -> np.ndarray:
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for token in tokenize(str(text)):
+                h = zlib.crc32(token.encode("utf-8"))
+                embeddings[i, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return embeddings
+
+
+def _fill(template: str, rng: random.Random) -> str:
+    topic, topic2 = rng.sample(TOPICS, 2)
+    return template.format(
+        actor=rng.choice(ACTORS), topic=topic, topic2=topic2, topic_title=topic[:1].upper() + topic[1:],
+        pct=rng.uniform(-5, 12), rate=rng.uniform(3, 8), value=rng.randint(10000, 80000),
+        quarter=rng.randint(1, 4), year=rng.randint(2018, 2025), month=rng.choice(MONTHS))
+
+
+def _synthetic_content(rng: random.Random, sentences: List[str]) -> str:
+    # Mostly short documents with a long tail that spans several chunks
+    n_sentences = rng.choice([3, 4, 6, 8, 12, 40])
+    parts = []
+    for _ in range(n_sentences):
+        roll = rng.random()
+        if roll < 0.4:
+            parts.append(_fill(rng.choice(FIGURE_SENTENCES), rng))
+        elif roll < 0.8:
+            parts.append(_fill(rng.choice(PROSE_SENTENCES), rng))
+        else:
+            parts.append(rng.choice(sentences))
+    return " ".join(parts)
+
+
+def generate_corpus(data_path: str, n_documents: int, seed: int = 0) -> Dict[str, int]:
+    """Write ``n_documents`` spread evenly over DOCUMENT_TYPES as JSONL files.
+
+    Each file starts with the dummy documents ``SimpleRAG`` would create and
+    is padded with synthetic documents mixing their sentences with generated
+    ones that quote figures, dates and tickers. Returns documents per source.
+    """
+    rng = random.Random(seed)
+    sentences = [sentence.strip().rstrip(".") + "." for docs in DUMMY_DOCUMENTS.values()
+                 for doc in docs for sentence in doc["content"].split(". ") if sentence.strip()]
+    os.makedirs(data_path, exist_ok=True)
+
+    counts = {}
+    for i, doc_type in enumerate(DOCUMENT_TYPES):
+        count = n_documents // len(DOCUMENT_TYPES) + (1 if i < n_documents % len(DOCUMENT_TYPES) else 0)
+        documents = [dict(doc) for doc in DUMMY_DOCUMENTS.get(doc_type, [])][:count]
+        while len(documents) < count:
+            n = len(documents)
+            doc = {"title": f"{_fill(rng.choice(TITLE_TEMPLATES), rng)} #{n}",
+                   "content": _synthetic_content(rng, sentences)}
+            if doc_type == "financial_news":
+                doc["date"] = (date(2024, 1, 1) + timedelta(days=rng.randint(0, 730))).isoformat()
+            elif doc_type == "economic_indicators":
+                doc["indicator"] = rng.choice(TOPICS)
+                doc["value"] = f"{rng.uniform(-5, 12):.1f}%"
+                doc["period"] = f"Q{rng.randint(1, 4)} {rng.randint(2018, 2025)}"
+            documents.append(doc)
+
+        with open(os.path.join(data_path, f"{doc_type}.jsonl"), 'w', encoding='utf-8') as f:
+            for doc in documents:
+                f.write(json.dumps(doc) + "\n")
+        counts[doc_type] = len(documents)
+    return counts
+
+
+def generate_queries(n_queries: int, seed: int = 1) -> List[str]:
+    """Return ``n_queries`` synthetic user questions about the corpus topics."""
+    rng = random.Random(seed)
+    return [_fill(rng.choice(QUERY_TEMPLATES), rng) for _ in range(n_queries)]
+
+
+def summarize_latencies(latencies: List[float], wall_time: Optional[float] = None) -> Dict[str, float]:
+    """Summarize latencies in seconds as milliseconds percentiles plus throughput."""
+    if not latencies:
+        return {"count": 0}
+    ms = np.array(latencies) * 1000.0
+    wall_time = wall_time if wall_time is not None else float(np.sum(latencies))
+    return {
+        "count": len(latencies),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+        "ops_per_s": len(latencies) / wall_time if wall_time > 0 else 0.0
+    }
+
+
+def time_calls(fn: Callable, inputs: List) -> Dict[str, float]:
+    """Call ``fn`` once per input and summarize the latencies."""
+    latencies = []
+    for item in inputs:
+        start = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - start)
+    return summarize_latencies(latencies)
+
+
+def run_microbenchmarks(rag: SimpleRAG, queries: List[str], load_repeats: int = 1) -> Dict[str, Dict]:
+    """Benchmark the stages of the RAG pipeline on a loaded system."""
+    results = {
+        "load_documents": time_calls(lambda _: rag._load_documents(), range(load_repeats)),
+        "retrieve_relevant_documents": time_calls(lambda q: rag.retrieve_relevant_documents(q, top_k=3), queries),
+        "check_glossary_terms": time_calls(rag.check_glossary_terms, queries),
+        "get_relevant_market_data": time_calls(rag.get_relevant_market_data, queries),
+        "generate_response": time_calls(rag.generate_response, queries)
+    }
+    dates = rag.metadata_index.dates
+    if len(dates):
+        # "Latest news": the most recent 30 days of dated documents
+        date_from = str(dates[-1] - np.timedelta64(30, 'D'))
+        results["retrieve_latest_news"] = time_calls(
+            lambda q: rag.retrieve_relevant_documents(q, top_k=3, date_from=date_from), queries)
+    return results
+
+
+def start_local_server(rag: SimpleRAG):
+    """Serve the Flask app for ``rag`` on an ephemeral local port; returns (server, url)."""
+    from werkzeug.serving import make_server
+
+    rag_server.rag_system = rag
+    rag_server.rag_state = "ready"
+    server = make_server("127.0.0.1", 0, rag_server.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="benchmark-server", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def run_load(url: str, queries: List[str], concurrency: int, n_requests: int,
+             timeout: float = 30.0) -> Dict:
+    """POST ``n_requests`` chat queries to ``url`` from ``concurrency`` client threads.
+
+    Each thread reuses one connection where the server allows keep-alive.
+    Only successful (200) responses count toward latency and QPS.
+    """
+    parsed = urllib.parse.urlsplit(url)
+    path = parsed.path.rstrip("/") + "/api/chat"
+    counter = itertools.count()
+    latencies = []
+    errors = {}
+    lock = threading.Lock()
+
+    def client():
+        connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=timeout)
+        local_latencies, local_errors = [], {}
+        while True:
+            i = next(counter)
+            if i >= n_requests:
+                break
+            body = json.dumps({"message": queries[i % len(queries)], "user_id": "benchmark"})
+            start = time.perf_counter()
+            try:
+                connection.request("POST", path, body, {"Content-Type": "application/json"})
+                response = connection.getresponse()
+                response.read()
+                status = str(response.status)
+            except (OSError, http.client.HTTPException) as e:
+                status = type(e).__name__
+                connection.close()
+            if status == "200":
+                local_latencies.append(time.perf_counter() - start)
+            else:
+                local_errors[status] = local_errors.get(status, 0) + 1
+        connection.close()
+        with lock:
+            latencies.extend(local_latencies)
+            for status, count in local_errors.items():
+                errors[status] = errors.get(status, 0) + count
+
+    threads = [threading.Thread(target=client, name=f"load-client-{i}") for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - start
+
+    summary = summarize_latencies(latencies, wall_time)
+    summary.pop("ops_per_s", None)
+    return {
+        "concurrency": concurrency,
+        "requests": n_requests,
+        "errors": errors,
+        "qps": len(latencies) / wall_time if wall_time > 0 else 0.0,
+        "latency": summary
+    }
+
+
+def compare_results(baseline: Dict, current: Dict, tolerance: float) -> List[str]:
+    """Return descriptions of metrics that regressed by more than ``tolerance`` (a fraction)."""
+    regressions = []
+
+    def check(name, old, new, higher_is_better=False):
+        if not old or new is None:
+            return
+        change = (old - new) / old if higher_is_better else (new - old) / old
+        if change > tolerance:
+            regressions.append(f"{name}: {old:.3f} -> {new:.3f} ({change:+.0%})")
+
+    for stage, stats in baseline.get("microbenchmarks", {}).items():
+        new_stats = current.get("microbenchmarks", {}).get(stage, {})
+        check(f"{stage} p50_ms", stats.get("p50_ms"), new_stats.get("p50_ms"))
+    new_levels = {level["concurrency"]: level for level in current.get("http", [])}
+    for level in baseline.get("http", []):
+        new_level = new_levels.get(level["concurrency"])
+        if new_level is None:
+            continue
+        check(f"http c={level['concurrency']} p95_ms", level["latency"].get("p95_ms"),
+              new_level["latency"].get("p95_ms"))
+        check(f"http c={level['concurrency']} qps", level["qps"], new_level["qps"], higher_is_better=True)
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='ESOM Finance RAG benchmarks')
+    parser.add_argument('--documents', type=int, default=2000,
+                        help='Number of synthetic documents to generate')
+    parser.add_argument('--data-path', type=str, default=None,
+                        help='Directory for the synthetic corpus (default: a temporary directory)')
+    parser.add_argument('--queries', type=int, default=200,
+                        help='Number of distinct synthetic queries')
+    parser.add_argument('--load-repeats', type=int, default=1,
+                        help='Times the corpus is reloaded for the load_documents benchmark')
+    parser.add_argument('--concurrency', type=str, default="1,4,16",
+                        help='Comma-separated client concurrency levels for the HTTP load test')
+    parser.add_argument('--requests', type=int, default=400,
+                        help='Requests sent per concurrency level')
+    parser.add_argument('--url', type=str, default=None,
+                        help='Load-test a running server instead of a local one (skips microbenchmarks)')
+    parser.add_argument('--skip-micro', action='store_true', help='Skip the microbenchmarks')
+    parser.add_argument('--skip-http', action='store_true', help='Skip the HTTP load test')
+    parser.add_argument('--enable-caches', action='store_true',
+                        help='Keep the query and response caches enabled (disabled by default)')
+    parser.add_argument('--index-backend', type=str, default="exact", choices=sorted(INDEX_BACKENDS))
+    parser.add_argument('--retrieval', type=str, default="dense", choices=RETRIEVAL_MODES)
+    parser.add_argument('--embedding-dtype', type=str, default="float32", choices=EMBEDDING_DTYPES)
+    parser.add_argument('--embedding-dim', type=int, default=384,
+                        help='Dimension of the stub embedding model')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the corpus and query generators')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Write the JSON results to this file as well as stdout')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='Compare against a previous results file and exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Relative slowdown tolerated when comparing against --baseline')
+    parser.add_argument('--verbose', action='store_true', help='Keep the server logging enabled')
+    args = parser.parse_args(argv)
+
+    if not args.verbose:
+        logging.getLogger(rag_server.__name__).setLevel(logging.WARNING)
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    queries = generate_queries(args.queries, args.seed + 1)
+    concurrency_levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    results = {
+        "format_version": RESULT_FORMAT_VERSION,
+        "timestamp": datetime.now().isoformat(),
+        "environment": {
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count()
+        },
+        "config": {key: value for key, value in vars(args).items()
+                   if key not in ("output", "baseline", "verbose")}
+    }
+
+    if args.url:
+        if not args.skip_http:
+            results["http"] = [run_load(args.url, queries, level, args.requests) for level in concurrency_levels]
+    else:
+        data_path = args.data_path or tempfile.mkdtemp(prefix="esom-benchmark-")
+        try:
+            results["corpus"] = {"documents": generate_corpus(data_path, args.documents, args.seed)}
+            cache_size = None if args.enable_caches else 0
+            options = {"query_cache_size": cache_size, "response_cache_size": cache_size}
+            start = time.perf_counter()
+            rag = SimpleRAG(data_path=data_path, use_embedding_cache=False,
+                            embeddings_model=HashingEmbeddingModel(args.embedding_dim),
+                            index_backend=args.index_backend, retrieval_mode=args.retrieval,
+                            embedding_dtype=args.embedding_dtype,
+                            **{key: value for key, value in options.items() if value is not None})
+            results["corpus"]["init_s"] = time.perf_counter() - start
+            results["corpus"]["chunks"] = len(rag.chunk_doc_rows)
+
+            if not args.skip_micro:
+                results["microbenchmarks"] = run_microbenchmarks(rag, queries, args.load_repeats)
+            if not args.skip_http:
+                server, url = start_local_server(rag)
+                try:
+                    # Warm up connections and lazily initialized code paths
+                    run_load(url, queries, 1, min(10, args.requests))
+                    results["http"] = [run_load(url, queries, level, args.requests)
+                                       for level in concurrency_levels]
+                finally:
+                    server.shutdown()
+        finally:
+            if args.data_path is None:
+                shutil.rmtree(data_path, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare_results(json.load(f), results, args.tolerance)
+        for regression in regressions:
+            logger.error(f"Regression: {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
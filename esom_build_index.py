@@ -0,0 +1,172 @@
+"""
+ESOM Finance RAG Index Builder
+------------------------------
+Builds the deployable index artifact served by esom_simple_rag.py and
+esom_asgi.py, so that documents are embedded on a build machine instead of
+in the serving process.
+
+The builder reads the JSONL sources and the glossary from the data path and
+writes one versioned artifact directory holding:
+
+- the normalized document embeddings and the chunk layout
+- the vector (exact or IVF) and BM25 indexes
+- the document store
+- the compiled glossary automaton
+- a manifest.json with the version, model, index settings and source digests
+
+Artifacts are written to <output>/<version> and the <output>/current link is
+switched to the new version once it is complete. Servers started with
+--index <output> memory-map the current artifact and start without
+encoding any documents.
+
+Usage:
+    python esom_build_index.py --data-path data --output indexes
+    python esom_simple_rag.py --data-path data --index indexes
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from esom_simple_rag import (DEFAULT_CHUNK_OVERLAP, DEFAULT_CHUNK_SIZE, DEFAULT_DATA_PATH,
+                             DEFAULT_ENCODE_BATCH_SIZE, DOCUMENT_TYPES, EMBEDDING_DTYPES,
+                             INDEX_BACKENDS, INDEX_CURRENT_LINK, RETRIEVAL_MODES, ExactIndex,
+                             IVFIndex, SimpleRAG, VectorIndex)
+
+logger = logging.getLogger(__name__)
+
+# Files an artifact is built from; all of them must exist in the data path
+SOURCE_FILES = [f"{doc_type}.jsonl" for doc_type in DOCUMENT_TYPES] + ["finance_glossary.jsonl"]
+
+
+def file_digest(path: str) -> str:
+    """Return the SHA-256 digest of a file, read in 1 MiB blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_digests(data_path: str) -> Dict[str, str]:
+    """Digest the JSONL files an artifact is built from."""
+    return {name: file_digest(os.path.join(data_path, name))
+            for name in SOURCE_FILES if os.path.exists(os.path.join(data_path, name))}
+
+
+def switch_current(output: str, version: str):
+    """Atomically point <output>/current at the artifact ``version``."""
+    link = os.path.join(output, INDEX_CURRENT_LINK)
+    tmp_link = link + ".tmp"
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(version, tmp_link)
+    os.replace(tmp_link, link)
+
+
+def prune_versions(output: str, keep: int) -> List[str]:
+    """Remove all but the ``keep`` newest artifacts, never the current one; return the removed versions."""
+    current = os.path.basename(os.path.realpath(os.path.join(output, INDEX_CURRENT_LINK)))
+    versions = sorted(name for name in os.listdir(output)
+                      if os.path.isfile(os.path.join(output, name, "manifest.json")))
+    removed = [version for version in versions[:-keep] if version != current] if keep > 0 else []
+    for version in removed:
+        shutil.rmtree(os.path.join(output, version), ignore_errors=True)
+    return removed
+
+
+def build_index(data_path: str, output: str, rag_kwargs: Dict, keep: int = 3) -> Dict:
+    """Index the corpus in ``data_path`` and publish it as a new artifact under ``output``.
+
+    Returns the artifact's manifest. Raises FileNotFoundError if a source
+    file is missing and ValueError if the corpus holds no documents.
+    """
+    # Step 1: Check the sources, since SimpleRAG would fill missing files with dummy data
+    missing = [name for name in SOURCE_FILES if not os.path.isfile(os.path.join(data_path, name))]
+    if missing:
+        raise FileNotFoundError(f"Missing source files in {data_path}: {', '.join(missing)}")
+
+    # Step 2: Embed and index the corpus, as the server would at startup
+    rag = SimpleRAG(data_path=data_path, query_cache_size=0, response_cache_size=0,
+                    market_poll_interval=0.0, **rag_kwargs)
+    if not rag.document_count():
+        raise ValueError(f"No documents found in {data_path}")
+
+    # Step 3: Name the version after the build time and the embeddings it holds
+    fingerprint = VectorIndex.embeddings_fingerprint(rag.document_embeddings)
+    version = f"{datetime.now():%Y%m%dT%H%M%S}-{fingerprint[:12]}"
+
+    # Step 4: Write the artifact and make it current once complete
+    os.makedirs(output, exist_ok=True)
+    manifest = rag.save_snapshot(os.path.join(output, version), version=version, metadata={
+        "embeddings_fingerprint": fingerprint,
+        "sources": source_digests(data_path)
+    })
+    switch_current(output, version)
+
+    removed = prune_versions(output, keep)
+    if removed:
+        logger.info(f"Removed old index artifacts: {', '.join(removed)}")
+    logger.info(f"Published index artifact {version} to {output}")
+    return manifest
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Build the ESOM Finance RAG index artifact')
+    parser.add_argument('--data-path', type=str, default=DEFAULT_DATA_PATH,
+                        help='Directory holding the JSONL sources and glossary')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Directory receiving versioned artifacts (default: <data-path>/indexes)')
+    parser.add_argument('--keep', type=int, default=3,
+                        help='Number of artifact versions kept in the output directory (0 keeps all)')
+    parser.add_argument('--index-backend', type=str, default=ExactIndex.name, choices=sorted(INDEX_BACKENDS),
+                        help='Vector index stored in the artifact')
+    parser.add_argument('--ivf-lists', type=int, default=None,
+                        help='Number of IVF clusters (default: 4 * sqrt(number of documents))')
+    parser.add_argument('--ivf-probe', type=int, default=8,
+                        help='Number of IVF clusters scanned per query')
+    parser.add_argument('--embedding-dtype', type=str, default="float32", choices=EMBEDDING_DTYPES,
+                        help='Storage type of the normalized document embedding matrix')
+    parser.add_argument('--retrieval', type=str, default="dense", choices=RETRIEVAL_MODES,
+                        help='Include the BM25 lexical index ("hybrid") or only embeddings ("dense")')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='Maximum characters per embedded document chunk')
+    parser.add_argument('--chunk-overlap', type=int, default=DEFAULT_CHUNK_OVERLAP,
+                        help='Characters shared by consecutive chunks of a document')
+    parser.add_argument('--encode-batch-size', type=int, default=DEFAULT_ENCODE_BATCH_SIZE,
+                        help='Document chunks embedded per model call')
+    parser.add_argument('--no-embedding-cache', action='store_true',
+                        help='Re-encode every chunk instead of reusing the embedding cache in the data path')
+    args = parser.parse_args(argv)
+
+    rag_kwargs = {
+        "index_backend": args.index_backend,
+        "embedding_dtype": args.embedding_dtype,
+        "retrieval_mode": args.retrieval,
+        "chunk_size": args.chunk_size,
+        "chunk_overlap": args.chunk_overlap,
+        "encode_batch_size": args.encode_batch_size,
+        "use_embedding_cache": not args.no_embedding_cache
+    }
+    if args.index_backend == IVFIndex.name:
+        rag_kwargs["index_params"] = {"n_lists": args.ivf_lists, "n_probe": args.ivf_probe}
+
+    output = args.output or os.path.join(args.data_path, "indexes")
+    try:
+        manifest = build_index(args.data_path, output, rag_kwargs, keep=args.keep)
+    except Exception as e:
+        logger.error(f"Error building the index artifact: {e}")
+        return 1
+
+    print(json.dumps(manifest, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
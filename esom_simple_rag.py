@@ -15,17 +15,38 @@ import time
 from datetime import datetime
 import logging
 import argparse
+import asyncio
+import base64
+import bisect
+import copy
+import functools
+import hashlib
+import hmac
+import http.client
+import itertools
+import multiprocessing
+import queue
 import random
-from typing import List, Dict, Any, Optional
+import re
+import secrets
+import shutil
+import signal
+import socket
+import sys
+import threading
+import urllib.parse
+from collections import Counter, OrderedDict, deque
+from collections.abc import Mapping
+from concurrent.futures import Future, ThreadPoolExecutor, wait as wait_futures
+from itertools import islice
+from types import MappingProxyType
+from typing import List, Dict, Any, Optional, Tuple, Callable, Iterator
 
-# Third-party imports
+# Third-party imports (sentence_transformers and langchain are imported
+# lazily by SimpleRAG, so the server can bind its port before they load)
 import numpy as np
-import torch
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from sentence_transformers import SentenceTransformer
-from langchain.embeddings import HuggingFaceEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 # Set up logging
 logging.basicConfig(
@@ -36,143 +57,2938 @@ logger = logging.getLogger(__name__)
 
 # Initialize Flask app
 app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
+# Enable CORS for every route except the admin endpoints, which browsers
+# must not be able to call from other origins
+CORS(app, resources={r"^(?!/api/(ingest|documents|profiler|shard/search)(/|$)).*": {"origins": "*"}})
+
+# Token required by the admin endpoints (set with --admin-token or
+# ESOM_ADMIN_TOKEN); without one they are disabled
+admin_token = None
 
 # Default path for data
 DEFAULT_DATA_PATH = "econ_finance_data/processed"
 
-# Global variables for storing data and models
-embeddings_model = None
-document_store = []
-document_embeddings = []
-glossary = {}
-market_data = {}
-current_trends = {}
+# Embedding models (primary and fallback)
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+FALLBACK_EMBEDDING_MODEL_NAME = "paraphrase-MiniLM-L3-v2"
+
+# Directory (inside the data path) holding the persistent embedding cache
+EMBEDDING_CACHE_DIR = ".embedding_cache"
+
+# Directory (inside the data path) holding serialized vector indexes
+INDEX_DIR = ".index"
+
+# Default chunking of document content (in characters)
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_CHUNK_OVERLAP = 200
+
+# Chunks fetched per requested document before de-duplicating by parent
+CHUNK_OVERSAMPLE = 4
+
+# Prompt budgeting: approximate characters per token, default context budget
+# and the smallest passage worth including in a prompt
+CHARS_PER_TOKEN = 4
+DEFAULT_CONTEXT_TOKENS = 768
+MIN_PASSAGE_TOKENS = 32
+
+# Document collections, each stored as <doc_type>.jsonl in the data path
+DOCUMENT_TYPES = [
+    "research_papers", "textbook_excerpts", 
+    "financial_news", "economic_indicators"
+]
+
+# Directory (inside the data path) holding the document content blob
+DOCUMENT_STORE_DIR = ".document_store"
+
+# Directory (inside the data path) holding the snapshot shared by pre-forked workers
+SNAPSHOT_DIR = ".snapshot"
+SNAPSHOT_FORMAT_VERSION = 2
+
+# Link (inside an index build directory) to the artifact version to serve
+INDEX_CURRENT_LINK = "current"
+
+# JSONL lines parsed per ingestion batch and chunks per encode call
+INGEST_BATCH_LINES = 1000
+DEFAULT_ENCODE_BATCH_SIZE = 256
+
+# Key marking a JSONL line as a tombstone: {"id": ..., "_deleted": true} drops
+# the earlier lines of that ID in the same file when the corpus is loaded
+TOMBSTONE_KEY = "_deleted"
+
+# Largest number of queries accepted by one /api/chat/batch request
+MAX_BATCH_QUERIES = 10000
+
+# Retrieval modes: dense embeddings only, or fused with BM25 lexical search
+RETRIEVAL_MODES = ("dense", "hybrid")
+
+# Rank offset of reciprocal rank fusion; larger values flatten the rank weights
+RRF_K = 60
+
+# Follow-up questions are retrieved with up to HISTORY_TURNS earlier user turns
+# blended into the query embedding, the i-th most recent weighted HISTORY_DECAY ** i
+HISTORY_TURNS = 3
+HISTORY_DECAY = 0.5
+# A question is a follow-up if it opens with a connective or a reference to
+# earlier turns, or if it is short and refers back anywhere; longer
+# questions mentioning "this year" or "that rate" stand on their own
+FOLLOW_UP_PATTERN = re.compile(
+    r"^\s*(?:and|but|also|so|then|what about|how about|compared to|versus|vs"
+    r"|it|its|that|those|they|them|their|same)\b",
+    re.IGNORECASE)
+FOLLOW_UP_REFERENCE_PATTERN = re.compile(
+    r"\b(?:it|its|that|this|these|those|they|them|their|same|previous|before|earlier)\b",
+    re.IGNORECASE)
+FOLLOW_UP_MAX_WORDS = 6
+
+# Sharded retrieval: documents are partitioned across shard servers by a hash
+# of their ID or by source. Shards that do not answer within the shard timeout
+# are left out of the merged results; coordinators wait up to
+# SHARD_STARTUP_TIMEOUT seconds for shards that are still indexing. Shard
+# searches carry the admin token and ask for at most MAX_SHARD_TOP_K hits.
+SHARD_KEYS = ("hash", "source")
+DEFAULT_SHARD_TIMEOUT = 1.0
+SHARD_STARTUP_TIMEOUT = 600.0
+MAX_SHARD_TOP_K = 100
+
+# Keyword routes used when market_data.json has no "routes" section: the
+# result key, the path of the figure in the file and the query keywords
+# asking for it. Every instrument listed under "market_data" is also routed
+# by its own name.
+DEFAULT_MARKET_ROUTES = [
+    {"name": "inflation", "path": ["trends", "inflation_rate"],
+     "keywords": ["inflation", "cpi", "price index"]},
+    {"name": "repo_rate", "path": ["trends", "repo_rate"],
+     "keywords": ["interest rate", "repo", "repo rate"]},
+    {"name": "gdp_growth", "path": ["trends", "gdp_growth"],
+     "keywords": ["gdp", "growth", "economic growth"]},
+    {"name": "SENSEX", "path": ["market_data", "indices", "SENSEX"],
+     "keywords": ["sensex", "stock market", "share market", "bse"]},
+    {"name": "NIFTY", "path": ["market_data", "indices", "NIFTY"],
+     "keywords": ["nifty", "nse"]},
+    {"name": "Gold", "path": ["market_data", "commodities", "Gold"],
+     "keywords": ["gold"]},
+    {"name": "Crude Oil", "path": ["market_data", "commodities", "Crude Oil"],
+     "keywords": ["oil", "crude", "petroleum"]}
+]
+
+# Global variables for storing data and models
+embeddings_model = None
+document_store = []
+document_embeddings = []
+glossary = {}
+market_data = {}
+current_trends = {}
+
+class EmbeddingStore:
+    """Persistent on-disk cache of document embeddings keyed by content hash.
+
+    The cache is a single ``.npy`` matrix (opened memory-mapped) plus a JSON
+    manifest recording the model name, embedding dimension and the content
+    hash stored in each row. A manifest written for a different model or
+    dimension is discarded, so switching to the fallback model re-encodes.
+    """
+
+    MANIFEST_FILE = "manifest.json"
+    MATRIX_FILE = "embeddings.npy"
+
+    def __init__(self, cache_dir: str, model_name: str, dimension: int):
+        self.cache_dir = cache_dir
+        self.model_name = model_name
+        self.dimension = dimension
+        self._matrix = None
+        self._rows = {}
+        self._pending = {}
+        self._used = set()
+        self.encoded = 0
+        self._load()
+
+    @staticmethod
+    def content_hash(text: str) -> str:
+        """Return the cache key for a piece of document content."""
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _load(self):
+        """Open the cached matrix if its manifest matches the current model."""
+        manifest_path = os.path.join(self.cache_dir, self.MANIFEST_FILE)
+        matrix_path = os.path.join(self.cache_dir, self.MATRIX_FILE)
+        if not (os.path.exists(manifest_path) and os.path.exists(matrix_path)):
+            return
+
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if (manifest.get("model_name") != self.model_name
+                    or manifest.get("dimension") != self.dimension):
+                logger.info(f"Embedding cache was built with {manifest.get('model_name')}, "
+                            f"discarding it for {self.model_name}")
+                return
+            matrix = np.load(matrix_path, mmap_mode='r')
+            hashes = manifest.get("hashes", [])
+            if matrix.shape != (len(hashes), self.dimension):
+                logger.warning("Embedding cache manifest does not match matrix, discarding it")
+                return
+            self._matrix = matrix
+            self._rows = {h: i for i, h in enumerate(hashes)}
+            logger.info(f"Opened embedding cache with {len(hashes)} entries")
+        except Exception as e:
+            logger.error(f"Error reading embedding cache: {e}")
+            self._matrix = None
+            self._rows = {}
+
+    def _save(self, hashes: List[str], matrix: np.ndarray):
+        """Atomically replace the cache contents with the given rows."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        matrix_path = os.path.join(self.cache_dir, self.MATRIX_FILE)
+        manifest_path = os.path.join(self.cache_dir, self.MANIFEST_FILE)
+
+        with open(matrix_path + ".tmp", 'wb') as f:
+            np.save(f, matrix)
+        with open(manifest_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump({
+                "model_name": self.model_name,
+                "dimension": self.dimension,
+                "count": len(hashes),
+                "updated_at": datetime.now().isoformat(),
+                "hashes": hashes
+            }, f)
+
+        # Matrix first: a manifest never points at rows that are not on disk
+        os.replace(matrix_path + ".tmp", matrix_path)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    def get_embeddings(self, texts: List[str], encode_fn) -> np.ndarray:
+        """Return embeddings for texts, encoding only content not already cached.
+
+        Newly encoded rows are held in memory until ``sync`` persists them.
+        """
+        hashes = [self.content_hash(text) for text in texts]
+        self._used.update(hashes)
+
+        # Encode each distinct piece of uncached content once
+        missing = {}
+        for h, text in zip(hashes, texts):
+            if h not in self._rows and h not in self._pending and h not in missing:
+                missing[h] = text
+
+        if missing:
+            encoded = np.asarray(encode_fn(list(missing.values())), dtype=np.float32)
+            self._pending.update((h, encoded[i]) for i, h in enumerate(missing))
+            self.encoded += len(missing)
+
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for i, h in enumerate(hashes):
+            row = self._rows.get(h)
+            embeddings[i] = self._matrix[row] if row is not None else self._pending[h]
+        return embeddings
+
+    def sync(self):
+        """Persist newly encoded rows and drop rows not requested since the cache was opened."""
+        kept = [h for h in self._rows if h in self._used]
+        if not self._pending and len(kept) == len(self._rows):
+            return
+
+        logger.info(f"Updating embedding cache: {len(self._pending)} added, "
+                    f"{len(self._rows) - len(kept)} stale entries dropped")
+        hashes = kept + list(self._pending)
+        matrix = np.empty((len(hashes), self.dimension), dtype=np.float32)
+        if kept:
+            matrix[:len(kept)] = self._matrix[[self._rows[h] for h in kept]]
+        if self._pending:
+            matrix[len(kept):] = np.stack(list(self._pending.values()))
+
+        try:
+            self._save(hashes, matrix)
+            self._matrix = np.load(os.path.join(self.cache_dir, self.MATRIX_FILE), mmap_mode='r')
+            self._rows = {h: i for i, h in enumerate(hashes)}
+            self._pending = {}
+        except Exception as e:
+            logger.error(f"Error writing embedding cache: {e}")
+
+
+# Storage types supported for the document embedding matrix
+EMBEDDING_DTYPES = ("float32", "float16", "int8")
+
+
+def l2_normalize(vectors: np.ndarray) -> np.ndarray:
+    """Return float32 copies of the vectors scaled to unit L2 norm."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class GrowableArray:
+    """Append-only NumPy buffer with amortized O(1) appends.
+
+    ``extend`` writes past the rows that earlier views expose and only then
+    publishes a longer view, so readers holding an older view never observe
+    a partially written row. Growing reallocates with 1.5x headroom.
+    """
+
+    def __init__(self, dtype, row_shape: Tuple[int, ...] = (), capacity: int = 0):
+        self._buffer = np.empty((capacity,) + tuple(row_shape), dtype=dtype)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def view(self) -> np.ndarray:
+        return self._buffer[:self._size]
+
+    def extend(self, rows) -> np.ndarray:
+        """Append rows and return a view of the whole array."""
+        rows = np.asarray(rows, dtype=self._buffer.dtype)
+        needed = self._size + len(rows)
+        if needed > len(self._buffer):
+            capacity = max(needed, len(self._buffer) * 3 // 2, 1024)
+            buffer = np.empty((capacity,) + self._buffer.shape[1:], dtype=self._buffer.dtype)
+            buffer[:self._size] = self._buffer[:self._size]
+            self._buffer = buffer
+        self._buffer[self._size:needed] = rows
+        self._size = needed
+        return self._buffer[:needed]
+
+
+class EmbeddingMatrix:
+    """Contiguous matrix of L2-normalized embeddings in a compact dtype.
+
+    ``float32`` and ``float16`` rows are stored as-is. ``int8`` rows are
+    symmetrically quantized with one float32 scale per row, so a row costs
+    ``dim + 4`` bytes. Inner products against a normalized query are cosine
+    similarities. Non-float32 storage is scored block by block so the
+    temporary float32 copy never exceeds ``BLOCK_ROWS`` rows.
+    """
+
+    BLOCK_ROWS = 65536
+
+    def __init__(self, vectors: np.ndarray, scales: Optional[np.ndarray] = None):
+        self.vectors = np.ascontiguousarray(vectors)
+        self.scales = scales
+        # Growable storage shared with matrices produced by ``append``
+        self._vector_buffer = None
+        self._scale_buffer = None
+
+    @classmethod
+    def from_embeddings(cls, embeddings: np.ndarray, dtype: str = "float32") -> "EmbeddingMatrix":
+        """Normalize raw model embeddings and store them in the given dtype."""
+        if dtype not in EMBEDDING_DTYPES:
+            raise ValueError(f"Unsupported embedding dtype: {dtype}")
+        normalized = l2_normalize(embeddings)
+        if dtype == "int8":
+            scales = np.abs(normalized).max(axis=1) / 127.0
+            scales = np.maximum(scales, 1e-12).astype(np.float32)
+            vectors = np.rint(normalized / scales[:, None]).astype(np.int8)
+            return cls(vectors, scales)
+        return cls(normalized.astype(dtype))
+
+    @property
+    def dtype(self) -> str:
+        return self.vectors.dtype.name
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.vectors.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.vectors.nbytes + (0 if self.scales is None else self.scales.nbytes)
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    def __getitem__(self, rows) -> np.ndarray:
+        """Return the selected rows dequantized to float32."""
+        vectors = self.vectors[rows].astype(np.float32)
+        if self.scales is not None:
+            vectors *= self.scales[rows][..., None]
+        return vectors
+
+    def append(self, embeddings: np.ndarray) -> "EmbeddingMatrix":
+        """Return a matrix with raw model embeddings added after the current rows.
+
+        Storage is shared with this matrix, which stays valid and unchanged,
+        so appending does not copy the existing rows (beyond the amortized
+        cost of growing the buffer).
+        """
+        added = EmbeddingMatrix.from_embeddings(embeddings, self.dtype)
+        if self._vector_buffer is None or len(self._vector_buffer) != len(self):
+            # Not the newest matrix of its buffer: start a buffer of our own
+            self._vector_buffer = GrowableArray(self.vectors.dtype, self.vectors.shape[1:])
+            self._vector_buffer.extend(self.vectors)
+            if self.scales is not None:
+                self._scale_buffer = GrowableArray(np.float32)
+                self._scale_buffer.extend(self.scales)
+
+        scales = None
+        if self._scale_buffer is not None:
+            scales = self._scale_buffer.extend(added.scales)
+        matrix = EmbeddingMatrix(self._vector_buffer.extend(added.vectors), scales)
+        matrix._vector_buffer = self._vector_buffer
+        matrix._scale_buffer = self._scale_buffer
+        return matrix
+
+    def take(self, rows: np.ndarray) -> "EmbeddingMatrix":
+        """Return a new matrix holding the given rows in the same storage dtype."""
+        scales = None if self.scales is None else self.scales[rows]
+        return EmbeddingMatrix(self.vectors[rows], scales)
+
+    def scores(self, query: np.ndarray, start: int = 0, end: Optional[int] = None) -> np.ndarray:
+        """Return inner products of rows [start, end) with a normalized float32 query."""
+        end = len(self.vectors) if end is None else end
+        if self.vectors.dtype == np.float32:
+            return self.vectors[start:end] @ query
+
+        scores = np.empty(end - start, dtype=np.float32)
+        for block in range(start, end, self.BLOCK_ROWS):
+            block_end = min(block + self.BLOCK_ROWS, end)
+            scores[block - start:block_end - start] = self.vectors[block:block_end].astype(np.float32) @ query
+        if self.scales is not None:
+            scores *= self.scales[start:end]
+        return scores
+
+    def batch_scores(self, queries: np.ndarray, start: int = 0, end: Optional[int] = None) -> np.ndarray:
+        """Return the (n_queries, rows) inner products of rows [start, end) with normalized float32 queries."""
+        end = len(self.vectors) if end is None else end
+        if self.vectors.dtype == np.float32:
+            return queries @ self.vectors[start:end].T
+
+        scores = np.empty((len(queries), end - start), dtype=np.float32)
+        for block in range(start, end, self.BLOCK_ROWS):
+            block_end = min(block + self.BLOCK_ROWS, end)
+            scores[:, block - start:block_end - start] = queries @ self.vectors[block:block_end].astype(np.float32).T
+        if self.scales is not None:
+            scores *= self.scales[start:end]
+        return scores
+
+    def state(self, prefix: str) -> Dict[str, np.ndarray]:
+        """Return arrays for serialization under the given key prefix."""
+        state = {f"{prefix}vectors": self.vectors}
+        if self.scales is not None:
+            state[f"{prefix}scales"] = self.scales
+        return state
+
+    @classmethod
+    def from_state(cls, state: Dict[str, np.ndarray], prefix: str) -> "EmbeddingMatrix":
+        return cls(state[f"{prefix}vectors"], state.get(f"{prefix}scales"))
+
+
+class VectorIndex:
+    """Interface for nearest-neighbour search over an ``EmbeddingMatrix``.
+
+    Backends implement ``build`` and ``search`` and describe their persistent
+    state through ``_state``/``_restore`` so that ``save``/``load`` work for
+    every backend.
+    """
+
+    name = "base"
+
+    META_FILE = "index.json"
+
+    def __init__(self, **params):
+        self.params = params
+        self.fingerprint = None
+
+    def build(self, embeddings: EmbeddingMatrix):
+        """Build the index over the given (n_docs, dim) matrix."""
+        raise NotImplementedError
+
+    def search(self, query_embedding: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (row indices, scores) of the top_k rows for a normalized query, best first."""
+        raise NotImplementedError
+
+    def search_batch(self, query_embeddings: np.ndarray, top_k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Return ``search`` results for each row of a (n_queries, dim) matrix of normalized queries."""
+        return [self.search(query, top_k) for query in query_embeddings]
+
+    def extend(self, embeddings: EmbeddingMatrix) -> "VectorIndex":
+        """Return an index over ``embeddings``, whose leading rows are the ones already indexed.
+
+        The returned index is a new object, so searches running against this
+        one are unaffected.
+        """
+        raise NotImplementedError
+
+    def needs_rebuild(self) -> bool:
+        """Whether enough rows were added through ``extend`` to warrant a rebuild."""
+        return False
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def _state(self) -> Dict[str, np.ndarray]:
+        raise NotImplementedError
+
+    def _restore(self, state: Dict[str, np.ndarray]):
+        raise NotImplementedError
+
+    @staticmethod
+    def embeddings_fingerprint(embeddings: EmbeddingMatrix) -> str:
+        """Return a digest identifying the matrix an index was built from."""
+        digest = hashlib.sha256(f"{embeddings.shape}{embeddings.dtype}".encode("utf-8"))
+        digest.update(embeddings.vectors.data)
+        if embeddings.scales is not None:
+            digest.update(embeddings.scales.data)
+        return digest.hexdigest()
+
+    def save(self, path: str):
+        """Serialize the index to a directory holding one .npy file per array."""
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for key, array in self._state().items():
+            np.save(os.path.join(tmp_path, f"{key}.npy"), array)
+        with open(os.path.join(tmp_path, self.META_FILE), 'w', encoding='utf-8') as f:
+            json.dump({"backend": self.name, "params": self.params,
+                       "fingerprint": self.fingerprint}, f)
+        _replace_directory(tmp_path, path)
+
+    @staticmethod
+    def load(path: str, mmap: bool = True) -> "VectorIndex":
+        """Load an index previously written by ``save``.
+
+        Arrays are memory-mapped by default, so processes loading the same
+        index share its pages through the OS page cache.
+        """
+        with open(os.path.join(path, VectorIndex.META_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        index = INDEX_BACKENDS[meta["backend"]](**meta["params"])
+        index._restore({
+            name[:-len(".npy")]: np.load(os.path.join(path, name), mmap_mode='r' if mmap else None)
+            for name in os.listdir(path) if name.endswith(".npy")
+        })
+        index.fingerprint = meta["fingerprint"]
+        return index
+
+
+def _replace_directory(new_path: str, path: str):
+    """Move a freshly written directory into place, replacing any previous one.
+
+    Files of the old directory that are still memory-mapped stay readable
+    until they are unmapped.
+    """
+    old_path = path + ".old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(new_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def resolve_index_path(path: str) -> str:
+    """Return the artifact directory for ``path``.
+
+    ``path`` is either an artifact (a directory with a manifest.json) or an
+    esom_build_index.py output directory, whose ``current`` link is followed.
+    """
+    current = os.path.join(path, INDEX_CURRENT_LINK)
+    if not os.path.exists(os.path.join(path, "manifest.json")) and os.path.exists(current):
+        return os.path.realpath(current)
+    return path
+
+
+def _top_k(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Return indices of the top_k highest scores, best first.
+
+    Uses a linear-time partial selection and only sorts the k survivors.
+    """
+    if top_k >= len(scores):
+        return np.argsort(-scores, kind='stable')
+    candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+class ExactIndex(VectorIndex):
+    """Brute-force inner product search over every document.
+
+    ``build`` optionally restricts the search to sorted [start, end) row
+    ranges, which are scored in place; results are then positions within
+    the concatenated ranges. Restricted indexes are not meant to be saved.
+    """
+
+    name = "exact"
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        self.embeddings = None
+        self.ranges = None
+
+    def build(self, embeddings: EmbeddingMatrix, ranges: Optional[np.ndarray] = None):
+        self.embeddings = embeddings
+        self.ranges = ranges
+
+    def _blocks(self) -> Iterator[Tuple[int, int, int]]:
+        """Yield (start, end, position) of blocks of at most ``BLOCK_ROWS`` searched rows."""
+        ranges = [(0, len(self.embeddings))] if self.ranges is None else self.ranges
+        position = 0
+        for range_start, range_end in ranges:
+            for start in range(range_start, range_end, EmbeddingMatrix.BLOCK_ROWS):
+                end = min(start + EmbeddingMatrix.BLOCK_ROWS, range_end)
+                yield start, end, position
+                position += end - start
+
+    def extend(self, embeddings: EmbeddingMatrix) -> "ExactIndex":
+        index = ExactIndex(**self.params)
+        index.build(embeddings)
+        return index
+
+    def search(self, query_embedding: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if self.ranges is None:
+            similarities = self.embeddings.scores(query_embedding)
+        else:
+            similarities = np.concatenate([self.embeddings.scores(query_embedding, start, end)
+                                           for start, end in self.ranges] or [np.empty(0, dtype=np.float32)])
+        top_indices = _top_k(similarities, top_k)
+        return top_indices, similarities[top_indices]
+
+    def search_batch(self, query_embeddings: np.ndarray, top_k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Score all queries with one matrix-matrix product per block of rows.
+
+        Each block's top_k per query is merged into a running top_k, so the
+        score matrix never exceeds ``BLOCK_ROWS`` columns.
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        n_rows = len(self)
+        top_k = min(top_k, n_rows)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start, end, position in self._blocks():
+            scores = self.embeddings.batch_scores(queries, start, end)
+            k = min(top_k, end - start)
+            candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_rows = np.concatenate([best_rows, candidates + position], axis=1)
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, candidates, axis=1)], axis=1)
+            if best_rows.shape[1] > top_k:
+                keep = np.argpartition(-best_scores, top_k - 1, axis=1)[:, :top_k]
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        return list(zip(best_rows, best_scores))
+
+    def __len__(self) -> int:
+        if self.ranges is not None:
+            return int((self.ranges[:, 1] - self.ranges[:, 0]).sum())
+        return 0 if self.embeddings is None else len(self.embeddings)
+
+    def _state(self) -> Dict[str, np.ndarray]:
+        return self.embeddings.state("embeddings_")
+
+    def _restore(self, state: Dict[str, np.ndarray]):
+        self.embeddings = EmbeddingMatrix.from_state(state, "embeddings_")
+
+
+class IVFIndex(VectorIndex):
+    """Inverted-file index: k-means coarse quantizer plus per-cluster lists.
+
+    Documents are grouped by their nearest centroid; each cluster's row
+    numbers are stored contiguously, and its vectors are gathered from the
+    shared embedding matrix at query time rather than copied into the index.
+    A query scores the centroids, then only the ``n_probe`` closest
+    clusters, so the cost grows with ``N / n_lists * n_probe`` instead of
+    ``N``. ``n_lists`` defaults to ``4 * sqrt(N)``.
+
+    Rows added through ``extend`` are kept in an unclustered tail that is
+    scanned exhaustively until the index is rebuilt. A loaded index holds no
+    vectors and must be given its matrix through ``extend`` before searching.
+    """
+
+    # Tail size, relative to the clustered rows, at which a rebuild is due
+    REBUILD_TAIL_FRACTION = 0.1
+
+    name = "ivf"
+
+    def __init__(self, n_lists: Optional[int] = None, n_probe: int = 8,
+                 train_iterations: int = 10, seed: int = 0, **params):
+        super().__init__(n_lists=n_lists, n_probe=n_probe,
+                         train_iterations=train_iterations, seed=seed, **params)
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.train_iterations = train_iterations
+        self.seed = seed
+        self.centroids = None
+        self.list_offsets = None
+        self.list_ids = None
+        self.embeddings = None
+        self.tail_start = 0
+
+    @staticmethod
+    def _assign(vectors, centroids: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+        """Assign each vector to its nearest centroid (squared L2 distance)."""
+        half_norms = 0.5 * np.einsum('ij,ij->i', centroids, centroids)
+        assignments = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), batch_size):
+            batch = np.asarray(vectors[start:start + batch_size], dtype=np.float32)
+            assignments[start:start + batch_size] = np.argmax(batch @ centroids.T - half_norms, axis=1)
+        return assignments
+
+    def _train(self, embeddings: EmbeddingMatrix, n_lists: int) -> np.ndarray:
+        """Run Lloyd's k-means on a sample of the embeddings."""
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(len(embeddings), n_lists * 64)
+        sample_rows = np.sort(rng.choice(len(embeddings), sample_size, replace=False))
+        sample = embeddings[sample_rows]
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+
+        for _ in range(self.train_iterations):
+            assignments = self._assign(sample, centroids)
+            counts = np.bincount(assignments, minlength=n_lists)
+            filled = counts > 0
+            # Sum each cluster's members in one pass over the sorted sample
+            order = np.argsort(assignments, kind='stable')
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+            centroids[filled] = sums / counts[filled, None]
+            # Re-seed empty clusters from random sample points
+            empty = np.flatnonzero(~filled)
+            if len(empty):
+                centroids[empty] = sample[rng.choice(sample_size, len(empty), replace=False)]
+        return centroids
+
+    def build(self, embeddings: EmbeddingMatrix):
+        n_docs = len(embeddings)
+        self.embeddings = embeddings
+        self.tail_start = n_docs
+        if n_docs == 0:
+            # Nothing to cluster: every row added later goes to the tail
+            self.centroids = np.empty((0, embeddings.shape[1]), dtype=np.float32)
+            self.list_offsets = np.zeros(1, dtype=np.int64)
+            self.list_ids = np.empty(0, dtype=np.int64)
+            return
+
+        n_lists = self.n_lists or max(1, int(4 * np.sqrt(n_docs)))
+        n_lists = min(n_lists, n_docs)
+
+        self.centroids = self._train(embeddings, n_lists)
+        assignments = self._assign(embeddings, self.centroids)
+
+        # Lay out each cluster's row numbers contiguously (CSR-style offsets)
+        order = np.argsort(assignments, kind='stable')
+        counts = np.bincount(assignments, minlength=n_lists)
+        self.list_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        self.list_ids = order.astype(np.int64)
+
+    def extend(self, embeddings: EmbeddingMatrix) -> "IVFIndex":
+        index = copy.copy(self)
+        index.embeddings = embeddings
+        return index
+
+    def needs_rebuild(self) -> bool:
+        return self._tail_size() > self.REBUILD_TAIL_FRACTION * self.tail_start
+
+    def _tail_size(self) -> int:
+        return 0 if self.embeddings is None else len(self.embeddings) - self.tail_start
+
+    def search(self, query_embedding: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        query = np.asarray(query_embedding, dtype=np.float32)
+        centroid_scores = self.centroids @ query - 0.5 * np.einsum('ij,ij->i', self.centroids, self.centroids)
+        n_probe = min(self.n_probe, len(self.centroids))
+        probe = np.argpartition(centroid_scores, -n_probe)[-n_probe:] if n_probe else []
+
+        # Gather the probed clusters' rows from the shared matrix in one pass
+        ids = [self.list_ids[self.list_offsets[cluster]:self.list_offsets[cluster + 1]] for cluster in probe]
+        ids = np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+        scores = [self.embeddings.take(ids).scores(query)]
+        if self._tail_size() > 0:
+            ids = np.concatenate([ids, np.arange(self.tail_start, len(self.embeddings))])
+            scores.append(self.embeddings.scores(query, self.tail_start))
+        if not len(ids):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        scores = np.concatenate(scores)
+        best = _top_k(scores, top_k)
+        return ids[best], scores[best]
+
+    def __len__(self) -> int:
+        return (0 if self.list_ids is None else len(self.list_ids)) + self._tail_size()
+
+    def _state(self) -> Dict[str, np.ndarray]:
+        return {"centroids": self.centroids, "list_offsets": self.list_offsets, "list_ids": self.list_ids}
+
+    def _restore(self, state: Dict[str, np.ndarray]):
+        self.centroids = state["centroids"]
+        self.list_offsets = state["list_offsets"]
+        self.list_ids = state["list_ids"]
+        self.tail_start = len(self.list_ids)
+
+
+# Available vector index backends, selectable with --index-backend
+INDEX_BACKENDS = {
+    ExactIndex.name: ExactIndex,
+    IVFIndex.name: IVFIndex
+}
+
+
+def compare_index_backends(embeddings: EmbeddingMatrix, queries: np.ndarray, top_k: int = 10,
+                           backends: Optional[Dict[str, VectorIndex]] = None) -> Dict[str, Dict]:
+    """Measure recall@k and per-query latency of index backends against exact search.
+
+    ``backends`` maps a label to an already-built index; by default an IVF
+    index with default parameters is built over ``embeddings``. Queries are
+    normalized before searching.
+    """
+    queries = l2_normalize(queries)
+    exact = ExactIndex()
+    exact.build(embeddings)
+    if backends is None:
+        ivf = IVFIndex()
+        ivf.build(embeddings)
+        backends = {"ivf": ivf}
+
+    ground_truth = [set(exact.search(q, top_k)[0].tolist()) for q in queries]
+    results = {}
+    for label, index in [("exact", exact)] + list(backends.items()):
+        latencies = []
+        hits = 0
+        for query, truth in zip(queries, ground_truth):
+            start = time.perf_counter()
+            found, _ = index.search(query, top_k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits += len(truth.intersection(found.tolist()))
+        latencies = np.array(latencies)
+        results[label] = {
+            "params": index.params,
+            # Fewer than top_k rows may exist, so recall is relative to what exact search found
+            f"recall@{top_k}": hits / max(1, sum(len(truth) for truth in ground_truth)),
+            "latency_ms_mean": float(latencies.mean()),
+            "latency_ms_p50": float(np.percentile(latencies, 50)),
+            "latency_ms_p99": float(np.percentile(latencies, 99))
+        }
+    return results
+
+
+# Word tokens, keeping figures such as "5.25%", "1,000" or "usd/inr" in one piece
+TOKEN_PATTERN = re.compile(r"\w+(?:[.,/&]\w+)*%?")
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase tokens for lexical retrieval."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """Okapi BM25 over chunk rows with postings in compact CSR arrays.
+
+    Postings are grouped by term id in flat arrays: ``offsets`` delimits
+    each term's slice of ``rows`` (int32) and ``tfs`` (uint16 term
+    frequencies). Rows added through ``extend`` go to an unsorted tail that
+    is scanned with vectorized comparisons until ``rebuild`` merges it into
+    the CSR arrays. The vocabulary only grows and is shared by every
+    version of the index, so a search never sees a term id it cannot handle.
+
+    ``max_df_fraction`` optionally skips query terms occurring in more than
+    that fraction of rows, saving their long postings scans on large
+    corpora; by default every term is scored.
+    """
+
+    name = "bm25"
+
+    META_FILE = "index.json"
+
+    # Rebuild once the tail holds this fraction of the sorted postings
+    REBUILD_TAIL_FRACTION = 0.1
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, max_df_fraction: Optional[float] = None):
+        self.k1 = k1
+        self.b = b
+        self.max_df_fraction = max_df_fraction
+        self.vocabulary = {}
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.rows = np.empty(0, dtype=np.int32)
+        self.tfs = np.empty(0, dtype=np.uint16)
+        self.tail_terms = np.empty(0, dtype=np.int32)
+        self.tail_rows = np.empty(0, dtype=np.int32)
+        self.tail_tfs = np.empty(0, dtype=np.uint16)
+        self.lengths = np.empty(0, dtype=np.int32)
+        self.norms = np.empty(0, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def postings(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Tokenize texts into (term ids, text positions, term frequencies, token counts).
+
+        New terms are added to the vocabulary. The result is passed to
+        ``extend`` once the texts' rows should become searchable.
+        """
+        vocabulary = self.vocabulary
+        terms, positions, tfs, lengths = [], [], [], []
+        for position, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            for token, count in Counter(tokens).items():
+                term = vocabulary.get(token)
+                if term is None:
+                    term = vocabulary[token] = len(vocabulary)
+                terms.append(term)
+                positions.append(position)
+                tfs.append(min(count, np.iinfo(np.uint16).max))
+        return (np.array(terms, dtype=np.int32), np.array(positions, dtype=np.int32),
+                np.array(tfs, dtype=np.uint16), np.array(lengths, dtype=np.int32))
+
+    def extend(self, batches: List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]) -> "BM25Index":
+        """Return an index with the rows of ``postings`` batches appended after the current rows.
+
+        The returned index is a new object, so searches running against this
+        one are unaffected.
+        """
+        terms, rows, tfs, lengths = [self.tail_terms], [self.tail_rows], [self.tail_tfs], [self.lengths]
+        base = len(self)
+        for batch_terms, positions, batch_tfs, batch_lengths in batches:
+            terms.append(batch_terms)
+            rows.append(positions + np.int32(base))
+            tfs.append(batch_tfs)
+            lengths.append(batch_lengths)
+            base += len(batch_lengths)
+
+        index = copy.copy(self)
+        index.tail_terms = np.concatenate(terms)
+        index.tail_rows = np.concatenate(rows)
+        index.tail_tfs = np.concatenate(tfs)
+        index.lengths = np.concatenate(lengths)
+        index._update_norms()
+        return index
+
+    def needs_rebuild(self) -> bool:
+        """Whether the tail has grown large enough to merge into the sorted postings."""
+        return len(self.tail_terms) > self.REBUILD_TAIL_FRACTION * len(self.rows)
+
+    def rebuild(self) -> "BM25Index":
+        """Return an index with the tail merged into the CSR arrays."""
+        n_terms = len(self.offsets) - 1
+        sorted_terms = np.repeat(np.arange(n_terms, dtype=np.int32), np.diff(self.offsets))
+        terms = np.concatenate([sorted_terms, self.tail_terms])
+        order = np.argsort(terms, kind='stable')
+        counts = np.bincount(terms, minlength=n_terms)
+
+        index = copy.copy(self)
+        index.offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=index.offsets[1:])
+        index.rows = np.concatenate([self.rows, self.tail_rows])[order]
+        index.tfs = np.concatenate([self.tfs, self.tail_tfs])[order]
+        index.tail_terms = np.empty(0, dtype=np.int32)
+        index.tail_rows = np.empty(0, dtype=np.int32)
+        index.tail_tfs = np.empty(0, dtype=np.uint16)
+        return index
+
+    def _update_norms(self):
+        """Precompute each row's length normalization ``k1 * (1 - b + b * len / avg_len)``."""
+        average_length = float(self.lengths.mean()) if len(self.lengths) else 0.0
+        relative = self.lengths / average_length if average_length > 0 else np.ones(len(self.lengths))
+        self.norms = (self.k1 * (1 - self.b + self.b * relative)).astype(np.float32)
+
+    def search(self, query: str, top_k: int, rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (row indices, BM25 scores) of the top_k rows matching the query, best first.
+
+        ``rows`` optionally restricts the result to a sorted array of allowed rows.
+        """
+        allowed = rows
+        n_rows = len(self)
+        n_terms = len(self.offsets) - 1
+        matched_rows, weights = [], []
+        for token in set(tokenize(query)):
+            term = self.vocabulary.get(token)
+            if term is None:
+                continue
+            rows = tfs = None
+            if term < n_terms:
+                start, end = self.offsets[term], self.offsets[term + 1]
+                rows, tfs = self.rows[start:end], self.tfs[start:end]
+            if len(self.tail_terms):
+                in_tail = self.tail_terms == term
+                if in_tail.any():
+                    tail_rows, tail_tfs = self.tail_rows[in_tail], self.tail_tfs[in_tail]
+                    rows = tail_rows if rows is None else np.concatenate([rows, tail_rows])
+                    tfs = tail_tfs if tfs is None else np.concatenate([tfs, tail_tfs])
+            if rows is None or not len(rows):
+                continue
+            if self.max_df_fraction is not None and len(rows) > self.max_df_fraction * n_rows:
+                continue
+
+            df = len(rows)
+            idf = np.log1p((n_rows - df + 0.5) / (df + 0.5))
+            tfs = tfs.astype(np.float32)
+            matched_rows.append(rows)
+            weights.append(idf * tfs * (self.k1 + 1) / (tfs + self.norms[rows]))
+
+        if not matched_rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows, inverse = np.unique(np.concatenate(matched_rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(weights))
+        if allowed is not None:
+            positions = np.searchsorted(allowed, rows)
+            keep = positions < len(allowed)
+            keep[keep] = allowed[positions[keep]] == rows[keep]
+            rows, scores = rows[keep], scores[keep]
+        top = _top_k(scores, top_k)
+        return rows[top].astype(np.int64), scores[top].astype(np.float32)
+
+    def save(self, path: str):
+        """Serialize the index to a directory holding one .npy file per array."""
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for key in ("offsets", "rows", "tfs", "tail_terms", "tail_rows", "tail_tfs", "lengths", "norms"):
+            np.save(os.path.join(tmp_path, f"{key}.npy"), getattr(self, key))
+        vocabulary = sorted(self.vocabulary, key=self.vocabulary.get)
+        with open(os.path.join(tmp_path, self.META_FILE), 'w', encoding='utf-8') as f:
+            json.dump({"backend": self.name,
+                       "params": {"k1": self.k1, "b": self.b, "max_df_fraction": self.max_df_fraction},
+                       "vocabulary": vocabulary}, f)
+        _replace_directory(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "BM25Index":
+        """Load an index previously written by ``save``, memory-mapping its arrays by default."""
+        with open(os.path.join(path, cls.META_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        index = cls(**meta["params"])
+        index.vocabulary = {term: i for i, term in enumerate(meta["vocabulary"])}
+        for key in ("offsets", "rows", "tfs", "tail_terms", "tail_rows", "tail_tfs", "lengths", "norms"):
+            setattr(index, key, np.load(os.path.join(path, f"{key}.npy"), mmap_mode='r' if mmap else None))
+        return index
+
+
+class EmbeddingBatcher:
+    """Background scheduler that coalesces concurrent query encodes into batches.
+
+    Callers block in ``encode`` while a worker thread collects queued texts
+    for up to ``window_ms`` milliseconds (or until ``max_batch_size`` texts
+    are waiting), encodes them with a single model call and hands each
+    caller its own row.
+    """
+
+    # Upper bounds of the batch size histogram buckets
+    BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+    def __init__(self, encode_fn, window_ms: float = 5.0, max_batch_size: int = 32):
+        self.encode_fn = encode_fn
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batch_sizes = {bucket: 0 for bucket in self.BATCH_SIZE_BUCKETS}
+        self._batch_sizes["+Inf"] = 0
+        self._batches = 0
+        self._requests = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+    def encode(self, text: str, timeout: Optional[float] = None) -> np.ndarray:
+        """Encode a single text through the shared batch and return its embedding."""
+        if self._closed:
+            raise RuntimeError("Embedding batcher is closed")
+        future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future.result(timeout=timeout)
+
+    def close(self):
+        """Stop the worker thread once the queued requests have been served."""
+        self._closed = True
+        self._queue.put(None)
+        self._worker.join()
+
+    def _collect(self) -> List[Tuple[str, Future, float]]:
+        """Block for the first request, then gather more until the window closes."""
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Re-queue the shutdown marker for the next collection round
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if not batch:
+                return
+
+            started = time.perf_counter()
+            self._record(len(batch), [started - enqueued for _, _, enqueued in batch])
+            try:
+                embeddings = self.encode_fn([text for text, _, _ in batch])
+                for i, (_, future, _) in enumerate(batch):
+                    future.set_result(embeddings[i])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+
+    def _record(self, batch_size: int, waits: List[float]):
+        with self._lock:
+            self._batches += 1
+            self._requests += batch_size
+            self._wait_total += sum(waits)
+            self._wait_max = max(self._wait_max, max(waits))
+            for bucket in self.BATCH_SIZE_BUCKETS:
+                if batch_size <= bucket:
+                    self._batch_sizes[bucket] += 1
+                    break
+            else:
+                self._batch_sizes["+Inf"] += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        """Return queue depth, batch size histogram and queue wait statistics."""
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "window_ms": self.window * 1000,
+                "max_batch_size": self.max_batch_size,
+                "batches": self._batches,
+                "requests": self._requests,
+                "mean_batch_size": self._requests / self._batches if self._batches else 0.0,
+                "batch_size_histogram": {str(bucket): count for bucket, count in self._batch_sizes.items()},
+                "wait_ms_mean": self._wait_total / self._requests * 1000 if self._requests else 0.0,
+                "wait_ms_max": self._wait_max * 1000
+            }
+
+
+def normalize_query(query: str) -> str:
+    """Canonical form of a query used as a cache key."""
+    return " ".join(query.lower().split()).rstrip("?!. ")
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache with hit/miss accounting."""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def discard_where(self, predicate: Callable[[Any], bool]) -> int:
+        """Remove the entries whose value satisfies ``predicate``; return how many."""
+        with self._lock:
+            stale = [key for key, value in self._data.items() if predicate(value)]
+            for key in stale:
+                del self._data[key]
+            return len(stale)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return size, hit rate and eviction counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions
+            }
+
+
+class TTLCache(LRUCache):
+    """LRU cache whose entries also expire ``ttl`` seconds after insertion."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        super().__init__(maxsize)
+        self.ttl = ttl
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.ttl <= 0:
+            return
+        super().put(key, (time.monotonic() + self.ttl, value))
+
+    def discard_where(self, predicate: Callable[[Any], bool]) -> int:
+        return super().discard_where(lambda entry: predicate(entry[1]))
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats["ttl_seconds"] = self.ttl
+        stats["expirations"] = self.expirations
+        return stats
+
+
+class LatencyHistogram:
+    """Cumulative latency histogram with Prometheus-style bucket bounds (seconds)."""
+
+    BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+               0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self._counts = [0] * (len(self.BUCKETS) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        bucket = bisect.bisect_left(self.BUCKETS, seconds)
+        with self._lock:
+            self._counts[bucket] += 1
+            self._sum += seconds
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        """Return (cumulative counts per bucket including +Inf, sum, count)."""
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        cumulative = list(itertools.accumulate(counts))
+        return cumulative, total, cumulative[-1]
+
+
+class StageLatency:
+    """Latency histograms of the named stages of the chat pipeline.
+
+    Callers time a stage with ``time.perf_counter`` and report it through
+    ``observe``, which costs a bisect and an uncontended lock.
+    """
+
+    STAGES = ("encode", "search", "glossary", "market", "synthesis", "first_token", "serialization", "request")
+
+    def __init__(self):
+        self.histograms = {stage: LatencyHistogram() for stage in self.STAGES}
+
+    def observe(self, stage: str, seconds: float):
+        self.histograms[stage].observe(seconds)
+
+
+class SamplingProfiler:
+    """Statistical profiler that samples every thread's stack at a fixed interval.
+
+    While running, a daemon thread collects the stacks of all other threads
+    from ``sys._current_frames`` and counts them in folded form
+    ("thread;module.function;... count"), which flame graph tools read
+    directly. It can be started and stopped at runtime; when stopped it
+    costs nothing.
+    """
+
+    MAX_DEPTH = 64
+
+    def __init__(self):
+        self.interval = 0.01
+        self.samples = 0
+        self._stacks = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float = 0.01, reset: bool = True):
+        """Start sampling every ``interval`` seconds (restarting if already running)."""
+        self.stop()
+        with self._lock:
+            if reset:
+                self._stacks.clear()
+                self.samples = 0
+        self.interval = interval
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                functions = []
+                while frame is not None and len(functions) < self.MAX_DEPTH:
+                    code = frame.f_code
+                    functions.append(f"{frame.f_globals.get('__name__', '?')}.{code.co_name}")
+                    frame = frame.f_back
+                stacks.append(";".join([names.get(thread_id, str(thread_id))] + functions[::-1]))
+            with self._lock:
+                self._stacks.update(stacks)
+                self.samples += 1
+
+    def folded(self, limit: Optional[int] = None) -> str:
+        """Return the collected stacks in folded format, most frequent first."""
+        with self._lock:
+            stacks = self._stacks.most_common(limit)
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton for whole-word, longest-match keyword search.
+
+    The automaton is compiled once from the patterns; scanning a text is a
+    single pass whose cost depends on the text length and the number of
+    matches, not on how many patterns were compiled. Matches must start and
+    end on word boundaries, so "gdp" does not match inside "gdpr". With
+    ``plurals`` a pattern may also end one plural "s" before the boundary,
+    so "interest rate" matches "interest rates".
+    """
+
+    def __init__(self, patterns, plurals: bool = False):
+        # Node 0 is the root; each node has goto edges, a failure link, the
+        # pattern ending there (if any) and a link to the next node on its
+        # failure chain that ends a pattern
+        self._goto = [{}]
+        self._fail = [0]
+        self._pattern = [None]
+        self._output = [0]
+        self.size = 0
+        self.plurals = plurals
+
+        for pattern in patterns:
+            if pattern:
+                self._add(pattern)
+        self._compile()
+
+    def _add(self, pattern: str):
+        node = 0
+        for ch in pattern:
+            next_node = self._goto[node].get(ch)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][ch] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._pattern.append(None)
+                self._output.append(0)
+            node = next_node
+        if self._pattern[node] is None:
+            self.size += 1
+        self._pattern[node] = pattern
+
+    def _compile(self):
+        """Compute failure and output links breadth-first."""
+        pending = deque(self._goto[0].values())
+        while pending:
+            node = pending.popleft()
+            for ch, child in self._goto[node].items():
+                pending.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0)
+                target = self._fail[child]
+                self._output[child] = target if self._pattern[target] is not None else self._output[target]
+
+    @staticmethod
+    def _is_word_char(ch: str) -> bool:
+        return ch.isalnum() or ch == "_"
+
+    def find_all(self, text: str) -> List[Tuple[int, int, str]]:
+        """Return every whole-word match as (start, end, pattern)."""
+        matches = []
+        goto, fail, pattern_at, output = self._goto, self._fail, self._pattern, self._output
+        node = 0
+        for end, ch in enumerate(text, 1):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+
+            match_node = node if pattern_at[node] is not None else output[node]
+            if not match_node:
+                continue
+            match_end = end
+            if end < len(text) and self._is_word_char(text[end]):
+                # Only a plural "s" may follow a pattern within the word
+                if not (self.plurals and text[end] == "s"
+                        and (end + 1 == len(text) or not self._is_word_char(text[end + 1]))):
+                    continue
+                match_end = end + 1
+            while match_node:
+                pattern = pattern_at[match_node]
+                start = end - len(pattern)
+                if start == 0 or not self._is_word_char(text[start - 1]):
+                    matches.append((start, match_end, pattern))
+                match_node = output[match_node]
+        return matches
+
+    def find(self, text: str, limit: Optional[int] = None) -> List[str]:
+        """Return distinct non-overlapping matched patterns, longest first."""
+        return self._select(self.find_all(text), limit)
+
+    def find_batch(self, texts: List[str], limit: Optional[int] = None) -> List[List[str]]:
+        """Return ``find`` for each text, scanning the whole batch in one pass.
+
+        The texts are joined with newlines, which are not word characters,
+        so no match can span two texts.
+        """
+        starts = [0]
+        for text in texts[:-1]:
+            starts.append(starts[-1] + len(text) + 1)
+        matches = [[] for _ in texts]
+        for match in self.find_all("\n".join(texts)):
+            matches[bisect.bisect_right(starts, match[0]) - 1].append(match)
+        return [self._select(text_matches, limit) for text_matches in matches]
+
+    @staticmethod
+    def _select(matches: List[Tuple[int, int, str]], limit: Optional[int] = None) -> List[str]:
+        # Leftmost-longest, like a regex alternation of the patterns: take the
+        # longest match at the leftmost start, skip past it and repeat
+        found = []
+        covered = 0
+        for start, end, pattern in sorted(matches, key=lambda m: (m[0], m[0] - m[1])):
+            if start < covered:
+                continue
+            covered = end
+            if pattern not in found:
+                found.append(pattern)
+        found.sort(key=len, reverse=True)
+        return found if limit is None else found[:limit]
+
+    def __len__(self) -> int:
+        return self.size
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the compiled automaton as JSON-serializable lists."""
+        return {"goto": self._goto, "fail": self._fail, "pattern": self._pattern, "output": self._output,
+                "plurals": self.plurals}
+
+    @classmethod
+    def from_dict(cls, state: Dict[str, Any]) -> "KeywordMatcher":
+        """Rebuild a matcher from ``to_dict`` output without recompiling it."""
+        matcher = cls([], plurals=state.get("plurals", False))
+        matcher._goto = state["goto"]
+        matcher._fail = state["fail"]
+        matcher._pattern = state["pattern"]
+        matcher._output = state["output"]
+        matcher.size = sum(pattern is not None for pattern in matcher._pattern)
+        return matcher
+
+
+def _freeze(value):
+    """Recursively wrap dicts in read-only mapping proxies."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    return value
+
+
+class MarketSnapshot:
+    """Immutable, versioned view of market_data.json.
+
+    Readers grab ``rag.market`` once per request and use that object for
+    the whole request, so a concurrent reload never mixes figures from two
+    versions of the file. The keyword routes are resolved to their figures
+    and compiled into one ``KeywordMatcher`` when the snapshot is built, so
+    a lookup is a single scan of the query however many instruments exist.
+    """
+
+    __slots__ = ("version", "market_data", "trends", "loaded_at", "_figures", "_routes_by_keyword", "_matcher")
+
+    def __init__(self, version: int, market_data: Dict, trends: Dict, routes: Optional[List[Dict]] = None):
+        self.version = version
+        self.market_data = _freeze(market_data)
+        self.trends = _freeze(trends)
+        self.loaded_at = datetime.now().isoformat()
+        self._compile_routes(DEFAULT_MARKET_ROUTES if routes is None else routes)
+
+    @classmethod
+    def from_file(cls, file_path: str, version: int) -> "MarketSnapshot":
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(version, data.get("market_data", {}), data.get("trends", {}), data.get("routes"))
+
+    def _compile_routes(self, routes: List[Dict]):
+        sections = {"market_data": self.market_data, "trends": self.trends}
+        figures = []
+        routes_by_keyword = {}
+
+        def add(name, value, keywords):
+            for keyword in keywords:
+                keyword = " ".join(str(keyword).lower().split())
+                if keyword:
+                    routes_by_keyword.setdefault(keyword, []).append(len(figures))
+            figures.append((name, value))
+
+        for route in routes:
+            if "name" not in route:
+                raise ValueError(f"Market data route without a name: {route}")
+            value = sections
+            for key in route.get("path", ()):
+                value = value.get(key) if isinstance(value, Mapping) else None
+            add(route["name"], "Data not available" if value is None else value,
+                route.get("keywords", [route["name"]]))
+
+        # Instruments without an explicit route are asked for by name
+        routed = {name for name, _ in figures}
+        for instruments in self.market_data.values():
+            if isinstance(instruments, Mapping):
+                for name, value in instruments.items():
+                    if name not in routed:
+                        add(name, value, [name])
+
+        self._figures = tuple(figures)
+        self._routes_by_keyword = MappingProxyType({keyword: tuple(indices)
+                                                    for keyword, indices in routes_by_keyword.items()})
+        # Plural forms ("interest rates", "stock markets") ask for the same figures
+        self._matcher = KeywordMatcher(routes_by_keyword, plurals=True)
+
+    def lookup(self, query: str) -> Dict:
+        """Return {name: figure} for the instruments the query mentions, in route order."""
+        return self._figures_for(self._matcher.find(" ".join(query.lower().split())))
+
+    def lookup_batch(self, queries: List[str]) -> List[Dict]:
+        """Return ``lookup`` for each query, matching the whole batch in one automaton pass."""
+        keywords = self._matcher.find_batch([" ".join(query.lower().split()) for query in queries])
+        return [self._figures_for(query_keywords) for query_keywords in keywords]
+
+    def _figures_for(self, keywords: List[str]) -> Dict:
+        routes = set()
+        for keyword in keywords:
+            routes.update(self._routes_by_keyword[keyword])
+        return {self._figures[i][0]: self._figures[i][1] for i in sorted(routes)}
+
+
+class MarketDataWatcher:
+    """Poll a file and call ``on_change`` from a background thread when it changes.
+
+    A change is a different (inode, size, mtime) triple, which catches both
+    in-place rewrites and atomic rename-over updates. Errors raised by the
+    callback are logged and the file is retried on its next change.
+    """
+
+    def __init__(self, file_path: str, on_change: Callable[[], None], interval: float = 2.0):
+        self.file_path = file_path
+        self.on_change = on_change
+        self.interval = interval
+        self._signature = self._stat()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="market-data-watcher", daemon=True)
+        self._thread.start()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.file_path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            signature = self._stat()
+            if signature is None or signature == self._signature:
+                continue
+            self._signature = signature
+            try:
+                self.on_change()
+            except Exception as e:
+                logger.error(f"Error reloading {self.file_path}: {e}")
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def _parse_jsonl_lines(lines: List[str]) -> List[Dict]:
+    """Parse a batch of JSONL lines."""
+    return [json.loads(line) for line in lines if line.strip()]
+
+
+def document_id(doc: Dict) -> str:
+    """Return the document's ``id``, deriving a stable one from its source, title and content."""
+    if doc.get("id"):
+        return str(doc["id"])
+    key = "\n".join([doc.get("source", ""), doc.get("title", ""), doc.get("content", "")])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def shard_of(doc: Dict, shard_count: int, shard_key: str = "hash") -> int:
+    """Return the shard (0 to shard_count - 1) of a document whose ``source`` and ``id`` are set."""
+    if shard_key == "source":
+        return DOCUMENT_TYPES.index(doc["source"]) % shard_count
+    return int.from_bytes(hashlib.sha1(doc["id"].encode("utf-8")).digest()[:8], "big") % shard_count
+
+
+class DocumentStore:
+    """Columnar, append-only document store backed by a memory-mapped blob.
+
+    Each document costs a few fixed-width array slots: an interned source
+    code, a parsed date, a 64-bit hash of its ID and three offsets into a
+    single blob file. The blob holds the UTF-8 content followed by a small
+    JSON record of the remaining fields (ID, title, date and any extra
+    metadata), which is only decoded when a field is read.
+
+    A store written with ``save`` can be reopened ``read_only``: every
+    column and the blob are then memory-mapped and ``append`` is refused.
+    A writable store replaces (rather than truncates) the blob file and maps
+    it through its own descriptor, so other instances and processes that
+    have the previous blob mapped keep reading valid data.
+    """
+
+    BLOB_FILE = "content.bin"
+    COLUMNS = ("source_codes", "dates", "id_hashes", "offsets")
+
+    def __init__(self, directory: str, sources: List[str] = DOCUMENT_TYPES, read_only: bool = False):
+        self.read_only = read_only
+        self._blob_path = os.path.join(directory, self.BLOB_FILE)
+        if read_only:
+            self._open(directory)
+            return
+
+        self.sources = list(sources)
+        self._source_codes = {source: code for code, source in enumerate(self.sources)}
+        os.makedirs(directory, exist_ok=True)
+        # Unlink instead of truncating: truncating a mapped file raises SIGBUS in its readers
+        if os.path.lexists(self._blob_path):
+            os.unlink(self._blob_path)
+        self._blob_file = open(self._blob_path, 'w+b')
+        self._blob_size = 0
+        self._blob = np.empty(0, dtype=np.uint8)
+
+        self._source_buffer = GrowableArray(np.uint8)
+        self._date_buffer = GrowableArray('datetime64[D]')
+        self._id_hash_buffer = GrowableArray(np.int64)
+        self._offset_buffer = GrowableArray(np.int64, (3,))
+        self.source_codes = self._source_buffer.view
+        self.dates = self._date_buffer.view
+        self.id_hashes = self._id_hash_buffer.view
+        self.offsets = self._offset_buffer.view
+
+    def _open(self, directory: str):
+        """Memory-map a store previously written by ``save``."""
+        with open(os.path.join(directory, "sources.json"), 'r', encoding='utf-8') as f:
+            self.sources = json.load(f)
+        self._source_codes = {source: code for code, source in enumerate(self.sources)}
+        self._blob_size = os.path.getsize(self._blob_path)
+        self._blob = (np.memmap(self._blob_path, dtype=np.uint8, mode='r')
+                      if self._blob_size else np.empty(0, dtype=np.uint8))
+        for column in self.COLUMNS:
+            setattr(self, column, np.load(os.path.join(directory, f"{column}.npy"), mmap_mode='r'))
+
+    def save(self, directory: str):
+        """Write the blob and columns to a directory that can be opened ``read_only``."""
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, self.BLOB_FILE), 'wb') as dst:
+            for start in range(0, self._blob_size, 1 << 24):
+                dst.write(self._blob[start:start + (1 << 24)].tobytes())
+        for column in self.COLUMNS:
+            np.save(os.path.join(directory, f"{column}.npy"), getattr(self, column))
+        with open(os.path.join(directory, "sources.json"), 'w', encoding='utf-8') as f:
+            json.dump(self.sources, f)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    @staticmethod
+    def hash_id(doc_id: str) -> int:
+        """Return the 64-bit hash stored for a document ID."""
+        return int.from_bytes(hashlib.sha1(doc_id.encode("utf-8")).digest()[:8], 'little', signed=True)
+
+    @staticmethod
+    def _parse_date(value) -> np.datetime64:
+        try:
+            return np.datetime64(str(value)[:10], 'D')
+        except ValueError:
+            return np.datetime64('NaT', 'D')
+
+    def append(self, documents: List[Dict]) -> int:
+        """Append documents (which must carry an ``id``) and return the first new row."""
+        if self.read_only:
+            raise RuntimeError("Document store is read-only")
+        base = len(self)
+        parts = []
+        offsets = np.empty((len(documents), 3), dtype=np.int64)
+        position = self._blob_size
+        for i, doc in enumerate(documents):
+            content = doc.get("content", "").encode("utf-8")
+            meta = json.dumps({k: v for k, v in doc.items() if k not in ("content", "source")}).encode("utf-8")
+            offsets[i] = (position, position + len(content), position + len(content) + len(meta))
+            position = offsets[i, 2]
+            parts.append(content)
+            parts.append(meta)
+
+        self._blob_file.write(b"".join(parts))
+        self._blob_file.flush()
+        self._blob_size = int(position)
+        if self._blob_size:
+            # Map the open file rather than the path, which a newer store may have replaced
+            self._blob = np.memmap(self._blob_file, dtype=np.uint8, mode='r', shape=(self._blob_size,))
+
+        # Publish the blob before the offsets that point into it
+        self.source_codes = self._source_buffer.extend([self._source_codes[doc["source"]] for doc in documents])
+        self.dates = self._date_buffer.extend([self._parse_date(doc.get("date")) for doc in documents])
+        self.id_hashes = self._id_hash_buffer.extend([self.hash_id(doc["id"]) for doc in documents])
+        self.offsets = self._offset_buffer.extend(offsets)
+        return base
+
+    def _read(self, start: int, end: int) -> str:
+        return bytes(self._blob[start:end]).decode("utf-8")
+
+    def content(self, row: int, start: int = 0, end: Optional[int] = None) -> str:
+        """Return a document's content, or the byte range [start, end) of it."""
+        content_start, content_end, _ = self.offsets[row]
+        end = content_end - content_start if end is None else end
+        return self._read(content_start + start, content_start + end)
+
+    def metadata(self, row: int) -> Dict:
+        """Return every stored field of a document except content and source."""
+        _, meta_start, meta_end = self.offsets[row]
+        return json.loads(self._read(meta_start, meta_end))
+
+    def source(self, row: int) -> str:
+        return self.sources[self.source_codes[row]]
+
+    def find(self, doc_id: str) -> List[int]:
+        """Return the rows stored under a document ID, oldest first."""
+        rows = np.flatnonzero(self.id_hashes == self.hash_id(doc_id))
+        return [int(row) for row in rows if self.metadata(row).get("id") == doc_id]
+
+    def view(self, row: int) -> "DocumentView":
+        return DocumentView(self, row)
+
+
+class MetadataIndex:
+    """Source and date lookups over chunk rows for filtered retrieval.
+
+    Chunks of one source are mostly contiguous (files are loaded one source
+    at a time), so each source maps to a short list of [start, end) row
+    ranges. Dated chunks are kept in a date-sorted array, so a date range is
+    two binary searches. ``select`` therefore only touches matching rows.
+    """
+
+    def __init__(self, sources: List[str]):
+        self.sources = list(sources)
+        self.source_ranges = {}
+        self.chunk_sources = np.empty(0, dtype=np.uint8)
+        self.dates = np.empty(0, dtype='datetime64[D]')
+        self.date_rows = np.empty(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.chunk_sources)
+
+    def extend(self, source_codes: np.ndarray, dates: np.ndarray) -> "MetadataIndex":
+        """Return an index covering new chunk rows with the given source codes and dates.
+
+        The returned index is a new object, so lookups running against this
+        one are unaffected.
+        """
+        base = len(self)
+        source_codes = np.asarray(source_codes, dtype=np.uint8)
+        dates = np.asarray(dates, dtype='datetime64[D]')
+
+        index = copy.copy(self)
+        index.chunk_sources = np.concatenate([self.chunk_sources, source_codes])
+
+        # Run-length encode the new rows, merging with a range ending at ``base``
+        source_ranges = {code: [tuple(r) for r in ranges] for code, ranges in self.source_ranges.items()}
+        run_starts = np.flatnonzero(np.diff(source_codes.astype(np.int16), prepend=-1) != 0) if len(source_codes) else []
+        run_ends = list(run_starts[1:]) + [len(source_codes)]
+        for start, end in zip(run_starts, run_ends):
+            ranges = source_ranges.setdefault(int(source_codes[start]), [])
+            if ranges and ranges[-1][1] == base + start:
+                ranges[-1] = (ranges[-1][0], base + int(end))
+            else:
+                ranges.append((base + int(start), base + int(end)))
+        index.source_ranges = {code: np.array(ranges, dtype=np.int64) for code, ranges in source_ranges.items()}
+
+        # Merge the dated new rows into the sorted date index
+        dated = np.flatnonzero(~np.isnat(dates))
+        order = np.argsort(dates[dated], kind='stable')
+        new_dates, new_rows = dates[dated][order], dated[order] + base
+        positions = np.searchsorted(self.dates, new_dates, side='right')
+        index.dates = np.insert(self.dates, positions, new_dates)
+        index.date_rows = np.insert(self.date_rows, positions, new_rows)
+        return index
+
+    def ranges(self, sources: List[str]) -> np.ndarray:
+        """Return the sorted, disjoint [start, end) chunk row ranges of the given sources as an (n, 2) array."""
+        ranges = [(int(start), int(end)) for source in sources
+                  for start, end in self.source_ranges.get(self.sources.index(source), ())]
+        return np.array(sorted(ranges), dtype=np.int64).reshape(-1, 2)
+
+    def select(self, sources: Optional[List[str]] = None, date_from: Optional[np.datetime64] = None,
+               date_to: Optional[np.datetime64] = None) -> np.ndarray:
+        """Return the sorted chunk rows matching every given filter (dates inclusive)."""
+        if date_from is None and date_to is None:
+            ranges = self.ranges(sources)
+            if not len(ranges):
+                return np.empty(0, dtype=np.int64)
+            return np.concatenate([np.arange(start, end) for start, end in ranges])
+
+        codes = None if sources is None else [self.sources.index(source) for source in sources]
+        lo = 0 if date_from is None else np.searchsorted(self.dates, date_from, side='left')
+        hi = len(self.dates) if date_to is None else np.searchsorted(self.dates, date_to, side='right')
+        rows = self.date_rows[lo:hi]
+        if codes is not None:
+            rows = rows[np.isin(self.chunk_sources[rows], codes)]
+        return np.sort(rows)
+
+
+class DocumentView:
+    """Read-only, dict-like view of one stored document; fields are decoded on access."""
+
+    __slots__ = ("_store", "row")
+
+    def __init__(self, store: DocumentStore, row: int):
+        self._store = store
+        self.row = row
+
+    def __getitem__(self, key: str):
+        if key == "content":
+            return self._store.content(self.row)
+        if key == "source":
+            return self._store.source(self.row)
+        return self._store.metadata(self.row)[key]
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key: str) -> bool:
+        return key in ("content", "source") or key in self._store.metadata(self.row)
+
+    def to_dict(self) -> Dict:
+        doc = self._store.metadata(self.row)
+        doc["source"] = self._store.source(self.row)
+        doc["content"] = self._store.content(self.row)
+        return doc
+
+
+class RetrievedDocument:
+    """A retrieval hit: a view of the parent document, the matching chunk and its score.
+
+    Behaves like a read-only dict of the document's fields plus ``chunk``,
+    ``chunk_start``, ``chunk_end`` (byte offsets into the content) and
+    ``similarity_score``.
+    """
+
+    __slots__ = ("document", "chunk_start", "chunk_end", "similarity_score")
+
+    _FIELDS = ("chunk", "chunk_start", "chunk_end", "similarity_score")
+
+    def __init__(self, document: DocumentView, chunk_start: int, chunk_end: int, similarity_score: float):
+        self.document = document
+        self.chunk_start = chunk_start
+        self.chunk_end = chunk_end
+        self.similarity_score = similarity_score
+
+    @property
+    def chunk(self) -> str:
+        return self.document._store.content(self.document.row, self.chunk_start, self.chunk_end)
+
+    def __getitem__(self, key: str):
+        if key in self._FIELDS:
+            return getattr(self, key)
+        return self.document[key]
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._FIELDS or key in self.document
+
+    def to_dict(self) -> Dict:
+        doc = self.document.to_dict()
+        for key in self._FIELDS:
+            doc[key] = getattr(self, key)
+        return doc
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of ``text`` for prompt budgeting."""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def truncate_text(text: str, max_chars: int) -> str:
+    """Shorten ``text`` to at most ``max_chars`` characters, cutting at a word boundary."""
+    if len(text) <= max_chars:
+        return text
+    cut = text.rfind(" ", 0, max_chars - 3)
+    return text[:cut if cut > 0 else max_chars - 3].rstrip() + "..."
+
+
+class PromptContext:
+    """The question and the budgeted context a generator answers it from.
+
+    ``passages`` are (label, text) pairs of retrieved chunks in rank order;
+    ``history`` holds the (role, text) chat turns that fit the budget.
+    """
+
+    __slots__ = ("query", "passages", "glossary_terms", "market_data", "history")
+
+    INSTRUCTIONS = ("You are the ESOM Finance assistant. Answer the question about economics or finance "
+                    "using only the context below. If the context does not contain the answer, say so. "
+                    "Be concise.")
+
+    def __init__(self, query: str, passages: List[Tuple[str, str]], glossary_terms: Dict,
+                 market_data: Dict, history: List[Tuple[str, str]]):
+        self.query = query
+        self.passages = passages
+        self.glossary_terms = glossary_terms
+        self.market_data = market_data
+        self.history = history
+
+    def prompt(self) -> str:
+        """Render the context as a plain-text completion prompt."""
+        parts = [self.INSTRUCTIONS]
+        if self.market_data:
+            parts.append("Market data:\n" + "\n".join(f"- {key}: {value}" for key, value in self.market_data.items()))
+        if self.glossary_terms:
+            parts.append("Glossary:\n" + "\n".join(f"- {term}: {definition}"
+                                                   for term, definition in self.glossary_terms.items()))
+        if self.passages:
+            parts.append("Sources:\n" + "\n\n".join(f"[{i}] {label}\n{text}"
+                                                    for i, (label, text) in enumerate(self.passages, 1)))
+        if self.history:
+            parts.append("Conversation so far:\n" + "\n".join(f"{role}: {text}" for role, text in self.history))
+        parts.append(f"Question: {self.query}\nAnswer:")
+        return "\n\n".join(parts)
+
+
+class Generator:
+    """Synthesis backend that writes the answer for a PromptContext.
+
+    Subclasses implement ``stream``, yielding the answer in pieces as they
+    are produced; ``generate`` returns the whole answer.
+    """
+
+    name = None
+
+    def __init__(self, max_new_tokens: int = 256, temperature: float = 0.2):
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+
+    def stream(self, context: PromptContext) -> Iterator[str]:
+        raise NotImplementedError
+
+    def generate(self, context: PromptContext) -> str:
+        return "".join(self.stream(context))
+
+
+class TemplateGenerator(Generator):
+    """Model-free generator that assembles the answer from the top passage, glossary and market data."""
+
+    name = "template"
+
+    def generate(self, context: PromptContext) -> str:
+        glossary_terms = context.glossary_terms
+        market_data = context.market_data
+        if not context.passages:
+            # No relevant documents found
+            if glossary_terms:
+                # But we found glossary terms
+                terms_list = list(glossary_terms.keys())
+                if len(terms_list) == 1:
+                    return f"I see you're asking about '{terms_list[0]}'. {glossary_terms[terms_list[0]]}"
+                else:
+                    definitions = [f"'{term}': {glossary_terms[term]}" for term in terms_list]
+                    return f"I found these relevant terms in your query:\n\n" + "\n\n".join(definitions)
+            
+            if market_data:
+                # We have market data
+                data_points = [f"{key}: {value}" for key, value in market_data.items()]
+                return f"Here's the latest data related to your query:\n\n" + "\n".join(data_points)
+            
+            # Generic response for no information
+            return "I don't have specific information on that topic yet. Please try asking about economics, finance, or market data that might be in my knowledge base."
+        
+        # We have relevant documents
+        answer_parts = []
+        
+        # Use the best matching passage of the most relevant document
+        main_content = context.passages[0][1]
+        if len(main_content) > 300:
+            main_content = main_content[:300] + "..."
+        answer_parts.append(main_content)
+        
+        # Add glossary definitions if any
+        if glossary_terms:
+            terms_text = "\n\nRelated terms:\n"
+            terms_text += "\n".join([f"- {term.capitalize()}: {definition}" for term, definition in glossary_terms.items()])
+            answer_parts.append(terms_text)
+        
+        # Add market data if any
+        if market_data:
+            market_text = "\n\nRelevant market data:\n"
+            market_text += "\n".join([f"- {key}: {value}" for key, value in market_data.items()])
+            answer_parts.append(market_text)
+        
+        return " ".join(answer_parts)
+
+    def stream(self, context: PromptContext) -> Iterator[str]:
+        # Word by word, keeping the whitespace, so clients render it like model output
+        yield from re.findall(r"\s*\S+", self.generate(context))
+
+
+class LlamaCppGenerator(Generator):
+    """Local CPU model in GGUF format, run in-process with llama-cpp-python.
+
+    The model is not safe for concurrent use, so generations are serialized.
+    """
+
+    name = "llama-cpp"
+
+    def __init__(self, model: str = None, n_ctx: int = 2048, n_threads: Optional[int] = None, **kwargs):
+        super().__init__(**kwargs)
+        if not model:
+            raise ValueError("The llama-cpp generator needs the path of a GGUF model")
+        try:
+            from llama_cpp import Llama
+        except ImportError:
+            raise RuntimeError("llama-cpp-python is required for the llama-cpp generator: pip install llama-cpp-python")
+        logger.info(f"Loading generator model {model}...")
+        self.model = Llama(model_path=model, n_ctx=n_ctx, n_threads=n_threads, verbose=False)
+        self._lock = threading.Lock()
+
+    def stream(self, context: PromptContext) -> Iterator[str]:
+        with self._lock:
+            for chunk in self.model.create_completion(context.prompt(), max_tokens=self.max_new_tokens,
+                                                      temperature=self.temperature, stop=["\nQuestion:"],
+                                                      stream=True):
+                yield chunk["choices"][0]["text"]
+
+
+class CompletionServerGenerator(Generator):
+    """Generator backed by an OpenAI-compatible /v1/completions server.
+
+    Works with a local llama.cpp, vLLM or Ollama server, or any stub that
+    streams completions as server-sent events.
+    """
+
+    name = "http"
+
+    def __init__(self, url: str = "http://127.0.0.1:8080", model: Optional[str] = None,
+                 timeout: float = 30.0, **kwargs):
+        super().__init__(**kwargs)
+        self.url = urllib.parse.urlsplit(url)
+        self.model = model
+        self.timeout = timeout
+
+    def stream(self, context: PromptContext) -> Iterator[str]:
+        body = {"prompt": context.prompt(), "max_tokens": self.max_new_tokens,
+                "temperature": self.temperature, "stop": ["\nQuestion:"], "stream": True}
+        if self.model:
+            body["model"] = self.model
+        connection_class = http.client.HTTPSConnection if self.url.scheme == "https" else http.client.HTTPConnection
+        connection = connection_class(self.url.netloc, timeout=self.timeout)
+        try:
+            connection.request("POST", self.url.path.rstrip("/") + "/v1/completions", json.dumps(body),
+                               {"Content-Type": "application/json", "Accept": "text/event-stream"})
+            response = connection.getresponse()
+            if response.status != 200:
+                raise RuntimeError(f"Completion server returned {response.status}: {response.read()[:200]!r}")
+            for line in response:
+                line = line.strip()
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[len(b"data:"):].strip()
+                if data == b"[DONE]":
+                    break
+                text = json.loads(data)["choices"][0].get("text", "")
+                if text:
+                    yield text
+        finally:
+            connection.close()
+
+
+GENERATOR_BACKENDS = {
+    TemplateGenerator.name: TemplateGenerator,
+    LlamaCppGenerator.name: LlamaCppGenerator,
+    CompletionServerGenerator.name: CompletionServerGenerator
+}
+
+
+class ConversationSession:
+    """Recent user turns of one conversation with their embeddings and retrieved documents.
+
+    Sessions are cached per user_id so that a follow-up question reuses the
+    embeddings of earlier turns instead of re-encoding the chat history.
+    Turns are keyed by their normalized text; only the most recent
+    ``MAX_TURNS`` are kept.
+    """
+
+    __slots__ = ("_turns", "_lock")
+
+    MAX_TURNS = HISTORY_TURNS + 1
+
+    def __init__(self):
+        self._turns = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, text: str) -> Tuple[Optional[np.ndarray], Tuple[int, ...]]:
+        """Return the (embedding, retrieved document rows) of a turn, or (None, ())."""
+        with self._lock:
+            return self._turns.get(normalize_query(text), (None, ()))
+
+    def remember(self, text: str, embedding: np.ndarray, doc_rows: Tuple[int, ...] = ()):
+        with self._lock:
+            key = normalize_query(text)
+            self._turns[key] = (embedding, doc_rows)
+            self._turns.move_to_end(key)
+            while len(self._turns) > self.MAX_TURNS:
+                self._turns.popitem(last=False)
+
+
+class ShardClient:
+    """Coordinator side of sharded retrieval.
+
+    Each shard is a server started with ``--shard I/N`` that indexes one
+    partition of the corpus. Queries are embedded once by the coordinator
+    and sent to every shard's POST /api/shard/search, which returns its
+    local top-k hits with their cosine similarities; the hits are merged
+    by similarity. Shards that fail or do not answer within ``timeout``
+    seconds are left out, so a slow shard costs recall instead of
+    stalling the request. Keep-alive connections are reused per shard.
+    Requests carry ``token``, the shards' admin token, as a bearer token.
+    """
+
+    def __init__(self, urls: List[str], timeout: float = DEFAULT_SHARD_TIMEOUT, token: Optional[str] = None):
+        if not urls:
+            raise ValueError("At least one shard URL is required")
+        self.urls = [urllib.parse.urlsplit(url if "://" in url else f"http://{url}") for url in urls]
+        self.timeout = timeout
+        self.token = token
+        self.info = [None] * len(urls)
+        self.executor = ThreadPoolExecutor(max_workers=8 * len(urls), thread_name_prefix="shard-client")
+        self._connections = [queue.LifoQueue() for _ in urls]
+        self._lock = threading.Lock()
+        self.requests = [0] * len(urls)
+        self.failures = [0] * len(urls)
+        self.timeouts = [0] * len(urls)
+        self.partial_results = 0
+
+    def connect(self, embedding_model_name: Optional[str], embedding_dim: int,
+                startup_timeout: Optional[float] = None) -> int:
+        """Wait for the shards to report ready and check that they embed like the coordinator.
+
+        Shards that are not ready after ``startup_timeout`` seconds (default
+        SHARD_STARTUP_TIMEOUT) are queried anyway but skipped until they
+        answer. Returns the number of ready shards; raises RuntimeError if
+        none became ready and ValueError if a shard uses another embedding model.
+        """
+        if startup_timeout is None:
+            startup_timeout = SHARD_STARTUP_TIMEOUT
+        deadline = time.monotonic() + startup_timeout
+        pending = set(range(len(self.urls)))
+        while pending:
+            for shard in sorted(pending):
+                try:
+                    self.info[shard] = self._request(shard, "GET", "/api/shard/info")
+                except Exception:
+                    continue
+                pending.discard(shard)
+            if pending and time.monotonic() < deadline:
+                time.sleep(0.5)
+            elif pending:
+                break
+        
+        ready = [info for info in self.info if info is not None]
+        if not ready:
+            raise RuntimeError(f"None of the {len(self.urls)} shards became ready")
+        for url, info in zip(self.urls, self.info):
+            if info is None:
+                logger.warning(f"Shard {url.netloc} is not ready; retrieval continues without it")
+            elif info["embedding_dim"] != embedding_dim or info["embedding_model"] != embedding_model_name:
+                raise ValueError(f"Shard {url.netloc} embeds with {info['embedding_model']} "
+                                 f"({info['embedding_dim']} dimensions), the coordinator with "
+                                 f"{embedding_model_name} ({embedding_dim} dimensions)")
+        return len(ready)
+
+    def document_count(self) -> int:
+        """Live documents across the shards, as reported when they connected."""
+        return sum(info["documents"] for info in self.info if info is not None)
+
+    def search(self, query_embeddings: np.ndarray, queries: List[str], top_k: int,
+               filters: Dict) -> List[List[Dict]]:
+        """Return the merged top_k hits of each query, best first.
+
+        ``query_embeddings`` are the normalized (n_queries, dim) embeddings
+        and ``queries`` the texts used for the shards' lexical search.
+        Shards whose partition holds none of the filtered sources are skipped.
+        """
+        embeddings = np.ascontiguousarray(query_embeddings, dtype='<f4')
+        body = json.dumps({
+            "embeddings": base64.b64encode(embeddings.tobytes()).decode("ascii"),
+            "shape": list(embeddings.shape),
+            "queries": list(queries),
+            "top_k": top_k,
+            "filters": filters
+        })
+        shards = [shard for shard, info in enumerate(self.info)
+                  if not (info and "sources" in filters and not set(info["sources"]) & set(filters["sources"]))]
+        futures = {self.executor.submit(self._request, shard, "POST", "/api/shard/search", body): shard
+                   for shard in shards}
+        done, not_done = wait_futures(futures, timeout=self.timeout)
+        
+        merged = [[] for _ in queries]
+        answered = 0
+        for future in done:
+            shard = futures[future]
+            try:
+                results = future.result()["results"]
+            except Exception as e:
+                logger.warning(f"Shard {self.urls[shard].netloc} failed: {e}")
+                self._count(self.failures, shard)
+                continue
+            answered += 1
+            for hits, shard_hits in zip(merged, results):
+                hits.extend(shard_hits)
+        for future in not_done:
+            future.cancel()
+            shard = futures[future]
+            logger.warning(f"Shard {self.urls[shard].netloc} missed the {self.timeout:.2f}s deadline")
+            self._count(self.timeouts, shard)
+        if answered < len(futures):
+            with self._lock:
+                self.partial_results += 1
+        
+        return [sorted(hits, key=lambda hit: hit["similarity_score"], reverse=True)[:top_k] for hits in merged]
+
+    def _count(self, counters: List[int], shard: int):
+        with self._lock:
+            counters[shard] += 1
+
+    def _request(self, shard: int, method: str, path: str, body: Optional[str] = None) -> Dict:
+        """Send a request over a pooled connection, retrying once if a reused connection went stale."""
+        url = self.urls[shard]
+        self._count(self.requests, shard)
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        while True:
+            try:
+                connection, reused = self._connections[shard].get_nowait(), True
+            except queue.Empty:
+                connection, reused = http.client.HTTPConnection(url.netloc, timeout=self.timeout), False
+            try:
+                connection.request(method, url.path.rstrip("/") + path, body, headers)
+                response = connection.getresponse()
+                payload = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if reused:
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._connections[shard].put(connection)
+            if response.status != 200:
+                raise RuntimeError(f"Shard returned {response.status}: {payload[:200]!r}")
+            return json.loads(payload)
+
+    def stats(self) -> List[Dict]:
+        with self._lock:
+            return [{"url": url.geturl(), "ready": info is not None,
+                     "documents": info["documents"] if info else 0, "chunks": info["chunks"] if info else 0,
+                     "requests": requests, "failures": failures, "timeouts": timeouts}
+                    for url, info, requests, failures, timeouts
+                    in zip(self.urls, self.info, self.requests, self.failures, self.timeouts)]
+
+
+# Sample documents written when a source's JSONL file is missing
+DUMMY_DOCUMENTS = {
+    "research_papers": [
+        {"title": "Impact of Monetary Policy on Inflation", 
+         "content": "Monetary policy has a significant impact on inflation rates. Central banks use various tools like interest rates to control inflation. In India, the Reserve Bank of India implements monetary policy to maintain price stability."},
+        {"title": "Economic Growth Patterns in Developing Nations",
+         "content": "Developing nations often show different growth patterns compared to developed economies. Factors such as infrastructure, education, and governance play crucial roles in determining these patterns."}
+    ],
+    "textbook_excerpts": [
+        {"title": "Principles of Macroeconomics", 
+         "content": "Macroeconomics studies the behavior of the economy as a whole, including inflation, GDP, and unemployment. These factors are interconnected and influence economic policy decisions."},
+        {"title": "Introduction to Financial Markets", 
+         "content": "Financial markets are mechanisms that allow people to buy and sell (trade) financial securities, commodities, and other fungible items. They are crucial for allocating resources in the economy."}
+    ],
+    "financial_news": [
+        {"title": "Stock Market Reaches New High", 
+         "date": "2025-05-29",
+         "content": "The stock market reached a new record high today as investors responded positively to recent economic data showing strong growth and controlled inflation."},
+        {"title": "Central Bank Announces Interest Rate Decision", 
+         "date": "2025-05-28",
+         "content": "The central bank announced today that it will maintain current interest rates, citing balanced risks to economic growth and inflation targets."}
+    ],
+    "economic_indicators": [
+        {"indicator": "GDP Growth", 
+         "value": "4.2%",
+         "period": "Q1 2025",
+         "content": "India's GDP grew by 4.2% in the first quarter of 2025, showing resilience despite global economic challenges."},
+        {"indicator": "Inflation Rate", 
+         "value": "3.8%",
+         "period": "April 2025",
+         "content": "Consumer price inflation stood at 3.8% in April 2025, remaining within the Reserve Bank's target range of 2-6%."}
+    ]
+}
+
+
+def _text_splitter(chunk_size: int, chunk_overlap: int):
+    """Return langchain's recursive character splitter, importing langchain on first use."""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
 
 class SimpleRAG:
     """Simple Retrieval-Augmented Generation system for economics and finance data."""
     
-    def __init__(self, data_path: str = DEFAULT_DATA_PATH):
-        """Initialize the RAG system with data from the specified path."""
+    def __init__(self, data_path: str = DEFAULT_DATA_PATH, use_embedding_cache: bool = True,
+                 index_backend: str = ExactIndex.name, index_params: Optional[Dict] = None,
+                 embedding_dtype: str = "float32", query_batch_window_ms: float = 0.0,
+                 query_batch_size: int = 32, query_cache_size: int = 4096,
+                 response_cache_size: int = 1024, response_cache_ttl: float = 60.0,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+                 encode_batch_size: int = DEFAULT_ENCODE_BATCH_SIZE,
+                 on_state: Optional[Callable[[str], None]] = None, snapshot_path: Optional[str] = None,
+                 market_poll_interval: float = 0.0, retrieval_mode: str = "dense",
+                 dense_weight: float = 1.0, sparse_weight: float = 1.0, lexical_prefilter: int = 0,
+                 embeddings_model=None, session_cache_size: int = 4096,
+                 generator_backend: str = TemplateGenerator.name, generator_params: Optional[Dict] = None,
+                 context_tokens: int = DEFAULT_CONTEXT_TOKENS, shard: Optional[Tuple[int, int]] = None,
+                 shard_key: str = "hash", shards: Optional[List[str]] = None,
+                 shard_timeout: float = DEFAULT_SHARD_TIMEOUT, shard_token: Optional[str] = None):
+        """Initialize the RAG system with data from the specified path.
+
+        A positive ``query_batch_window_ms`` routes query encoding through an
+        ``EmbeddingBatcher`` so that concurrent requests share model calls.
+        Query embeddings are kept in an LRU cache and complete responses in a
+        TTL cache; a size (or TTL) of 0 disables the respective cache.
+        Documents are embedded as overlapping chunks of ``chunk_size``
+        characters. JSONL files are streamed in batches of lines and
+        encoded ``encode_batch_size`` chunks at a time. ``on_state`` is
+        called with "loading_model" and "indexing" as loading progresses.
+        With ``snapshot_path`` the corpus, embeddings, indexes and glossary
+        are memory-mapped from a ``save_snapshot`` artifact (or the current
+        artifact of an esom_build_index.py output directory) instead of
+        being built, and nothing is encoded; the system is then read-only
+        and a missing or incompatible artifact is an error. A positive
+        ``market_poll_interval`` watches market_data.json and hot-reloads it.
+        In "hybrid" ``retrieval_mode`` dense and BM25 rankings are combined
+        by weighted reciprocal rank fusion; a positive ``lexical_prefilter``
+        limits dense scoring to that many BM25 candidates on larger corpora.
+        A preloaded ``embeddings_model`` (anything with ``encode`` and
+        ``get_sentence_embedding_dimension``) replaces the sentence-transformers model.
+        Up to ``session_cache_size`` conversations keep the embeddings and
+        retrieved documents of their recent turns for follow-up questions.
+        Answers are written by the ``generator_backend`` from GENERATOR_BACKENDS,
+        built with ``generator_params``, from a prompt context of at most
+        ``context_tokens`` (estimated) tokens.
+        With ``shard`` = (index, count) only the documents that ``shard_of``
+        assigns to that shard by ``shard_key`` are indexed, with state
+        directories of their own. With ``shards`` (shard server URLs) the
+        system indexes nothing itself and retrieves from the shards instead,
+        leaving out those that miss ``shard_timeout``; it is then read-only.
+        Shard searches are authorized with ``shard_token``, the shards' admin token.
+        """
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Retrieval mode must be one of: {', '.join(RETRIEVAL_MODES)}")
+        if generator_backend not in GENERATOR_BACKENDS:
+            raise ValueError(f"Generator must be one of: {', '.join(GENERATOR_BACKENDS)}")
+        if shard is not None:
+            if shard_key not in SHARD_KEYS:
+                raise ValueError(f"Shard key must be one of: {', '.join(SHARD_KEYS)}")
+            if not 0 <= shard[0] < shard[1]:
+                raise ValueError(f"Invalid shard {shard[0]}/{shard[1]}")
+            if shard_key == "source" and shard[1] > len(DOCUMENT_TYPES):
+                raise ValueError(f"Partitioning by source allows at most {len(DOCUMENT_TYPES)} shards")
+            if snapshot_path or shards:
+                raise ValueError("A shard indexes its own partition of the data path")
         self.data_path = data_path
-        self.embeddings_model = None
-        self.document_store = []
+        self.use_embedding_cache = use_embedding_cache
+        self.embedding_dtype = embedding_dtype
+        self.index_backend = index_backend
+        self.index_params = index_params or {}
+        self.embeddings_model = embeddings_model
+        self.embedding_model_name = None
+        if embeddings_model is not None:
+            self.embedding_model_name = getattr(embeddings_model, "model_name", type(embeddings_model).__name__)
+        self.encode_batch_size = encode_batch_size
+        self.document_store = None
+        self.deleted_rows = frozenset()
+        self.text_splitter = _text_splitter(chunk_size, chunk_overlap)
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self._chunk_buffers = None
+        self.chunk_doc_rows = np.empty(0, dtype=np.int64)
+        self.chunk_starts = np.empty(0, dtype=np.int64)
+        self.chunk_ends = np.empty(0, dtype=np.int64)
         self.document_embeddings = None
+        self.read_only = False
+        self.index_manifest = None
+        self._write_lock = threading.Lock()
+        self.index = None
+        self.retrieval_mode = retrieval_mode
+        self.dense_weight = dense_weight
+        self.sparse_weight = sparse_weight
+        self.lexical_prefilter = lexical_prefilter
+        self.lexical_index = None
+        self._lexical_pending = []
+        self.metadata_index = MetadataIndex(DOCUMENT_TYPES)
+        self.query_batcher = None
+        self.query_cache = LRUCache(query_cache_size)
+        self.response_cache = TTLCache(response_cache_size, response_cache_ttl)
+        self.sessions = LRUCache(session_cache_size)
+        self.context_tokens = context_tokens
+        self.generator = None
         self.glossary = {}
-        self.market_data = {}
-        self.current_trends = {}
+        self.glossary_matcher = KeywordMatcher([])
+        self.market = MarketSnapshot(0, {}, {})
+        self.market_watcher = None
+        self.shard = tuple(shard) if shard is not None else None
+        self.shard_key = shard_key
+        self.shard_client = None
+        self.stage_latency = StageLatency()
+        self.model_load_seconds = 0.0
+        self.corpus_load_seconds = 0.0
         
         # Load models and data
-        self._load_embedding_model()
-        self._load_documents()
-        self._load_glossary()
+        if on_state:
+            on_state("loading_model")
+        start = time.perf_counter()
+        if self.embeddings_model is None:
+            self._load_embedding_model()
+        self.generator = GENERATOR_BACKENDS[generator_backend](**(generator_params or {}))
+        self.model_load_seconds = time.perf_counter() - start
+        if on_state:
+            on_state("indexing")
+        start = time.perf_counter()
+        if shards:
+            self.shard_client = ShardClient(shards, shard_timeout, shard_token)
+            self.shard_client.connect(self.embedding_model_name,
+                                      self.embeddings_model.get_sentence_embedding_dimension())
+            self.read_only = True
+        elif snapshot_path:
+            if not self._load_snapshot(snapshot_path):
+                raise RuntimeError(f"Could not load the index artifact in {snapshot_path}")
+        else:
+            self._load_documents()
+        self.corpus_load_seconds = time.perf_counter() - start
+        # Artifacts carry a compiled glossary; otherwise it is read from the data path
+        if not self.glossary:
+            self._load_glossary()
         self._load_market_data()
+        if market_poll_interval > 0:
+            self.market_watcher = MarketDataWatcher(self._market_data_path(), self.reload_market_data,
+                                                    market_poll_interval)
         
-        logger.info(f"Initialized RAG system with {len(self.document_store)} documents")
+        if query_batch_window_ms > 0:
+            self.query_batcher = EmbeddingBatcher(self.embeddings_model.encode,
+                                                  query_batch_window_ms, query_batch_size)
+        
+        logger.info(f"Initialized RAG system with {self.document_count()} documents")
     
     def _load_embedding_model(self):
         """Load the sentence embedding model."""
         logger.info("Loading embedding model...")
+        from sentence_transformers import SentenceTransformer
+
         try:
-            self.embeddings_model = SentenceTransformer('all-MiniLM-L6-v2')
+            self.embeddings_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+            self.embedding_model_name = EMBEDDING_MODEL_NAME
             logger.info("Embedding model loaded successfully")
         except Exception as e:
             logger.error(f"Error loading embedding model: {e}")
             # Use a simpler model as fallback
             try:
-                self.embeddings_model = SentenceTransformer('paraphrase-MiniLM-L3-v2')
+                self.embeddings_model = SentenceTransformer(FALLBACK_EMBEDDING_MODEL_NAME)
+                self.embedding_model_name = FALLBACK_EMBEDDING_MODEL_NAME
                 logger.info("Fallback embedding model loaded")
             except Exception as e2:
                 logger.error(f"Failed to load fallback model: {e2}")
                 raise
     
     def _load_documents(self):
-        """Load documents from JSONL files and create embeddings."""
+        """Stream documents from JSONL files, embedding them in bounded batches."""
         logger.info(f"Loading documents from {self.data_path}...")
         
         # Create data directory if it doesn't exist
         os.makedirs(self.data_path, exist_ok=True)
         
-        documents = []
+        # Start from an empty corpus
+        self.document_store = DocumentStore(self._state_path(DOCUMENT_STORE_DIR))
+        self.deleted_rows = frozenset()
+        self._chunk_buffers = (GrowableArray(np.int64), GrowableArray(np.int64), GrowableArray(np.int64))
+        self.document_embeddings = None
+        self.index = None
+        self.metadata_index = MetadataIndex(self.document_store.sources)
+        self.lexical_index = BM25Index() if self.retrieval_mode == "hybrid" else None
+        self._lexical_pending = []
         
-        # List of document types to look for
-        document_types = [
-            "research_papers", "textbook_excerpts", 
-            "financial_news", "economic_indicators"
-        ]
+        store = None
+        if self.use_embedding_cache:
+            store = EmbeddingStore(
+                self._state_path(EMBEDDING_CACHE_DIR),
+                self.embedding_model_name,
+                self.embeddings_model.get_sentence_embedding_dimension()
+            )
         
-        for doc_type in document_types:
+        # (source, document ID, rows loaded before the tombstone line)
+        tombstones = []
+        for doc_type in DOCUMENT_TYPES:
             file_path = os.path.join(self.data_path, f"{doc_type}.jsonl")
             
             # Create dummy data if file doesn't exist
             if not os.path.exists(file_path):
                 self._create_dummy_data(file_path, doc_type)
+            # Source shards skip the files of other shards without parsing them
+            if doc_type not in self.shard_sources():
+                continue
             
             try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        doc = json.loads(line)
+                count = 0
+                for lines in self._iter_document_batches(file_path):
+                    documents = []
+                    for doc in lines:
+                        if doc.get(TOMBSTONE_KEY):
+                            # Rows loaded so far, including this batch's documents before the tombstone
+                            tombstones.append((doc_type, str(doc["id"]), len(self.document_store) + len(documents)))
+                            continue
                         # Add source information
                         doc["source"] = doc_type
-                        documents.append(doc)
-                logger.info(f"Loaded {doc_type} documents")
+                        if self._in_shard(doc):
+                            documents.append(doc)
+                    self._add_documents(documents, store)
+                    count += len(documents)
+                logger.info(f"Loaded {count} {doc_type} documents")
             except Exception as e:
                 logger.error(f"Error loading {doc_type} documents: {e}")
         
-        # Store the documents
-        self.document_store = documents
+        if store is not None:
+            logger.info(f"Encoded {store.encoded} new or changed chunks, the rest came from the embedding cache")
+            store.sync()
+        
+        # Tombstones drop the earlier lines of their ID in their own file
+        tombstoned = frozenset(row for doc_type, doc_id, end in tombstones
+                               for row in self.document_store.find(doc_id)
+                               if row < end and self.document_store.source(row) == doc_type)
+        # A document ID listed more than once keeps its last line
+        superseded = self._superseded_rows(tombstoned)
+        if superseded:
+            logger.warning(f"Skipped {len(superseded)} documents superseded by a later line with the same id")
+        self.deleted_rows = tombstoned | superseded
+        
+        if self.document_embeddings is not None:
+            logger.info(f"Created {self.embedding_dtype} embeddings for {len(self.document_embeddings)} chunks "
+                        f"({self.document_embeddings.nbytes / 1024 / 1024:.1f} MiB)")
+            self._build_index()
+        self._update_lexical_index()
+        self._update_metadata_index()
+        
+        # Cached responses may reference documents that changed
+        self.response_cache.clear()
+
+    @staticmethod
+    def _iter_document_batches(file_path: str):
+        """Yield lists of parsed documents from a JSONL file, INGEST_BATCH_LINES lines at a time."""
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for lines in iter(lambda: list(islice(f, INGEST_BATCH_LINES)), []):
+                yield _parse_jsonl_lines(lines)
+
+    def _add_documents(self, documents: List[Dict], store: Optional[EmbeddingStore] = None) -> List[str]:
+        """Append documents to the corpus: chunk, encode in bounded batches, grow the matrix.
+
+        Rows are published documents first and embeddings last, so a query
+        running concurrently never sees an embedding row whose chunk or
+        parent document is missing. The vector index is not updated here.
+        """
+        ids = []
+        for doc in documents:
+            doc["id"] = document_id(doc)
+            ids.append(doc["id"])
+        base = self.document_store.append(documents)
+        
+        doc_row_buffer, start_buffer, end_buffer = self._chunk_buffers
+        chunks = self._iter_chunks(documents, base)
+        while True:
+            batch = list(islice(chunks, self.encode_batch_size))
+            if not batch:
+                break
+            doc_rows, starts, ends, texts = zip(*batch)
+            if store is not None:
+                embeddings = store.get_embeddings(list(texts), self.embeddings_model.encode)
+            else:
+                embeddings = self.embeddings_model.encode(list(texts))
+            if self.lexical_index is not None:
+                self._lexical_pending.append(self.lexical_index.postings(texts))
+            
+            self.chunk_doc_rows = doc_row_buffer.extend(doc_rows)
+            self.chunk_starts = start_buffer.extend(starts)
+            self.chunk_ends = end_buffer.extend(ends)
+            if self.document_embeddings is None:
+                self.document_embeddings = EmbeddingMatrix.from_embeddings(embeddings, self.embedding_dtype)
+            else:
+                self.document_embeddings = self.document_embeddings.append(embeddings)
+        
+        return ids
+
+    def _iter_chunks(self, documents: List[Dict], base_row: int = 0):
+        """Yield (doc_row, start, end, text) for the overlapping chunks of each document.
+
+        Offsets are byte offsets into the UTF-8 encoded content, matching the
+        layout of the document store. Chunks the splitter altered so that they
+        no longer occur in the content have no offsets and are skipped.
+        """
+        for doc_row, doc in enumerate(documents, base_row):
+            content = doc.get("content", "")
+            ascii_only = content.isascii()
+            search_from = 0
+            for chunk in self.text_splitter.split_text(content):
+                start = content.find(chunk, search_from)
+                if start < 0:
+                    start = content.find(chunk)
+                if start < 0:
+                    logger.warning(f"Skipped a chunk of document {doc.get('id')} that does not occur in its content")
+                    continue
+                end = start + len(chunk)
+                search_from = max(start + 1, end - self.chunk_overlap)
+                if not ascii_only:
+                    start = len(content[:start].encode("utf-8"))
+                    end = start + len(chunk.encode("utf-8"))
+                yield doc_row, start, end, chunk
+
+    def _state_path(self, name: str) -> str:
+        """Path of a state directory in the data path, private to this shard when sharded."""
+        if self.shard is not None:
+            name = f"{name}-shard{self.shard[0]}of{self.shard[1]}"
+        return os.path.join(self.data_path, name)
+    
+    def _in_shard(self, doc: Dict) -> bool:
+        if self.shard is None:
+            return True
+        if "id" not in doc:
+            doc = dict(doc, id=document_id(doc))
+        return shard_of(doc, self.shard[1], self.shard_key) == self.shard[0]
+    
+    def shard_sources(self) -> List[str]:
+        """Sources this system can hold documents of: all of them unless sharded by source."""
+        if self.shard is None or self.shard_key != "source":
+            return list(DOCUMENT_TYPES)
+        return [source for source in DOCUMENT_TYPES if DOCUMENT_TYPES.index(source) % self.shard[1] == self.shard[0]]
+    
+    def shard_info(self) -> Dict:
+        """Description of this shard, checked by coordinators when they connect."""
+        return {
+            "shard": list(self.shard) if self.shard is not None else [0, 1],
+            "shard_key": self.shard_key,
+            "sources": self.shard_sources(),
+            "documents": self.document_count(),
+            "chunks": len(self.chunk_doc_rows),
+            "embedding_model": self.embedding_model_name,
+            "embedding_dim": self.embeddings_model.get_sentence_embedding_dimension()
+        }
+    
+    def document_count(self) -> int:
+        """Number of live (not deleted or replaced) documents."""
+        if self.shard_client is not None:
+            return self.shard_client.document_count()
+        if self.document_store is None:
+            return 0
+        return len(self.document_store) - len(self.deleted_rows)
+
+    def _live_row(self, doc_id: str) -> Optional[int]:
+        """Return the live row stored under a document ID, if any."""
+        rows = [row for row in self.document_store.find(doc_id) if row not in self.deleted_rows]
+        return rows[-1] if rows else None
+
+    def save_snapshot(self, directory: str, version: Optional[str] = None,
+                      metadata: Optional[Dict] = None) -> Dict:
+        """Write the corpus, embeddings, indexes and glossary for memory-mapped loading.
+
+        The snapshot is written next to ``directory`` and moved into place
+        when complete, so readers never see a partial snapshot. ``version``
+        and ``metadata`` are recorded in the returned manifest. Raises
+        ValueError for an empty corpus.
+        """
+        if self.index is None or not self.document_store:
+            raise ValueError("Cannot save a snapshot of an empty corpus")
+        
+        tmp_path = directory + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        
+        self.document_store.save(os.path.join(tmp_path, "documents"))
+        arrays = {
+            "chunk_doc_rows": self.chunk_doc_rows,
+            "chunk_starts": self.chunk_starts,
+            "chunk_ends": self.chunk_ends,
+            "deleted_rows": np.array(sorted(self.deleted_rows), dtype=np.int64),
+            **self.document_embeddings.state("embeddings_")
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+        # The exact backend is just the embedding matrix, so there is nothing to persist
+        if self.index.name != ExactIndex.name:
+            self.index.save(os.path.join(tmp_path, "index"))
+        if self.lexical_index is not None:
+            self.lexical_index.save(os.path.join(tmp_path, "lexical"))
+        with open(os.path.join(tmp_path, "glossary.json"), 'w', encoding='utf-8') as f:
+            json.dump({"terms": self.glossary, "automaton": self.glossary_matcher.to_dict()}, f)
+        
+        manifest = {
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "version": version,
+            "created_at": datetime.now().isoformat(),
+            "model_name": self.embedding_model_name,
+            "embedding_dim": self.document_embeddings.shape[1],
+            "embedding_dtype": self.embedding_dtype,
+            "index_backend": self.index.name,
+            "index_params": self.index.params,
+            "lexical_index": self.lexical_index is not None,
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "documents": len(self.document_store),
+            "chunks": len(self.chunk_doc_rows),
+            "glossary_terms": len(self.glossary),
+            **(metadata or {})
+        }
+        with open(os.path.join(tmp_path, "manifest.json"), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        
+        _replace_directory(tmp_path, directory)
+        logger.info(f"Saved snapshot of {len(self.chunk_doc_rows)} chunks to {directory}")
+        return manifest
+
+    def _load_snapshot(self, directory: str) -> bool:
+        """Memory-map a snapshot written by ``save_snapshot``; returns False if it is unusable."""
+        directory = resolve_index_path(directory)
+        try:
+            with open(os.path.join(directory, "manifest.json"), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+                logger.error(f"Unsupported snapshot format {manifest.get('format_version')} in {directory}")
+                return False
+            if manifest.get("model_name") != self.embedding_model_name:
+                logger.error(f"Snapshot in {directory} was built with {manifest.get('model_name')}, "
+                             f"but the server uses {self.embedding_model_name}")
+                return False
+            
+            def load(name):
+                path = os.path.join(directory, f"{name}.npy")
+                return np.load(path, mmap_mode='r') if os.path.exists(path) else None
+            
+            self.document_store = DocumentStore(os.path.join(directory, "documents"), read_only=True)
+            self.chunk_doc_rows = load("chunk_doc_rows")
+            self.chunk_starts = load("chunk_starts")
+            self.chunk_ends = load("chunk_ends")
+            self.deleted_rows = frozenset(load("deleted_rows").tolist())
+            self.document_embeddings = EmbeddingMatrix(load("embeddings_vectors"), load("embeddings_scales"))
+            self.embedding_dtype = manifest["embedding_dtype"]
+            if manifest["index_backend"] == ExactIndex.name:
+                self.index = ExactIndex()
+                self.index.build(self.document_embeddings)
+            else:
+                # The index searches the snapshot's embedding matrix rather than a copy of it
+                self.index = VectorIndex.load(os.path.join(directory, "index")).extend(self.document_embeddings)
+            self.index_backend = self.index.name
+            lexical_path = os.path.join(directory, "lexical")
+            if self.retrieval_mode == "hybrid" and os.path.exists(lexical_path):
+                self.lexical_index = BM25Index.load(lexical_path)
+            self.metadata_index = MetadataIndex(self.document_store.sources)
+            self._update_metadata_index()
+            with open(os.path.join(directory, "glossary.json"), 'r', encoding='utf-8') as f:
+                glossary = json.load(f)
+            self.glossary = glossary["terms"]
+            self.glossary_matcher = KeywordMatcher.from_dict(glossary["automaton"])
+        except Exception as e:
+            logger.error(f"Error loading snapshot from {directory}: {e}")
+            return False
+        
+        self.read_only = True
+        self.index_manifest = manifest
+        logger.info(f"Memory-mapped snapshot {manifest.get('version') or ''} with {len(self.chunk_doc_rows)} "
+                    f"chunks and {len(self.glossary)} glossary terms from {directory}")
+        return True
+
+    def ingest_documents(self, documents: List[Dict], persist: bool = True) -> List[str]:
+        """Add documents to the live index and return their IDs.
+
+        Each document needs ``content`` and a ``source`` from DOCUMENT_TYPES;
+        ingesting an existing ``id`` replaces that document. Writers are
+        serialized, but queries never wait: they keep searching the previous
+        index until the extended one is swapped in. With ``persist`` the
+        documents are also appended to their source's JSONL file, where
+        they supersede earlier lines of the same ID; a document moved to
+        another source leaves a tombstone in its old file.
+        """
+        for doc in documents:
+            if not isinstance(doc, dict) or not doc.get("content"):
+                raise ValueError("Every document needs a non-empty 'content' field")
+            if doc.get("source") not in DOCUMENT_TYPES:
+                raise ValueError(f"Document source must be one of: {', '.join(DOCUMENT_TYPES)}")
+            if not self._in_shard(doc):
+                raise ValueError(f"Document {document_id(doc)} belongs to another shard")
+        
+        with self._write_lock:
+            documents = [dict(doc) for doc in documents]
+            replaced = {self._live_row(document_id(doc)) for doc in documents} - {None}
+            base = len(self.document_store)
+            ids = self._add_documents(documents)
+            # An ID given twice in one request keeps its last document
+            latest = {}
+            for row, doc_id in enumerate(ids, base):
+                if doc_id in latest:
+                    replaced.add(latest[doc_id])
+                latest[doc_id] = row
+            self.deleted_rows = self.deleted_rows | replaced
+            
+            if self.index is None:
+                self._build_index()
+            else:
+                self.index = self.index.extend(self.document_embeddings)
+                if self.index.needs_rebuild():
+                    self._build_index()
+            self._update_lexical_index()
+            self._update_metadata_index()
+            
+            if persist:
+                lines = {doc_type: [] for doc_type in DOCUMENT_TYPES}
+                # A document moved to another source leaves a tombstone in its old file
+                for row in sorted(replaced):
+                    doc_id, doc_type = self.document_store.metadata(row)["id"], self.document_store.source(row)
+                    if row < base and documents[latest[doc_id] - base]["source"] != doc_type:
+                        lines[doc_type].append(json.dumps({"id": doc_id, TOMBSTONE_KEY: True}))
+                for row, doc in enumerate(documents, base):
+                    if latest[doc["id"]] == row:
+                        lines[doc["source"]].append(json.dumps({k: v for k, v in doc.items() if k != "source"}))
+                for doc_type in DOCUMENT_TYPES:
+                    self._append_to_jsonl(doc_type, lines[doc_type])
+            
+            self.response_cache.clear()
+        
+        logger.info(f"Ingested {len(ids)} documents ({len(replaced)} replaced)")
+        return ids
+
+    def delete_document(self, doc_id: str, persist: bool = True) -> bool:
+        """Remove a document from retrieval; returns False if the ID is unknown.
+
+        The document's rows stay in the matrix but are skipped by queries.
+        With ``persist`` a tombstone is appended to the source JSONL file.
+        """
+        with self._write_lock:
+            row = self._live_row(doc_id)
+            if row is None:
+                return False
+            self.deleted_rows = self.deleted_rows | {row}
+            
+            if persist:
+                self._append_to_jsonl(self.document_store.source(row),
+                                      [json.dumps({"id": doc_id, TOMBSTONE_KEY: True})])
+            
+            self.response_cache.clear()
         
-        # Create embeddings for documents
-        if documents and self.embeddings_model:
-            logger.info("Creating document embeddings...")
-            texts = [doc.get("content", "") for doc in documents]
-            self.document_embeddings = self.embeddings_model.encode(texts)
-            logger.info(f"Created embeddings for {len(texts)} documents")
+        logger.info(f"Deleted document {doc_id}")
+        return True
+
+    def _append_to_jsonl(self, doc_type: str, lines: List[str]):
+        """Append lines to a source's JSONL file; appends never rewrite earlier lines."""
+        if lines:
+            with open(os.path.join(self.data_path, f"{doc_type}.jsonl"), 'a', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+
+    def _superseded_rows(self, deleted: frozenset = frozenset()) -> frozenset:
+        """Rows whose document ID appears again in a later row; the last row of an ID wins.
+
+        Rows in ``deleted`` neither win nor are reported.
+        """
+        id_hashes = np.asarray(self.document_store.id_hashes)
+        order = np.argsort(id_hashes, kind='stable')
+        repeated = np.flatnonzero(id_hashes[order][1:] == id_hashes[order][:-1])
+        candidates = np.unique(np.concatenate([order[repeated], order[repeated + 1]]))
+        latest = {}
+        superseded = set()
+        # Rows sharing a hash are compared by ID, oldest row first
+        for row in candidates.tolist():
+            if row in deleted:
+                continue
+            doc_id = self.document_store.metadata(row).get("id")
+            if doc_id in latest:
+                superseded.add(latest[doc_id])
+            latest[doc_id] = row
+        return frozenset(superseded)
+
+    def _build_index(self):
+        """Load the vector index from disk if it is current, otherwise build and save it."""
+        index_path = os.path.join(self._state_path(INDEX_DIR), self.index_backend)
+        fingerprint = VectorIndex.embeddings_fingerprint(self.document_embeddings)
+        index = INDEX_BACKENDS[self.index_backend](**self.index_params)
+
+        if os.path.exists(index_path):
+            try:
+                saved = VectorIndex.load(index_path)
+                if saved.fingerprint == fingerprint and saved.params == index.params:
+                    self.index = saved.extend(self.document_embeddings)
+                    logger.info(f"Loaded {self.index_backend} index from {index_path}")
+                    return
+            except Exception as e:
+                logger.error(f"Error loading {self.index_backend} index: {e}")
+
+        logger.info(f"Building {self.index_backend} index...")
+        index.build(self.document_embeddings)
+        index.fingerprint = fingerprint
+        self.index = index
+
+        # The exact backend is just the embedding matrix, so there is nothing to persist
+        if self.index_backend != ExactIndex.name:
+            try:
+                index.save(index_path)
+                logger.info(f"Saved {self.index_backend} index to {index_path}")
+            except Exception as e:
+                logger.error(f"Error saving {self.index_backend} index: {e}")
     
     def _create_dummy_data(self, file_path: str, doc_type: str):
         """Create dummy data files for testing purposes."""
         logger.info(f"Creating dummy {doc_type} data")
         
-        # Define dummy data based on document type
-        dummy_docs = []
-        
-        if doc_type == "research_papers":
-            dummy_docs = [
-                {"title": "Impact of Monetary Policy on Inflation", 
-                 "content": "Monetary policy has a significant impact on inflation rates. Central banks use various tools like interest rates to control inflation. In India, the Reserve Bank of India implements monetary policy to maintain price stability."},
-                {"title": "Economic Growth Patterns in Developing Nations",
-                 "content": "Developing nations often show different growth patterns compared to developed economies. Factors such as infrastructure, education, and governance play crucial roles in determining these patterns."}
-            ]
-        
-        elif doc_type == "textbook_excerpts":
-            dummy_docs = [
-                {"title": "Principles of Macroeconomics", 
-                 "content": "Macroeconomics studies the behavior of the economy as a whole, including inflation, GDP, and unemployment. These factors are interconnected and influence economic policy decisions."},
-                {"title": "Introduction to Financial Markets", 
-                 "content": "Financial markets are mechanisms that allow people to buy and sell (trade) financial securities, commodities, and other fungible items. They are crucial for allocating resources in the economy."}
-            ]
-        
-        elif doc_type == "financial_news":
-            dummy_docs = [
-                {"title": "Stock Market Reaches New High", 
-                 "date": "2025-05-29",
-                 "content": "The stock market reached a new record high today as investors responded positively to recent economic data showing strong growth and controlled inflation."},
-                {"title": "Central Bank Announces Interest Rate Decision", 
-                 "date": "2025-05-28",
-                 "content": "The central bank announced today that it will maintain current interest rates, citing balanced risks to economic growth and inflation targets."}
-            ]
-        
-        elif doc_type == "economic_indicators":
-            dummy_docs = [
-                {"indicator": "GDP Growth", 
-                 "value": "4.2%",
-                 "period": "Q1 2025",
-                 "content": "India's GDP grew by 4.2% in the first quarter of 2025, showing resilience despite global economic challenges."},
-                {"indicator": "Inflation Rate", 
-                 "value": "3.8%",
-                 "period": "April 2025",
-                 "content": "Consumer price inflation stood at 3.8% in April 2025, remaining within the Reserve Bank's target range of 2-6%."}
-            ]
+        dummy_docs = DUMMY_DOCUMENTS.get(doc_type, [])
         
         # Save dummy data to file
         with open(file_path, 'w', encoding='utf-8') as f:
@@ -196,6 +3012,7 @@ class SimpleRAG:
                     term = item.get("term", "").lower()
                     if term:
                         self.glossary[term] = item.get("definition", "")
+            self.glossary_matcher = KeywordMatcher(self.glossary.keys())
             logger.info(f"Loaded glossary with {len(self.glossary)} terms")
         except Exception as e:
             logger.error(f"Error loading glossary: {e}")
@@ -216,23 +3033,44 @@ class SimpleRAG:
         
         logger.info(f"Created dummy glossary with {len(dummy_terms)} terms")
     
+    def _market_data_path(self) -> str:
+        return os.path.join(self.data_path, "market_data.json")
+    
+    @property
+    def market_data(self) -> Dict:
+        return self.market.market_data
+    
+    @property
+    def current_trends(self) -> Dict:
+        return self.market.trends
+    
     def _load_market_data(self):
         """Load market data and current economic trends."""
-        file_path = os.path.join(self.data_path, "market_data.json")
+        file_path = self._market_data_path()
         
         # Create dummy market data if file doesn't exist
         if not os.path.exists(file_path):
             self._create_dummy_market_data(file_path)
         
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                self.market_data = data.get("market_data", {})
-                self.current_trends = data.get("trends", {})
-            logger.info("Loaded market data and trends")
+            self.reload_market_data()
         except Exception as e:
             logger.error(f"Error loading market data: {e}")
     
+    def reload_market_data(self) -> int:
+        """Parse market_data.json into a new snapshot and swap it in; return its version.
+        
+        Parsing happens before the swap, so requests keep using the previous
+        snapshot until the new one is complete. Only cached responses that
+        quoted market figures are invalidated.
+        """
+        snapshot = MarketSnapshot.from_file(self._market_data_path(), self.market.version + 1)
+        self.market = snapshot
+        invalidated = self.response_cache.discard_where(lambda entry: entry[0] is not None)
+        logger.info(f"Loaded market data and trends (version {snapshot.version}, "
+                    f"invalidated {invalidated} cached responses)")
+        return snapshot.version
+    
     def _create_dummy_market_data(self, file_path: str):
         """Create dummy market data for testing."""
         dummy_data = {
@@ -257,7 +3095,8 @@ class SimpleRAG:
                 "repo_rate": "5.25%",
                 "gdp_growth": "4.2% (Q1 2025)",
                 "unemployment": "6.8% (April 2025)"
-            }
+            },
+            "routes": DEFAULT_MARKET_ROUTES
         }
         
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
@@ -266,189 +3105,971 @@ class SimpleRAG:
         
         logger.info("Created dummy market data")
     
-    def retrieve_relevant_documents(self, query: str, top_k: int = 3) -> List[Dict]:
-        """Retrieve the most relevant documents for a given query."""
-        if not self.document_embeddings is not None or not self.document_store:
-            logger.warning("No document embeddings available for retrieval")
-            return []
-        
-        # Create query embedding
-        query_embedding = self.embeddings_model.encode([query])[0]
-        
-        # Calculate similarities
-        similarities = np.dot(self.document_embeddings, query_embedding)
-        top_indices = np.argsort(similarities)[-top_k:][::-1]  # Get indices of top-k most similar docs
+    def _update_lexical_index(self):
+        """Make chunks added since the last update searchable by BM25."""
+        if self.lexical_index is None or not self._lexical_pending:
+            return
+        lexical_index = self.lexical_index.extend(self._lexical_pending)
+        if lexical_index.needs_rebuild():
+            lexical_index = lexical_index.rebuild()
+        self.lexical_index = lexical_index
+        self._lexical_pending = []
+    
+    def _update_metadata_index(self):
+        """Index the sources and dates of chunks added since the last update."""
+        doc_rows = self.chunk_doc_rows[len(self.metadata_index):]
+        if len(doc_rows):
+            self.metadata_index = self.metadata_index.extend(self.document_store.source_codes[doc_rows],
+                                                             self.document_store.dates[doc_rows])
+    
+    def parse_filters(self, sources=None, date_from=None, date_to=None) -> Dict:
+        """Validate retrieval filters; raises ValueError for unknown sources or malformed dates.
+        
+        ``sources`` is a source name or a list of them; dates are ISO
+        strings (YYYY-MM-DD) and both bounds are inclusive. Returns the
+        keyword arguments for ``retrieve_relevant_documents`` in canonical form.
+        """
+        filters = {}
+        if sources:
+            if isinstance(sources, str):
+                sources = [sources]
+            if not isinstance(sources, (list, tuple)) or not all(isinstance(source, str) for source in sources):
+                raise ValueError("sources must be a source name or a list of source names")
+            unknown = set(sources) - set(DOCUMENT_TYPES)
+            if unknown:
+                raise ValueError(f"Unknown sources {sorted(unknown)}; must be among: {', '.join(DOCUMENT_TYPES)}")
+            filters["sources"] = tuple(sorted(set(sources)))
+        for name, value in (("date_from", date_from), ("date_to", date_to)):
+            if value:
+                try:
+                    filters[name] = str(np.datetime64(str(value), 'D'))
+                except ValueError:
+                    raise ValueError(f"{name} must be a date in YYYY-MM-DD format")
+        return filters
+    
+    def _filtered_rows(self, filters: Dict) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """Return (rows, ranges) of the chunks passing ``parse_filters`` output.
+
+        ``rows`` is None without filters. Source-only filters also return
+        the sources' contiguous row ranges so that they can be scored in
+        place; date filters select scattered rows and return no ranges.
+        """
+        if not filters:
+            return None, None
+        rows = self.metadata_index.select(
+            filters.get("sources"),
+            np.datetime64(filters["date_from"]) if "date_from" in filters else None,
+            np.datetime64(filters["date_to"]) if "date_to" in filters else None)
+        if "date_from" in filters or "date_to" in filters:
+            return rows, None
+        return rows, self.metadata_index.ranges(filters["sources"])
+    
+    def encode_query(self, query: str) -> np.ndarray:
+        """Embed a single query, batching with concurrent requests when enabled."""
+        key = normalize_query(query)
+        embedding = self.query_cache.get(key)
+        if embedding is not None:
+            return embedding
+        
+        start = time.perf_counter()
+        if self.query_batcher is not None:
+            embedding = self.query_batcher.encode(query)
+        else:
+            embedding = self.embeddings_model.encode([query])[0]
+        self.stage_latency.observe("encode", time.perf_counter() - start)
+        self.query_cache.put(key, embedding)
+        return embedding
+    
+    def retrieve_relevant_documents(self, query: str, top_k: int = 3, sources=None,
+                                    date_from=None, date_to=None, history: Tuple[str, ...] = (),
+                                    session: Optional[ConversationSession] = None) -> List[RetrievedDocument]:
+        """Retrieve the most relevant documents for a given query.
+        
+        ``sources`` and the inclusive ``date_from``/``date_to`` bounds (see
+        ``parse_filters``) restrict retrieval to matching documents; only
+        their chunks are scored. ``history`` holds earlier user turns, most
+        recent first (see ``follow_up_history``): they are blended into the
+        query, and the documents retrieved for the latest one compete with
+        the results. A ``session`` supplies and records turn embeddings.
+        Sharded systems return the shards' hits as plain dicts with the same
+        fields; documents of earlier turns are not carried over across shards.
+        """
+        if self.shard_client is not None:
+            filters = self.parse_filters(sources, date_from, date_to)
+            own_embedding, query_embedding, lexical_query = self._query_embedding(query, history, session)
+            start = time.perf_counter()
+            docs = self.shard_client.search(query_embedding[None], [lexical_query], top_k, filters)[0]
+            self.stage_latency.observe("search", time.perf_counter() - start)
+            if session is not None:
+                session.remember(query, own_embedding)
+            return docs
+        
+        index = self.index
+        if index is None or not self.document_store:
+            logger.warning("No document embeddings available for retrieval")
+            return []
+        
+        filters = self.parse_filters(sources, date_from, date_to)
+        rows, ranges = self._filtered_rows(filters)
+        if rows is not None and not len(rows):
+            return []
+        
+        own_embedding, query_embedding, lexical_query = self._query_embedding(query, history, session)
+        
+        start = time.perf_counter()
+        if rows is None:
+            n_candidates = len(index)
+            dense_search = lambda k: index.search(query_embedding, k)
+        else:
+            # Score only the chunks passing the filters
+            n_candidates = len(rows)
+            embeddings = self.document_embeddings
+            if ranges is not None:
+                row_scores = np.concatenate([embeddings.scores(query_embedding, start, end) for start, end in ranges])
+            else:
+                row_scores = embeddings.take(rows).scores(query_embedding)
+            
+            def dense_search(k):
+                top = _top_k(row_scores, k)
+                return rows[top], row_scores[top]
+        
+        # Search for the best chunk of each of the top-k docs
+        best_chunks = self._rank_chunks(dense_search, n_candidates, lexical_query, query_embedding, rows, top_k)
+        if history and session is not None:
+            self._carry_over(best_chunks, session.get(history[0])[1], query_embedding, rows, top_k)
+        self.stage_latency.observe("search", time.perf_counter() - start)
+        
+        if session is not None:
+            session.remember(query, own_embedding, tuple(best_chunks))
+        
+        return self._retrieved_documents(best_chunks)
+    
+    def _query_embedding(self, query: str, history: Tuple[str, ...] = (),
+                         session: Optional[ConversationSession] = None) -> Tuple[np.ndarray, np.ndarray, str]:
+        """Return the query's own embedding, the embedding and the lexical query to retrieve with."""
+        # Create normalized query embedding so scores are cosine similarities
+        own_embedding = self._turn_embedding(query, session)
+        if not history:
+            return own_embedding, own_embedding, query
+        
+        # Blend in earlier turns so that follow-ups stay on topic
+        query_embedding = own_embedding.copy()
+        for i, turn in enumerate(history, 1):
+            query_embedding += HISTORY_DECAY ** i * self._turn_embedding(turn, session)
+        return own_embedding, l2_normalize(query_embedding), f"{history[0]} {query}"
+    
+    def retrieve_batch(self, queries: List[str], top_k: int = 3, sources=None, date_from=None,
+                       date_to=None) -> List[List[RetrievedDocument]]:
+        """Retrieve the most relevant documents for each of ``queries``.
+        
+        Equivalent to calling ``retrieve_relevant_documents`` per query, but
+        the queries are embedded in one model call and scored against the
+        candidate chunks with matrix-matrix products.
+        """
+        if not queries:
+            return []
+        if self.shard_client is not None:
+            filters = self.parse_filters(sources, date_from, date_to)
+            query_embeddings = self.encode_queries(queries)
+            start = time.perf_counter()
+            results = self.shard_client.search(query_embeddings, queries, top_k, filters)
+            self.stage_latency.observe("search", time.perf_counter() - start)
+            return results
+        return self.retrieve_embedded(self.encode_queries(queries), queries, top_k, sources, date_from, date_to)
+    
+    def retrieve_embedded(self, query_embeddings: np.ndarray, queries: List[str], top_k: int = 3, sources=None,
+                          date_from=None, date_to=None) -> List[List[RetrievedDocument]]:
+        """``retrieve_batch`` for queries embedded by the caller, e.g. a shard coordinator.
+        
+        ``query_embeddings`` are normalized and ``queries`` are the texts
+        for lexical search.
+        """
+        index = self.index
+        if index is None or not self.document_store or not len(queries):
+            return [[] for _ in queries]
+        
+        filters = self.parse_filters(sources, date_from, date_to)
+        rows, ranges = self._filtered_rows(filters)
+        if rows is not None and not len(rows):
+            return [[] for _ in queries]
+        
+        start = time.perf_counter()
+        if rows is None:
+            candidates = index
+        else:
+            # Score only the chunks passing the filters
+            candidates = ExactIndex()
+            if ranges is not None:
+                candidates.build(self.document_embeddings, ranges)
+            else:
+                candidates.build(self.document_embeddings.take(rows))
+        n_candidates = len(candidates)
+        # Oversample as _search_chunks does first; deeper searches fall back to per-query scans
+        prefetched = candidates.search_batch(query_embeddings, top_k * CHUNK_OVERSAMPLE)
+        
+        batch_chunks = []
+        for query, query_embedding, (top_rows, top_scores) in zip(queries, query_embeddings, prefetched):
+            def dense_search(k, query_embedding=query_embedding, top_rows=top_rows, top_scores=top_scores):
+                if k > len(top_rows):
+                    top_rows, top_scores = candidates.search(query_embedding, k)
+                top_rows, top_scores = top_rows[:k], top_scores[:k]
+                return (top_rows if rows is None else rows[top_rows]), top_scores
+            
+            batch_chunks.append(self._rank_chunks(dense_search, n_candidates, query, query_embedding, rows, top_k))
+        self.stage_latency.observe("search", time.perf_counter() - start)
+        return [self._retrieved_documents(best_chunks) for best_chunks in batch_chunks]
+    
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        """Return the normalized (n_queries, dim) embeddings of ``queries``.
+        
+        Cached embeddings are reused and all other distinct queries are
+        embedded in a single model call.
+        """
+        keys = [normalize_query(query) for query in queries]
+        embeddings = {}
+        missing = {}
+        for key, query in zip(keys, queries):
+            if key in embeddings or key in missing:
+                continue
+            embedding = self.query_cache.get(key)
+            if embedding is None:
+                missing[key] = query
+            else:
+                embeddings[key] = embedding
+        if missing:
+            start = time.perf_counter()
+            encoded = self.embeddings_model.encode(list(missing.values()))
+            self.stage_latency.observe("encode", time.perf_counter() - start)
+            for key, embedding in zip(missing, encoded):
+                embeddings[key] = embedding
+                self.query_cache.put(key, embedding)
+        return l2_normalize(np.stack([embeddings[key] for key in keys]).astype(np.float32))
+    
+    def _rank_chunks(self, dense_search: Callable[[int], Tuple[np.ndarray, np.ndarray]], n_candidates: int,
+                     lexical_query: str, query_embedding: np.ndarray, rows: Optional[np.ndarray],
+                     top_k: int) -> Dict[int, Tuple[int, float]]:
+        """Return {doc_row: (chunk row, cosine similarity)} for the top_k documents."""
+        lexical_index = self.lexical_index
+        if lexical_index is None or not len(lexical_index):
+            return self._search_chunks(dense_search, n_candidates, top_k)
+        
+        best_chunks = self._search_chunks(
+            lambda k: self._hybrid_search(dense_search, n_candidates, lexical_index, lexical_query,
+                                          query_embedding, k, rows),
+            n_candidates, top_k)
+        # Report cosine similarities rather than fusion scores
+        chunk_rows = [row for row, _ in best_chunks.values()]
+        similarities = self.document_embeddings[np.array(chunk_rows, dtype=np.int64)] @ query_embedding
+        return {doc_row: (row, float(similarity))
+                for (doc_row, (row, _)), similarity in zip(best_chunks.items(), similarities)}
+    
+    def _retrieved_documents(self, best_chunks: Dict[int, Tuple[int, float]]) -> List[RetrievedDocument]:
+        """Lightweight views of the parent documents with the matching passage."""
+        return [
+            RetrievedDocument(self.document_store.view(doc_row), int(self.chunk_starts[row]),
+                              int(self.chunk_ends[row]), score)
+            for doc_row, (row, score) in best_chunks.items()
+        ]
+    
+    def _turn_embedding(self, text: str, session: Optional[ConversationSession] = None) -> np.ndarray:
+        """Normalized embedding of a user turn, reused from the session when it has one."""
+        if session is not None:
+            embedding = session.get(text)[0]
+            if embedding is not None:
+                return embedding
+        embedding = l2_normalize(self.encode_query(text))
+        if session is not None:
+            session.remember(text, embedding)
+        return embedding
+    
+    def _carry_over(self, best_chunks: Dict[int, Tuple[int, float]], doc_rows: Tuple[int, ...],
+                    query_embedding: np.ndarray, rows: Optional[np.ndarray], top_k: int):
+        """Let the documents of the previous turn compete with ``best_chunks`` by cosine similarity.
+
+        Each carried document is represented by its best chunk for the
+        blended query; documents that are deleted or excluded by the
+        filter ``rows`` are skipped. Updates ``best_chunks`` in place.
+        """
+        embeddings = self.document_embeddings
+        chunk_doc_rows = self.chunk_doc_rows[:len(embeddings)]
+        carried = {}
+        for doc_row in doc_rows:
+            if doc_row in best_chunks or doc_row in self.deleted_rows:
+                continue
+            # Chunks are stored in document order, so a document's chunks are contiguous
+            chunk_rows = np.arange(np.searchsorted(chunk_doc_rows, doc_row, side='left'),
+                                   np.searchsorted(chunk_doc_rows, doc_row, side='right'))
+            if rows is not None and len(chunk_rows):
+                positions = np.minimum(np.searchsorted(rows, chunk_rows), len(rows) - 1)
+                chunk_rows = chunk_rows[rows[positions] == chunk_rows]
+            if not len(chunk_rows):
+                continue
+            # Filters apply to whole documents, so the remaining chunks are still contiguous
+            scores = embeddings.scores(query_embedding, int(chunk_rows[0]), int(chunk_rows[-1]) + 1)
+            best = int(np.argmax(scores))
+            carried[doc_row] = (int(chunk_rows[best]), float(scores[best]))
+        if carried:
+            ranked = sorted({**best_chunks, **carried}.items(), key=lambda item: item[1][1], reverse=True)
+            best_chunks.clear()
+            best_chunks.update(ranked[:top_k])
+    
+    @staticmethod
+    def is_follow_up(query: str) -> bool:
+        """Whether a question reads as a follow-up to earlier turns (see FOLLOW_UP_PATTERN)."""
+        if FOLLOW_UP_PATTERN.search(query):
+            return True
+        return len(query.split()) <= FOLLOW_UP_MAX_WORDS and FOLLOW_UP_REFERENCE_PATTERN.search(query) is not None
+    
+    @staticmethod
+    def follow_up_history(query: str, chat_history: Optional[List]) -> Tuple[str, ...]:
+        """Return the earlier user turns to retrieve a follow-up question with, most recent first.
+        
+        Only questions that read as follow-ups ("and what about last
+        quarter?") use the history; standalone questions return ().
+        ``chat_history`` is the client's list of {"role", "content"} messages.
+        """
+        if not chat_history or not SimpleRAG.is_follow_up(query):
+            return ()
+        current = normalize_query(query)
+        turns = []
+        for message in reversed(chat_history):
+            if not isinstance(message, dict) or message.get("role") != "user":
+                continue
+            content = message.get("content")
+            if isinstance(content, str) and content.strip() and normalize_query(content) != current:
+                turns.append(content)
+                if len(turns) == HISTORY_TURNS:
+                    break
+        return tuple(turns)
+    
+    def session(self, user_id: Optional[str]) -> Optional[ConversationSession]:
+        """Return the cached conversation session of ``user_id``, creating it if needed."""
+        if not user_id:
+            return None
+        session = self.sessions.get(user_id)
+        if session is None:
+            session = ConversationSession()
+            self.sessions.put(user_id, session)
+        return session
+    
+    def _search_chunks(self, search: Callable[[int], Tuple[np.ndarray, np.ndarray]], n_chunks: int,
+                       top_k: int) -> Dict[int, Tuple[int, float]]:
+        """Return {doc_row: (chunk row, score)} for the top_k distinct live parent documents.
+
+        ``search(k)`` ranks the best k chunks. Fetches several chunks per
+        wanted document and widens the search until enough distinct parents
+        are found or every chunk was ranked.
+        """
+        if top_k <= 0 or n_chunks <= 0:
+            return {}
+        chunk_doc_rows = self.chunk_doc_rows
+        deleted_rows = self.deleted_rows
+        k = min(n_chunks, top_k * CHUNK_OVERSAMPLE)
+        while True:
+            rows, scores = search(k)
+            best = {}
+            for row, score in zip(rows, scores):
+                doc_row = int(chunk_doc_rows[row])
+                if doc_row not in best and doc_row not in deleted_rows:
+                    best[doc_row] = (int(row), float(score))
+                    if len(best) == top_k:
+                        return best
+            if k >= n_chunks:
+                return best
+            k = min(n_chunks, k * 2)
+    
+    def _hybrid_search(self, dense_search: Callable[[int], Tuple[np.ndarray, np.ndarray]], n_candidates: int,
+                       lexical_index: BM25Index, query: str, query_embedding: np.ndarray, k: int,
+                       rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Rank chunks by weighted reciprocal rank fusion of the dense and BM25 top k.
         
-        # Return the top-k documents
-        relevant_docs = [self.document_store[i] for i in top_indices]
+        ``rows`` optionally restricts BM25 to the (sorted) chunk rows that
+        ``dense_search`` also ranks.
+        """
+        lexical_rows, _ = lexical_index.search(query, max(k, self.lexical_prefilter), rows)
         
-        # Add similarity scores for debugging
-        for i, doc in enumerate(relevant_docs):
-            doc["similarity_score"] = float(similarities[top_indices[i]])
+        if 0 < self.lexical_prefilter < n_candidates and len(lexical_rows) >= k:
+            # Score only the lexical candidates instead of every candidate row
+            candidate_scores = self.document_embeddings.take(lexical_rows).scores(query_embedding)
+            dense_rows = lexical_rows[_top_k(candidate_scores, k)]
+        else:
+            dense_rows, _ = dense_search(k)
         
-        return relevant_docs
+        fused = {}
+        for weight, rows in ((self.dense_weight, dense_rows), (self.sparse_weight, lexical_rows[:k])):
+            for rank, row in enumerate(rows.tolist()):
+                fused[row] = fused.get(row, 0.0) + weight / (RRF_K + rank + 1)
+        rows = sorted(fused, key=fused.get, reverse=True)
+        return np.array(rows, dtype=np.int64), np.array([fused[row] for row in rows], dtype=np.float32)
     
     def check_glossary_terms(self, query: str) -> Dict:
         """Check if the query contains any terms from our glossary."""
+        start = time.perf_counter()
         query_lower = query.lower()
         found_terms = {}
         
-        # Check for exact terms (prioritize longer matches)
-        sorted_terms = sorted(self.glossary.keys(), key=len, reverse=True)
-        for term in sorted_terms:
-            if term in query_lower:
-                found_terms[term] = self.glossary[term]
-                if len(found_terms) >= 2:  # Limit to prevent overwhelming responses
-                    break
+        # Whole-word matches, longer terms first; limit to prevent overwhelming responses
+        for term in self.glossary_matcher.find(query_lower, limit=2):
+            found_terms[term] = self.glossary[term]
         
+        self.stage_latency.observe("glossary", time.perf_counter() - start)
         return found_terms
     
-    def get_relevant_market_data(self, query: str) -> Dict:
+    def check_glossary_terms_batch(self, queries: List[str]) -> List[Dict]:
+        """``check_glossary_terms`` for each query, matched in one automaton pass."""
+        matches = self.glossary_matcher.find_batch([query.lower() for query in queries], limit=2)
+        return [{term: self.glossary[term] for term in terms} for terms in matches]
+    
+    def get_relevant_market_data(self, query: str, snapshot: Optional[MarketSnapshot] = None) -> Dict:
         """Extract relevant market data based on the query."""
-        result = {}
-        query_lower = query.lower()
-        
-        # Check for economic indicators
-        if any(term in query_lower for term in ["inflation", "cpi", "price index"]):
-            result["inflation"] = self.current_trends.get("inflation_rate", "Data not available")
-        
-        if any(term in query_lower for term in ["interest rate", "repo", "repo rate"]):
-            result["repo_rate"] = self.current_trends.get("repo_rate", "Data not available")
-        
-        if any(term in query_lower for term in ["gdp", "growth", "economic growth"]):
-            result["gdp_growth"] = self.current_trends.get("gdp_growth", "Data not available")
-        
-        # Check for market indices
-        if any(term in query_lower for term in ["sensex", "stock market", "share market", "bse"]):
-            result["SENSEX"] = self.market_data.get("indices", {}).get("SENSEX", "Data not available")
-        
-        if any(term in query_lower for term in ["nifty", "nse"]):
-            result["NIFTY"] = self.market_data.get("indices", {}).get("NIFTY", "Data not available")
-        
-        # Check for commodities
-        if "gold" in query_lower:
-            result["Gold"] = self.market_data.get("commodities", {}).get("Gold", "Data not available")
-        
-        if any(term in query_lower for term in ["oil", "crude", "petroleum"]):
-            result["Crude Oil"] = self.market_data.get("commodities", {}).get("Crude Oil", "Data not available")
-        
+        start = time.perf_counter()
+        if snapshot is None:
+            snapshot = self.market
+        result = snapshot.lookup(query)
+        self.stage_latency.observe("market", time.perf_counter() - start)
         return result
     
-    def generate_response(self, query: str, chat_history: List = None) -> Dict:
-        """Generate a response to the user query using retrieval and synthesis."""
+    def generate_response(self, query: str, chat_history: List = None, filters: Optional[Dict] = None,
+                          user_id: Optional[str] = None) -> Dict:
+        """Generate a response to the user query using retrieval and synthesis.
+        
+        ``filters`` are retrieval filters as returned by ``parse_filters``.
+        Follow-up questions are retrieved in the context of ``chat_history``,
+        reusing the turn embeddings cached for ``user_id``.
+        """
         if chat_history is None:
             chat_history = []
+        filters = filters or {}
+        history = self.follow_up_history(query, chat_history)
         
-        # Initialize response data
-        response_data = {
-            "answer": "",
-            "sources": [],
-            "glossary_terms": {},
-            "market_data": {}
-        }
+        # Repeated questions are answered from the response cache
+        cache_key = self._response_cache_key(query, filters, history)
+        cached = self._cached_response(cache_key)
+        if cached is not None:
+            return cached
+        market = self.market
         
         try:
             # Step 1: Retrieve relevant documents
-            relevant_docs = self.retrieve_relevant_documents(query, top_k=3)
+            relevant_docs = self.retrieve_relevant_documents(query, top_k=3, history=history,
+                                                             session=self.session(user_id), **filters)
             
             # Step 2: Check glossary for relevant terms
             glossary_terms = self.check_glossary_terms(query)
             
             # Step 3: Get relevant market data
-            market_data = self.get_relevant_market_data(query)
+            market_data = self.get_relevant_market_data(query, market)
             
-            # Step 4: Generate answer based on retrieved information
-            answer = self._synthesize_answer(query, relevant_docs, glossary_terms, market_data, chat_history)
+            response_data = self._assemble_response(query, relevant_docs, glossary_terms, market_data, chat_history)
+            self._cache_response(cache_key, response_data, market)
+            return response_data
             
-            # Step 5: Format sources information
-            sources = []
-            for doc in relevant_docs:
-                source_info = {
-                    "type": doc.get("source", "unknown"),
-                    "title": doc.get("title", "Untitled")
-                }
-                if "date" in doc:
-                    source_info["date"] = doc["date"]
-                sources.append(source_info)
+        except Exception as e:
+            logger.error(f"Error generating response: {e}")
+            return self._error_response()
+    
+    def generate_responses(self, queries: List[str], filters: Optional[Dict] = None,
+                           batch_size: int = DEFAULT_ENCODE_BATCH_SIZE) -> Iterator[Dict]:
+        """Answer many standalone queries, yielding one response per query in order.
+        
+        Queries are processed ``batch_size`` at a time: each batch is embedded
+        in one model call, scored with matrix-matrix products and matched
+        against the glossary and market keywords in single automaton passes.
+        Repeated queries reuse cached embeddings, but the response cache is
+        bypassed so that bulk runs do not evict interactive answers. A batch
+        that fails yields error responses for each of its queries.
+        """
+        filters = filters or {}
+        for batch_start in range(0, len(queries), batch_size):
+            batch = queries[batch_start:batch_start + batch_size]
+            market = self.market
+            try:
+                # Steps 1-3: Retrieval, glossary and market lookups for the whole batch
+                docs_batch = self.retrieve_batch(batch, top_k=3, **filters)
+                glossary_batch = self.check_glossary_terms_batch(batch)
+                market_batch = market.lookup_batch(batch)
+                
+                responses = [self._assemble_response(query, relevant_docs, glossary_terms, market_data, [])
+                             for query, relevant_docs, glossary_terms, market_data
+                             in zip(batch, docs_batch, glossary_batch, market_batch)]
+            except Exception as e:
+                logger.error(f"Error generating batch responses: {e}")
+                responses = [self._error_response() for _ in batch]
+            yield from responses
+    
+    async def agenerate_response(self, query: str, chat_history: List = None, executor=None,
+                                 filters: Optional[Dict] = None, user_id: Optional[str] = None) -> Dict:
+        """Asyncio variant of generate_response that overlaps the pipeline stages.
+        
+        Retrieval, including the CPU-bound query encode, runs in ``executor``
+        while the glossary and market lookups run on the event loop. Cancelling
+        the awaiting task abandons the retrieval result; the executor job itself
+        runs to completion in the background.
+        """
+        if chat_history is None:
+            chat_history = []
+        filters = filters or {}
+        history = self.follow_up_history(query, chat_history)
+        
+        cache_key = self._response_cache_key(query, filters, history)
+        cached = self._cached_response(cache_key)
+        if cached is not None:
+            return cached
+        market = self.market
+        
+        loop = asyncio.get_running_loop()
+        try:
+            # Step 1: Start retrieval off the event loop
+            retrieval = loop.run_in_executor(executor, functools.partial(
+                self.retrieve_relevant_documents, query, 3, history=history,
+                session=self.session(user_id), **filters))
+            
+            # Steps 2-3: Glossary and market lookups overlap with retrieval
+            try:
+                glossary_terms = self.check_glossary_terms(query)
+                market_data = self.get_relevant_market_data(query, market)
+            except BaseException:
+                retrieval.cancel()
+                raise
             
-            # Step 6: Assemble the response
-            response_data["answer"] = answer
-            response_data["sources"] = sources
-            response_data["glossary_terms"] = glossary_terms
-            response_data["market_data"] = market_data
+            relevant_docs = await retrieval
             
+            response_data = self._assemble_response(query, relevant_docs, glossary_terms, market_data, chat_history)
+            self._cache_response(cache_key, response_data, market)
             return response_data
             
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             logger.error(f"Error generating response: {e}")
-            return {
-                "answer": "I'm sorry, I encountered an error while processing your query. Please try again.",
-                "sources": [],
-                "glossary_terms": {},
-                "market_data": {}
+            return self._error_response()
+    
+    @staticmethod
+    def _response_cache_key(query: str, filters: Dict, history: Tuple[str, ...] = ()):
+        """Cache key of a response: the normalized query plus any retrieval filters and history turns."""
+        key = normalize_query(query)
+        if not filters and not history:
+            return key
+        return key, tuple(sorted(filters.items())), tuple(normalize_query(turn) for turn in history)
+    
+    def _cached_response(self, cache_key) -> Optional[Dict]:
+        """Look up a cached response, ignoring ones that quote superseded market data."""
+        cached = self.response_cache.get(cache_key)
+        if cached is None:
+            return None
+        market_version, response_data = cached
+        if market_version is not None and market_version != self.market.version:
+            return None
+        return response_data
+    
+    def _cache_response(self, cache_key, response_data: Dict, market: MarketSnapshot):
+        """Cache a response, tagged with the market data version it quotes (if any)."""
+        market_version = market.version if response_data["market_data"] else None
+        self.response_cache.put(cache_key, (market_version, response_data))
+    
+    def _assemble_response(self, query: str, relevant_docs: List[RetrievedDocument], glossary_terms: Dict,
+                           market_data: Dict, chat_history: List) -> Dict:
+        """Synthesize the answer and package it with its sources."""
+        start = time.perf_counter()
+        # Step 4: Generate answer based on retrieved information
+        context = self.build_prompt_context(query, relevant_docs, glossary_terms, market_data, chat_history)
+        answer = self.generator.generate(context)
+        
+        # Steps 5-6: Format sources information and assemble the response
+        response_data = {
+            "answer": answer,
+            "sources": self._format_sources(relevant_docs),
+            "glossary_terms": glossary_terms,
+            "market_data": market_data
+        }
+        self.stage_latency.observe("synthesis", time.perf_counter() - start)
+        return response_data
+    
+    @staticmethod
+    def _format_sources(relevant_docs: List[RetrievedDocument]) -> List[Dict]:
+        sources = []
+        for doc in relevant_docs:
+            source_info = {
+                "type": doc.get("source", "unknown"),
+                "title": doc.get("title", "Untitled")
             }
+            if "date" in doc:
+                source_info["date"] = doc["date"]
+            sources.append(source_info)
+        return sources
+    
+    @staticmethod
+    def _error_response() -> Dict:
+        """Fallback response returned when the pipeline fails."""
+        return {
+            "answer": "I'm sorry, I encountered an error while processing your query. Please try again.",
+            "sources": [],
+            "glossary_terms": {},
+            "market_data": {}
+        }
     
-    def _synthesize_answer(self, query: str, docs: List[Dict], glossary_terms: Dict, 
-                          market_data: Dict, chat_history: List) -> str:
-        """Synthesize an answer from retrieved information."""
-        # This is a simple version that doesn't use an actual LLM
-        # In a production system, you would use an actual LLM here
+    def build_prompt_context(self, query: str, docs: List[RetrievedDocument], glossary_terms: Dict,
+                             market_data: Dict, chat_history: List) -> PromptContext:
+        """Select the context for the generator within ``context_tokens``.
         
-        if not docs:
-            # No relevant documents found
-            if glossary_terms:
-                # But we found glossary terms
-                terms_list = list(glossary_terms.keys())
-                if len(terms_list) == 1:
-                    return f"I see you're asking about '{terms_list[0]}'. {glossary_terms[terms_list[0]]}"
-                else:
-                    definitions = [f"'{term}': {glossary_terms[term]}" for term in terms_list]
-                    return f"I found these relevant terms in your query:\n\n" + "\n\n".join(definitions)
-            
-            if market_data:
-                # We have market data
-                data_points = [f"{key}: {value}" for key, value in market_data.items()]
-                return f"Here's the latest data related to your query:\n\n" + "\n".join(data_points)
-            
-            # Generic response for no information
-            return "I don't have specific information on that topic yet. Please try asking about economics, finance, or market data that might be in my knowledge base."
+        Market figures and glossary definitions are short and go first.
+        Retrieved passages follow in rank order, the last one cut at a word
+        boundary; passages that would get fewer than MIN_PASSAGE_TOKENS are
+        dropped. Recent chat turns fill whatever budget remains, so prompt
+        size (and generation latency) is bounded however long the retrieved
+        chunks or the history are.
+        """
+        budget = self.context_tokens
+        for key, value in itertools.chain(market_data.items(), glossary_terms.items()):
+            budget -= estimate_tokens(f"- {key}: {value}")
         
-        # We have relevant documents
-        answer_parts = []
+        passages = []
+        for doc in docs:
+            if budget < MIN_PASSAGE_TOKENS:
+                break
+            label = doc.get("title") or doc.get("indicator") or "Untitled"
+            details = ", ".join(str(value) for value in (doc.get("source"), doc.get("date") or doc.get("period"))
+                                if value)
+            label = f"{label} ({details})" if details else label
+            budget -= estimate_tokens(label)
+            text = truncate_text(doc.get("chunk") or doc.get("content", ""), max(0, budget) * CHARS_PER_TOKEN)
+            budget -= estimate_tokens(text)
+            passages.append((label, text))
         
-        # Use content from most relevant document
-        main_content = docs[0].get("content", "")
-        if len(main_content) > 300:
-            main_content = main_content[:300] + "..."
-        answer_parts.append(main_content)
+        history = []
+        for message in reversed(chat_history or []):
+            if budget < MIN_PASSAGE_TOKENS or not isinstance(message, dict):
+                break
+            content = message.get("content")
+            if not isinstance(content, str) or not content.strip():
+                continue
+            role = "User" if message.get("role") == "user" else "Assistant"
+            text = truncate_text(content.strip(), min(budget * CHARS_PER_TOKEN, 400))
+            budget -= estimate_tokens(text)
+            history.append((role, text))
+        history.reverse()
         
-        # Add glossary definitions if any
-        if glossary_terms:
-            terms_text = "\n\nRelated terms:\n"
-            terms_text += "\n".join([f"- {term.capitalize()}: {definition}" for term, definition in glossary_terms.items()])
-            answer_parts.append(terms_text)
+        return PromptContext(query, passages, glossary_terms, market_data, history)
+    
+    def stream_response(self, query: str, chat_history: List = None, filters: Optional[Dict] = None,
+                        user_id: Optional[str] = None) -> Iterator[Tuple[str, Dict]]:
+        """Generate a response incrementally, as (event, data) pairs for server-sent events.
         
-        # Add market data if any
-        if market_data:
-            market_text = "\n\nRelevant market data:\n"
-            market_text += "\n".join([f"- {key}: {value}" for key, value in market_data.items()])
-            answer_parts.append(market_text)
+        A "context" event carries the sources, glossary terms and market
+        data as soon as retrieval is done, "token" events carry the answer
+        as the generator writes it and a final "done" event the whole answer.
+        Completed answers are cached like those of ``generate_response``.
+        """
+        if chat_history is None:
+            chat_history = []
+        filters = filters or {}
+        history = self.follow_up_history(query, chat_history)
         
-        return " ".join(answer_parts)
+        cache_key = self._response_cache_key(query, filters, history)
+        cached = self._cached_response(cache_key)
+        if cached is not None:
+            yield "context", {key: cached[key] for key in ("sources", "glossary_terms", "market_data")}
+            yield "token", {"text": cached["answer"]}
+            yield "done", {"response": cached["answer"]}
+            return
+        market = self.market
+        start = time.perf_counter()
+        
+        # Steps 1-3: Retrieval, glossary and market lookups
+        relevant_docs = self.retrieve_relevant_documents(query, top_k=3, history=history,
+                                                         session=self.session(user_id), **filters)
+        glossary_terms = self.check_glossary_terms(query)
+        market_data = self.get_relevant_market_data(query, market)
+        response_data = {
+            "answer": "",
+            "sources": self._format_sources(relevant_docs),
+            "glossary_terms": glossary_terms,
+            "market_data": market_data
+        }
+        yield "context", {key: response_data[key] for key in ("sources", "glossary_terms", "market_data")}
+        
+        # Step 4: Stream the answer as it is generated
+        synthesis_start = time.perf_counter()
+        context = self.build_prompt_context(query, relevant_docs, glossary_terms, market_data, chat_history)
+        pieces = []
+        for piece in self.generator.stream(context):
+            if not pieces:
+                self.stage_latency.observe("first_token", time.perf_counter() - start)
+            pieces.append(piece)
+            yield "token", {"text": piece}
+        self.stage_latency.observe("synthesis", time.perf_counter() - synthesis_start)
+        
+        response_data["answer"] = "".join(pieces)
+        self._cache_response(cache_key, response_data, market)
+        yield "done", {"response": response_data["answer"]}
 
 # Initialize the RAG system
 rag_system = None
 
-def initialize_rag():
-    """Initialize the RAG system with the specified data path."""
-    global rag_system
+# Keyword arguments for SimpleRAG, filled in from the command line
+rag_options = {}
+
+# Readiness of the RAG system: starting, loading_model, indexing, ready or failed
+rag_state = "starting"
+
+# Thread loading the RAG system in fast-start mode
+rag_loader = None
+
+# Serializes lazy initialization from concurrent requests
+rag_init_lock = threading.Lock()
+
+# Sampling profiler, toggled at runtime through /api/profiler
+profiler = SamplingProfiler()
+
+def _set_rag_state(state: str):
+    global rag_state
+    rag_state = state
+    logger.info(f"RAG system state: {state}")
+
+def initialize_rag(background: bool = False):
+    """Initialize the RAG system with the specified data path.
+    
+    With ``background`` the model and index are loaded in a daemon thread
+    and this returns immediately; progress is reported through ``rag_state``.
+    """
+    global rag_system, rag_loader
+    if background:
+        rag_loader = threading.Thread(target=initialize_rag, name="rag-loader", daemon=True)
+        rag_loader.start()
+        return True
+    
     try:
-        rag_system = SimpleRAG()
+        rag_system = SimpleRAG(on_state=_set_rag_state, **rag_options)
+        _set_rag_state("ready")
         return True
     except Exception as e:
         logger.error(f"Error initializing RAG: {e}")
+        _set_rag_state("failed")
         return False
 
+def _not_ready_response():
+    """503 response telling clients to retry while the RAG system loads."""
+    response = jsonify({
+        "error": "RAG system is not ready",
+        "state": rag_state
+    })
+    response.headers["Retry-After"] = "5"
+    return response, 503
+
+def log_chat_request(user_id: Optional[str], message: str, seconds: float):
+    """Log a processed chat request without the raw message text.
+    
+    Queries are identified by a short hash of their normalized form, so
+    repeated questions can still be counted.
+    """
+    if logger.isEnabledFor(logging.INFO):
+        query_hash = hashlib.sha1(normalize_query(message).encode("utf-8")).hexdigest()[:12]
+        logger.info("Query from %s (query %s, %d chars) - Processed in %.3fs",
+                    user_id or "anonymous", query_hash, len(message), seconds)
+
+def render_metrics(rag: Optional["SimpleRAG"]) -> str:
+    """Render the RAG system's metrics in the Prometheus text exposition format."""
+    lines = []
+    
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    
+    metric("esom_ready", "gauge", "Whether the RAG system is loaded", [({}, int(rag is not None))])
+    metric("esom_profiler_running", "gauge", "Whether the sampling profiler is collecting stacks",
+           [({}, int(profiler.running))])
+    if rag is None:
+        return "\n".join(lines) + "\n"
+    
+    samples = []
+    sums = []
+    counts = []
+    for stage, histogram in rag.stage_latency.histograms.items():
+        cumulative, total, count = histogram.snapshot()
+        for bound, value in zip(list(LatencyHistogram.BUCKETS) + ["+Inf"], cumulative):
+            samples.append(({"stage": stage, "le": bound}, value))
+        sums.append(({"stage": stage}, total))
+        counts.append(({"stage": stage}, count))
+    lines.append("# HELP esom_stage_latency_seconds Latency of the chat pipeline stages")
+    lines.append("# TYPE esom_stage_latency_seconds histogram")
+    for suffix, stage_samples in (("_bucket", samples), ("_sum", sums), ("_count", counts)):
+        for labels, value in stage_samples:
+            label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+            lines.append(f"esom_stage_latency_seconds{suffix}{{{label_text}}} {value}")
+    
+    metric("esom_model_load_seconds", "gauge", "Time taken to load the embedding model",
+           [({}, rag.model_load_seconds)])
+    metric("esom_corpus_load_seconds", "gauge", "Time taken to load, embed and index the corpus",
+           [({}, rag.corpus_load_seconds)])
+    metric("esom_documents", "gauge", "Live documents in the corpus", [({}, rag.document_count())])
+    metric("esom_chunks", "gauge", "Embedded document chunks", [({}, len(rag.chunk_doc_rows))])
+    embeddings = rag.document_embeddings
+    metric("esom_embeddings_bytes", "gauge", "Size of the document embedding matrix",
+           [({}, embeddings.nbytes if embeddings is not None else 0)])
+    if rag.lexical_index is not None:
+        metric("esom_lexical_terms", "gauge", "Terms in the BM25 vocabulary",
+               [({}, len(rag.lexical_index.vocabulary))])
+        metric("esom_lexical_postings", "gauge", "Postings in the BM25 index",
+               [({}, len(rag.lexical_index.rows) + len(rag.lexical_index.tail_rows))])
+    metric("esom_market_data_version", "gauge", "Version of the loaded market data snapshot",
+           [({}, rag.market.version)])
+    
+    caches = {"query_embeddings": rag.query_cache.stats(), "responses": rag.response_cache.stats(),
+              "sessions": rag.sessions.stats()}
+    for name, kind, help_text, field in (
+            ("esom_cache_hits_total", "counter", "Cache lookups that found an entry", "hits"),
+            ("esom_cache_misses_total", "counter", "Cache lookups that found no entry", "misses"),
+            ("esom_cache_evictions_total", "counter", "Entries evicted to respect the cache size", "evictions"),
+            ("esom_cache_hit_ratio", "gauge", "Fraction of cache lookups that were hits", "hit_rate"),
+            ("esom_cache_entries", "gauge", "Entries currently cached", "size")):
+        metric(name, kind, help_text, [({"cache": cache}, stats[field]) for cache, stats in caches.items()])
+    
+    if rag.query_batcher is not None:
+        batcher = rag.query_batcher.metrics()
+        metric("esom_query_batcher_queue_depth", "gauge", "Queries waiting to be encoded",
+               [({}, batcher["queue_depth"])])
+        metric("esom_query_batcher_batches_total", "counter", "Encode calls made by the query batcher",
+               [({}, batcher["batches"])])
+        metric("esom_query_batcher_requests_total", "counter", "Queries encoded by the query batcher",
+               [({}, batcher["requests"])])
+    
+    if rag.shard_client is not None:
+        shards = rag.shard_client.stats()
+        for name, help_text, field in (
+                ("esom_shard_requests_total", "Requests sent to the shard", "requests"),
+                ("esom_shard_failures_total", "Shard requests that failed", "failures"),
+                ("esom_shard_timeouts_total", "Shard requests that missed the shard timeout", "timeouts")):
+            metric(name, "counter", help_text, [({"shard": shard["url"]}, shard[field]) for shard in shards])
+        metric("esom_shard_partial_results_total", "counter", "Searches answered without every shard",
+               [({}, rag.shard_client.partial_results)])
+    return "\n".join(lines) + "\n"
+
+def _build_snapshot(options: Dict, directory: str):
+    """Build the RAG system once and write its snapshot (runs in a spawned process)."""
+    SimpleRAG(**options).save_snapshot(directory)
+
+def _run_worker(listener: socket.socket, host: str, port: int, background: bool):
+    """Serve requests on the inherited listening socket (runs in a forked worker)."""
+    from werkzeug.serving import make_server
+    
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    if not initialize_rag(background=background):
+        os._exit(1)
+    server = make_server(host, port, app, threaded=True, fd=listener.fileno())
+    server.serve_forever()
+
+def serve_prefork(host: str, port: int, workers: int, background: bool = False) -> bool:
+    """Serve the app from a pre-forked pool of worker processes.
+    
+    Unless an index artifact was given, the index is built once, in a
+    spawned process so that this parent never loads the model, and saved as
+    a snapshot. Every worker memory-maps that
+    snapshot read-only, so the embedding matrix, chunk arrays, document blob
+    and index are shared through the page cache; each worker only loads its
+    own model. Workers accept connections from one shared listening socket
+    and are replaced if they exit.
+    """
+    # Workers share a prebuilt artifact (or the shards) as is; otherwise build a snapshot first
+    if not rag_options.get("snapshot_path") and not rag_options.get("shards"):
+        snapshot_path = os.path.join(rag_options.get("data_path", DEFAULT_DATA_PATH), SNAPSHOT_DIR)
+        builder = multiprocessing.get_context("spawn").Process(
+            target=_build_snapshot, args=(dict(rag_options), snapshot_path), name="snapshot-builder")
+        builder.start()
+        builder.join()
+        if builder.exitcode != 0:
+            logger.error("Failed to build the index snapshot")
+            return False
+        rag_options["snapshot_path"] = snapshot_path
+    
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    listener = socket.create_server((host, port), family=family, backlog=1024)
+    children = {}
+    
+    # Threads do not survive fork, so each worker restarts its own profiler
+    profiling = profiler.running
+    
+    def start_worker():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                if profiling:
+                    profiler.start(profiler.interval)
+                _run_worker(listener, host, port, background)
+            finally:
+                os._exit(1)
+        children[pid] = time.monotonic()
+    
+    stopping = False
+    
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    
+    logger.info(f"Starting {workers} workers on {host}:{port}")
+    for _ in range(workers):
+        start_worker()
+    
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = children.pop(pid, None)
+        if stopping or started is None:
+            continue
+        logger.warning(f"Worker {pid} exited with status {status}, starting a replacement")
+        # Back off when workers die right after starting, e.g. on a bad snapshot
+        if time.monotonic() - started < 10:
+            time.sleep(1)
+        start_worker()
+    
+    listener.close()
+    return True
+
+def _run_shard(options: Dict, host: str, port: int, token: str):
+    """Index one partition and serve it (runs in a spawned process)."""
+    from werkzeug.serving import make_server
+    
+    global admin_token
+    admin_token = token
+    rag_options.update(options)
+    if not initialize_rag():
+        raise SystemExit(1)
+    shard, count = options["shard"]
+    logger.info(f"Serving shard {shard}/{count} on {host}:{port}")
+    make_server(host, port, app, threaded=True).serve_forever()
+
+def start_local_shards(count: int, base_port: int, token: str, host: str = "127.0.0.1") -> List[str]:
+    """Start ``count`` shard servers on consecutive ports from ``base_port`` and return their URLs.
+    
+    Each shard is a spawned daemon process indexing its partition of the
+    data path with the current ``rag_options`` and ``token`` as its admin
+    token; they exit with this process.
+    """
+    context = multiprocessing.get_context("spawn")
+    urls = []
+    for shard in range(count):
+        options = dict(rag_options, shard=(shard, count))
+        options.pop("shards", None)
+        process = context.Process(target=_run_shard, args=(options, host, base_port + shard, token),
+                                  name=f"shard-{shard}", daemon=True)
+        process.start()
+        urls.append(f"http://{host}:{base_port + shard}")
+    logger.info(f"Started {count} local shards: {', '.join(urls)}")
+    return urls
+
 @app.route('/', methods=['GET'])
 def home():
     """Homepage route that displays a simple test page"""
@@ -477,6 +4098,9 @@ def home():
             <div class="endpoint">
                 <h3>Available Endpoint:</h3>
                 <p><code>POST /api/chat</code> - Send economics & finance questions</p>
+                <p><code>POST /api/chat/stream</code> - The same, answered as server-sent events</p>
+                <p><code>POST /api/chat/batch</code> - Answer a list of queries, streamed back as NDJSON</p>
+                <p><code>POST /api/shard/search</code> - Local top-k of this server as a retrieval shard</p>
                 <p>This endpoint accepts JSON with the format:</p>
                 <pre><code>{
     "message": "Your question about economics or finance",
@@ -497,55 +4121,334 @@ def home():
 
 @app.route('/api/health', methods=['GET'])
 def health():
-    """Health check endpoint that returns a 200 status"""
+    """Health check endpoint that returns a 200 status once the RAG system is ready"""
+    if rag_system is None and rag_loader is not None:
+        return jsonify({
+            "status": rag_state,
+            "message": "ESOM Finance API is starting"
+        }), 503
+    
     return jsonify({
         "status": "ok",
+        "state": rag_state,
         "message": "ESOM Finance API is running"
     })
 
-@app.route('/api/chat', methods=['POST'])
-def chat():
-    """Endpoint for handling chat requests"""
-    # Check if RAG system is initialized
-    global rag_system
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    """Runtime statistics of the RAG system"""
     if rag_system is None:
-        if not initialize_rag():
+        return _not_ready_response()
+    
+    stats_data = {
+        "documents": rag_system.document_count(),
+        "chunks": len(rag_system.chunk_doc_rows),
+        "retrieval_mode": rag_system.retrieval_mode,
+        "caches": {
+            "query_embeddings": rag_system.query_cache.stats(),
+            "responses": rag_system.response_cache.stats(),
+            "sessions": rag_system.sessions.stats()
+        },
+        "market_data": {
+            "version": rag_system.market.version,
+            "loaded_at": rag_system.market.loaded_at
+        }
+    }
+    if rag_system.index_manifest is not None:
+        stats_data["index_artifact"] = {key: rag_system.index_manifest.get(key)
+                                        for key in ("version", "created_at", "model_name", "index_backend")}
+    if rag_system.query_batcher is not None:
+        stats_data["query_batcher"] = rag_system.query_batcher.metrics()
+    if rag_system.shard is not None:
+        stats_data["shard"] = rag_system.shard_info()
+    if rag_system.shard_client is not None:
+        stats_data["shards"] = rag_system.shard_client.stats()
+        stats_data["partial_results"] = rag_system.shard_client.partial_results
+    return jsonify(stats_data)
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics: per-stage latency histograms, index size, cache hit rates and load times"""
+    return render_metrics(rag_system), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+def require_admin(view):
+    """Serve an admin endpoint only to requests carrying the admin token as a bearer token."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not admin_token:
             return jsonify({
-                "error": "RAG system initialization failed"
-            }), 500
+                "error": "Admin endpoints are disabled; start the server with --admin-token to enable them"
+            }), 403
+        supplied = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(supplied.encode("utf-8"), f"Bearer {admin_token}".encode("utf-8")):
+            return jsonify({"error": "Invalid or missing admin token"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/api/profiler', methods=['GET', 'POST'])
+@require_admin
+def profile():
+    """Toggle the sampling profiler (POST) or download its folded stacks (GET)"""
+    if request.method == 'GET':
+        return profiler.folded(), 200, {"Content-Type": "text/plain; charset=utf-8"}
+    
+    data = request.json or {}
+    if data.get('enabled', True):
+        interval_ms = float(data.get('interval_ms', 10))
+        if interval_ms <= 0:
+            return jsonify({
+                "error": "interval_ms must be positive"
+            }), 400
+        profiler.start(interval_ms / 1000.0, reset=data.get('reset', True))
+    else:
+        profiler.stop()
+    return jsonify({
+        "running": profiler.running,
+        "interval_ms": profiler.interval * 1000,
+        "samples": profiler.samples
+    })
+
+@app.route('/api/ingest', methods=['POST'])
+@require_admin
+def ingest():
+    """Add documents to the live index without restarting"""
+    if rag_system is None:
+        return _not_ready_response()
     
-    # Parse request data
     data = request.json
-    if not data:
+    if rag_system.read_only:
+        return jsonify({"error": "Ingestion is not available for a read-only (snapshot or sharded) index"}), 409
+    
+    documents = data.get("documents") if isinstance(data, dict) else data
+    if not documents or not isinstance(documents, list):
+        return jsonify({
+            "error": "No documents provided"
+        }), 400
+    
+    try:
+        ids = rag_system.ingest_documents(documents)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error ingesting documents: {e}")
+        return jsonify({
+            "error": "An error occurred while ingesting documents",
+            "message": str(e)
+        }), 500
+    
+    return jsonify({"ingested": len(ids), "ids": ids})
+
+@app.route('/api/documents/<doc_id>', methods=['DELETE'])
+@require_admin
+def delete_document(doc_id):
+    """Remove a document from the live index"""
+    if rag_system is None:
+        return _not_ready_response()
+    
+    if rag_system.read_only:
+        return jsonify({"error": "Deletion is not available for a read-only (snapshot or sharded) index"}), 409
+    
+    if not rag_system.delete_document(doc_id):
+        return jsonify({"error": f"Unknown document: {doc_id}"}), 404
+    return jsonify({"deleted": doc_id})
+
+@app.route('/api/shard/info', methods=['GET'])
+def shard_info():
+    """Partition, size and embedding model of this server as a retrieval shard"""
+    if rag_system is None:
+        return _not_ready_response()
+    return jsonify(rag_system.shard_info())
+
+@app.route('/api/shard/search', methods=['POST'])
+@require_admin
+def shard_search():
+    """Local top-k hits for a batch of query embeddings sent by a sharded coordinator
+    
+    Accepts {"embeddings": base64 little-endian float32, "shape": [n, dim],
+    "queries": [...], "top_k": k, "filters": {...}} with the admin token;
+    dim must match the embedding model and k be at most MAX_SHARD_TOP_K.
+    """
+    if rag_system is None:
+        return _not_ready_response()
+    
+    data = request.json or {}
+    try:
+        embeddings = np.frombuffer(base64.b64decode(data["embeddings"]), dtype='<f4').reshape(data["shape"])
+        queries = data["queries"]
+        if embeddings.ndim != 2 or len(embeddings) != len(queries):
+            raise ValueError("embeddings must hold one row per query")
+        if len(queries) > MAX_BATCH_QUERIES:
+            raise ValueError(f"At most {MAX_BATCH_QUERIES} queries are accepted per request")
+        dimension = rag_system.embeddings_model.get_sentence_embedding_dimension()
+        if embeddings.shape[1] != dimension:
+            raise ValueError(f"embeddings must have {dimension} dimensions, got {embeddings.shape[1]}")
+        top_k = int(data.get("top_k", 3))
+        if not 1 <= top_k <= MAX_SHARD_TOP_K:
+            raise ValueError(f"top_k must be between 1 and {MAX_SHARD_TOP_K}")
+        filters = data.get("filters") or {}
+        results = rag_system.retrieve_embedded(embeddings.astype(np.float32), queries, top_k,
+                                               filters.get("sources"), filters.get("date_from"),
+                                               filters.get("date_to"))
+    except (KeyError, TypeError, ValueError) as e:
         return jsonify({
-            "error": "No data provided"
+            "error": f"Invalid shard search request: {e}"
         }), 400
     
+    hits = []
+    for docs in results:
+        query_hits = []
+        for doc in docs:
+            hit = doc.to_dict()
+            # The coordinator only quotes the matching chunk
+            del hit["content"]
+            query_hits.append(hit)
+        hits.append(query_hits)
+    return jsonify({"results": hits})
+
+def _ensure_rag_system():
+    """Initialize the RAG system on first use; returns an error response if it is not available."""
+    if rag_system is None:
+        # In fast-start mode the background loader owns initialization
+        if rag_loader is not None:
+            return _not_ready_response()
+        with rag_init_lock:
+            # Another request may have finished initializing while we waited
+            if rag_system is None and not initialize_rag():
+                return jsonify({
+                    "error": "RAG system initialization failed"
+                }), 500
+    return None
+
+def parse_chat_request(rag: "SimpleRAG", data: Optional[Dict]) -> Tuple[str, Optional[str], List, Dict]:
+    """Validate a chat request body into (message, user_id, chat_history, filters).
+    
+    ``user_id`` is None when the client sends none, so anonymous requests
+    never share a conversation session. Raises ValueError with the message
+    for a 400 response.
+    """
+    if not data:
+        raise ValueError("No data provided")
+    if not isinstance(data, dict):
+        raise ValueError("Request body must be a JSON object")
+    
     message = data.get('message')
-    user_id = data.get('user_id', 'anonymous')
+    user_id = data.get('user_id')
     chat_history = data.get('chat_history', [])
     
-    if not message:
+    if not message or not isinstance(message, str):
+        raise ValueError("No message provided")
+    if user_id is not None and not isinstance(user_id, str):
+        raise ValueError("user_id must be a string")
+    
+    # Optional retrieval filters: {"sources": [...], "date_from": "YYYY-MM-DD", "date_to": "YYYY-MM-DD"}
+    filters = data.get('filters') or {}
+    if not isinstance(filters, dict):
+        raise ValueError("filters must be an object")
+    filters = rag.parse_filters(filters.get('sources'), filters.get('date_from'), filters.get('date_to'))
+    return message, user_id, chat_history, filters
+
+def parse_batch_request(rag: "SimpleRAG", data: Optional[Dict]) -> Tuple[List[str], List, Dict]:
+    """Validate a batch request body into (messages, ids, filters).
+    
+    ``queries`` holds strings or {"id", "message"} objects; ids are None for
+    plain strings. Raises ValueError with the message for a 400 response.
+    """
+    if not data:
+        raise ValueError("No data provided")
+    if not isinstance(data, dict):
+        raise ValueError("Request body must be a JSON object")
+    
+    queries = data.get('queries')
+    if not queries or not isinstance(queries, list):
+        raise ValueError("No queries provided")
+    if len(queries) > MAX_BATCH_QUERIES:
+        raise ValueError(f"At most {MAX_BATCH_QUERIES} queries are accepted per request")
+    
+    messages = []
+    ids = []
+    for i, query in enumerate(queries):
+        query_id = None
+        if isinstance(query, dict):
+            query_id = query.get('id')
+            query = query.get('message')
+        if not isinstance(query, str) or not query.strip():
+            raise ValueError(f"Query {i} has no message")
+        messages.append(query)
+        ids.append(query_id)
+    
+    filters = data.get('filters') or {}
+    if not isinstance(filters, dict):
+        raise ValueError("filters must be an object")
+    filters = rag.parse_filters(filters.get('sources'), filters.get('date_from'), filters.get('date_to'))
+    return messages, ids, filters
+
+def batch_lines(rag: "SimpleRAG", messages: List[str], ids: List, filters: Dict) -> Iterator[str]:
+    """Answer a batch request as NDJSON lines, one per query in input order.
+    
+    An unexpected failure ends the stream with an {"error"} line.
+    """
+    start_time = time.perf_counter()
+    try:
+        for i, response_data in enumerate(rag.generate_responses(messages, filters)):
+            line = {
+                "index": i,
+                "response": response_data["answer"],
+                "sources": response_data["sources"],
+                "glossary_terms": response_data["glossary_terms"],
+                "market_data": response_data["market_data"]
+            }
+            if ids[i] is not None:
+                line["id"] = ids[i]
+            yield json.dumps(line) + "\n"
+    except Exception as e:
+        logger.error(f"Error processing batch request: {e}")
+        yield json.dumps({"error": "An error occurred while processing your request"}) + "\n"
+        return
+    logger.info(f"Answered a batch of {len(messages)} queries in {time.perf_counter() - start_time:.2f}s")
+
+def format_sse(event: str, data: Dict) -> str:
+    """Encode one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/chat', methods=['POST'])
+def chat():
+    """Endpoint for handling chat requests"""
+    # Check if RAG system is initialized
+    error_response = _ensure_rag_system()
+    if error_response is not None:
+        return error_response
+    
+    # Parse request data
+    try:
+        message, user_id, chat_history, filters = parse_chat_request(rag_system, request.json)
+    except ValueError as e:
         return jsonify({
-            "error": "No message provided"
+            "error": str(e)
         }), 400
     
     try:
         # Generate response
-        start_time = time.time()
-        response_data = rag_system.generate_response(message, chat_history)
-        
-        # Log query for analytics
-        logger.info(f"Query from {user_id}: '{message}' - Processed in {time.time() - start_time:.2f}s")
+        start_time = time.perf_counter()
+        response_data = rag_system.generate_response(message, chat_history, filters, user_id)
         
-        # Return the response
-        return jsonify({
+        # Serialize the response
+        serialize_start = time.perf_counter()
+        response = jsonify({
             "response": response_data["answer"],
             "sources": response_data["sources"],
             "glossary_terms": response_data["glossary_terms"],
             "market_data": response_data["market_data"],
             "timestamp": datetime.now().isoformat()
         })
+        end_time = time.perf_counter()
+        rag_system.stage_latency.observe("serialization", end_time - serialize_start)
+        rag_system.stage_latency.observe("request", end_time - start_time)
+        
+        # Log query for analytics
+        log_chat_request(user_id, message, end_time - start_time)
+        
+        # Return the response
+        return response
     
     except Exception as e:
         logger.error(f"Error processing chat request: {e}")
@@ -554,22 +4457,240 @@ def chat():
             "message": str(e)
         }), 500
 
-if __name__ == '__main__':
-    # Command-line arguments
-    parser = argparse.ArgumentParser(description='ESOM Finance RAG Chatbot Server')
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Chat endpoint streaming the answer as server-sent events (context, token..., done)"""
+    error_response = _ensure_rag_system()
+    if error_response is not None:
+        return error_response
+    
+    try:
+        message, user_id, chat_history, filters = parse_chat_request(rag_system, request.json)
+    except ValueError as e:
+        return jsonify({
+            "error": str(e)
+        }), 400
+    rag = rag_system
+    
+    def events():
+        start_time = time.perf_counter()
+        try:
+            for event, data in rag.stream_response(message, chat_history, filters, user_id):
+                if event == "done":
+                    data["timestamp"] = datetime.now().isoformat()
+                yield format_sse(event, data)
+        except Exception as e:
+            logger.error(f"Error streaming chat response: {e}")
+            yield format_sse("error", {"error": "An error occurred while processing your request"})
+            return
+        rag.stage_latency.observe("request", time.perf_counter() - start_time)
+        log_chat_request(user_id, message, time.perf_counter() - start_time)
+    
+    response = Response(stream_with_context(events()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    # Ask reverse proxies not to buffer the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+@app.route('/api/chat/batch', methods=['POST'])
+def chat_batch():
+    """Answer many queries in one request, streamed back as NDJSON in input order"""
+    error_response = _ensure_rag_system()
+    if error_response is not None:
+        return error_response
+    
+    try:
+        messages, ids, filters = parse_batch_request(rag_system, request.json)
+    except ValueError as e:
+        return jsonify({
+            "error": str(e)
+        }), 400
+    
+    return Response(stream_with_context(batch_lines(rag_system, messages, ids, filters)),
+                    mimetype="application/x-ndjson")
+
+def build_arg_parser(description: str = 'ESOM Finance RAG Chatbot Server') -> argparse.ArgumentParser:
+    """Command-line options shared by the Flask and ASGI servers."""
+    parser = argparse.ArgumentParser(description=description)
     parser.add_argument('--host', type=str, default='0.0.0.0',
                         help='Host to run the server on')
     parser.add_argument('--port', type=int, default=5001,
                         help='Port to run the server on')
-    parser.add_argument('--debug', action='store_true',
-                        help='Run in debug mode')
     parser.add_argument('--data-path', type=str, default=DEFAULT_DATA_PATH,
                         help='Path to data directory')
+    parser.add_argument('--index', type=str, default=None,
+                        help='Serve a prebuilt, memory-mapped index artifact (or the current one of an '
+                             'esom_build_index.py output directory) instead of indexing at startup')
+    parser.add_argument('--index-backend', type=str, default=ExactIndex.name,
+                        choices=sorted(INDEX_BACKENDS),
+                        help='Vector index used for document retrieval')
+    parser.add_argument('--ivf-lists', type=int, default=None,
+                        help='Number of IVF clusters (default: 4 * sqrt(number of documents))')
+    parser.add_argument('--ivf-probe', type=int, default=8,
+                        help='Number of IVF clusters scanned per query')
+    parser.add_argument('--embedding-dtype', type=str, default="float32",
+                        choices=EMBEDDING_DTYPES,
+                        help='Storage type of the normalized document embedding matrix')
+    parser.add_argument('--batch-window-ms', type=float, default=0.0,
+                        help='Time to collect concurrent queries into one encode call; every query '
+                             'waits up to this long, so batching is off (0) unless set')
+    parser.add_argument('--batch-size', type=int, default=32,
+                        help='Maximum number of queries encoded in one batch')
+    parser.add_argument('--query-cache-size', type=int, default=4096,
+                        help='Number of query embeddings kept in the LRU cache (0 disables)')
+    parser.add_argument('--response-cache-size', type=int, default=1024,
+                        help='Number of complete responses kept in the TTL cache (0 disables)')
+    parser.add_argument('--response-cache-ttl', type=float, default=60.0,
+                        help='Seconds a cached response stays valid (0 disables)')
+    parser.add_argument('--generator', type=str, default=TemplateGenerator.name,
+                        choices=sorted(GENERATOR_BACKENDS),
+                        help='Answer synthesis backend: templates, a local GGUF model or an OpenAI-compatible completion server')
+    parser.add_argument('--generator-model', type=str, default=None,
+                        help='GGUF model path (llama-cpp) or model name sent to the completion server (http)')
+    parser.add_argument('--generator-url', type=str, default="http://127.0.0.1:8080",
+                        help='Base URL of the completion server used by the http generator')
+    parser.add_argument('--max-new-tokens', type=int, default=256,
+                        help='Maximum tokens generated per answer')
+    parser.add_argument('--context-tokens', type=int, default=DEFAULT_CONTEXT_TOKENS,
+                        help='Approximate token budget of the retrieved context, glossary, market data and history in a prompt')
+    parser.add_argument('--session-cache-size', type=int, default=4096,
+                        help='Conversations whose recent turn embeddings are kept for follow-up questions (0 disables)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='Maximum characters per embedded document chunk')
+    parser.add_argument('--chunk-overlap', type=int, default=DEFAULT_CHUNK_OVERLAP,
+                        help='Characters shared by consecutive chunks of a document')
+    parser.add_argument('--encode-batch-size', type=int, default=DEFAULT_ENCODE_BATCH_SIZE,
+                        help='Document chunks embedded per model call during ingestion')
+    parser.add_argument('--retrieval', type=str, default="dense", choices=RETRIEVAL_MODES,
+                        help='Dense-only retrieval or dense fused with BM25 lexical search')
+    parser.add_argument('--dense-weight', type=float, default=1.0,
+                        help='Weight of the dense ranking in hybrid rank fusion')
+    parser.add_argument('--sparse-weight', type=float, default=1.0,
+                        help='Weight of the BM25 ranking in hybrid rank fusion')
+    parser.add_argument('--lexical-prefilter', type=int, default=0,
+                        help='Score only this many BM25 candidates with embeddings on larger corpora (0 disables)')
+    parser.add_argument('--market-poll-interval', type=float, default=2.0,
+                        help='Seconds between checks of market_data.json for changes (0 disables hot reload)')
+    parser.add_argument('--shard', type=parse_shard, default=None, metavar='I/N',
+                        help='Serve as retrieval shard I of N, indexing only that partition of the data path')
+    parser.add_argument('--shard-key', type=str, default="hash", choices=SHARD_KEYS,
+                        help='Partition documents across shards by a hash of their ID or by source')
+    parser.add_argument('--shards', type=str, default=None,
+                        help='Comma-separated shard server URLs to retrieve from instead of indexing locally')
+    parser.add_argument('--local-shards', type=int, default=0,
+                        help='Start this many shard servers on this machine and retrieve from them')
+    parser.add_argument('--shard-base-port', type=int, default=None,
+                        help='Port of the first local shard, the others use the following ports (default: --port + 1)')
+    parser.add_argument('--shard-timeout', type=float, default=DEFAULT_SHARD_TIMEOUT,
+                        help='Seconds to wait for shards; slower shards are left out of the results')
+    parser.add_argument('--admin-token', type=str, default=os.environ.get("ESOM_ADMIN_TOKEN"),
+                        help='Bearer token enabling the admin endpoints (/api/ingest, DELETE /api/documents, /api/profiler, '
+                             '/api/shard/search); defaults to $ESOM_ADMIN_TOKEN, they are disabled without one. '
+                             'Coordinators send it to the --shards servers')
+    parser.add_argument('--fast-start', action='store_true',
+                        help='Bind the port immediately and load the model and index in the background')
+    parser.add_argument('--profile', action='store_true',
+                        help='Start the sampling profiler at startup (toggle at runtime via /api/profiler)')
+    return parser
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """Parse an I/N shard specification."""
+    try:
+        shard, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("shard must be given as I/N, e.g. 0/4")
+    if not 0 <= shard < count:
+        raise argparse.ArgumentTypeError(f"shard index must be between 0 and {count - 1}")
+    return shard, count
+
+def configure_rag_options(args: argparse.Namespace):
+    """Translate parsed command-line options into SimpleRAG keyword arguments.
+    
+    Starts the shard servers requested with --local-shards.
+    """
+    global admin_token
+    admin_token = args.admin_token
+    rag_options["data_path"] = args.data_path
+    if args.index:
+        # Pin the artifact version now so that restarted workers keep serving it
+        rag_options["snapshot_path"] = resolve_index_path(args.index)
+    rag_options["index_backend"] = args.index_backend
+    rag_options["embedding_dtype"] = args.embedding_dtype
+    rag_options["query_batch_window_ms"] = args.batch_window_ms
+    rag_options["query_batch_size"] = args.batch_size
+    rag_options["query_cache_size"] = args.query_cache_size
+    rag_options["response_cache_size"] = args.response_cache_size
+    rag_options["response_cache_ttl"] = args.response_cache_ttl
+    rag_options["session_cache_size"] = args.session_cache_size
+    rag_options["generator_backend"] = args.generator
+    rag_options["context_tokens"] = args.context_tokens
+    if args.generator != TemplateGenerator.name:
+        rag_options["generator_params"] = {"model": args.generator_model, "max_new_tokens": args.max_new_tokens}
+        if args.generator == CompletionServerGenerator.name:
+            rag_options["generator_params"]["url"] = args.generator_url
+    rag_options["chunk_size"] = args.chunk_size
+    rag_options["chunk_overlap"] = args.chunk_overlap
+    rag_options["encode_batch_size"] = args.encode_batch_size
+    rag_options["market_poll_interval"] = args.market_poll_interval
+    rag_options["retrieval_mode"] = args.retrieval
+    rag_options["dense_weight"] = args.dense_weight
+    rag_options["sparse_weight"] = args.sparse_weight
+    rag_options["lexical_prefilter"] = args.lexical_prefilter
+    if args.index_backend == IVFIndex.name:
+        rag_options["index_params"] = {"n_lists": args.ivf_lists, "n_probe": args.ivf_probe}
+    if args.shard is not None:
+        rag_options["shard"] = args.shard
+    rag_options["shard_key"] = args.shard_key
+    rag_options["shard_timeout"] = args.shard_timeout
+    if args.local_shards > 0:
+        # Shards build their own partitions; options set so far are passed on to them.
+        # Without an admin token they share a generated one with this coordinator.
+        base_port = args.shard_base_port or args.port + 1
+        shard_token = admin_token or secrets.token_urlsafe(32)
+        rag_options["shards"] = start_local_shards(args.local_shards, base_port, shard_token)
+        rag_options["shard_token"] = shard_token
+    elif args.shards:
+        rag_options["shards"] = [url.strip() for url in args.shards.split(",") if url.strip()]
+        rag_options["shard_token"] = admin_token
+
+if __name__ == '__main__':
+    # Command-line arguments
+    parser = build_arg_parser()
+    parser.add_argument('--debug', action='store_true',
+                        help='Run in debug mode')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Serve from this many pre-forked worker processes sharing one read-only index '
+                             '(1 runs the Flask development server)')
+    parser.add_argument('--compare-index', action='store_true',
+                        help='Print recall@k and latency of the index backend against exact search, then exit')
     
     args = parser.parse_args()
+    configure_rag_options(args)
+    
+    if args.compare_index:
+        if not initialize_rag():
+            raise SystemExit(1)
+        embeddings = rag_system.document_embeddings
+        rng = np.random.default_rng(0)
+        # Use perturbed documents as queries so that they land near real clusters
+        rows = np.sort(rng.choice(len(embeddings), min(len(embeddings), 1000), replace=False))
+        queries = embeddings[rows] + rng.normal(scale=0.05, size=(len(rows), embeddings.shape[1])).astype(np.float32)
+        backends = {} if args.index_backend == ExactIndex.name else {args.index_backend: rag_system.index}
+        print(json.dumps(compare_index_backends(embeddings, queries, top_k=10, backends=backends), indent=2))
+        raise SystemExit(0)
+    
+    if args.profile:
+        profiler.start()
     
     # Initialize RAG system
-    if initialize_rag():
+    if args.workers > 1:
+        if not serve_prefork(args.host, args.port, args.workers, background=args.fast_start):
+            logger.error("Failed to start worker pool. Exiting.")
+    elif args.fast_start:
+        initialize_rag(background=True)
+        logger.info(f"Starting server on {args.host}:{args.port} (loading in background)")
+        app.run(host=args.host, port=args.port, debug=args.debug)
+    elif initialize_rag():
         logger.info(f"Starting server on {args.host}:{args.port}")
         app.run(host=args.host, port=args.port, debug=args.debug)
     else:
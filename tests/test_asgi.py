@@ -0,0 +1,106 @@
+"""Admission control of the ASGI server."""
+
+import asyncio
+import json
+import threading
+
+import pytest
+
+import esom_asgi
+import esom_simple_rag
+
+
+async def call(app, path, receive):
+    """Send one request to the app and return (status, JSON body)."""
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    await app({"type": "http", "method": "POST", "path": path}, receive, send)
+    return messages[0]["status"], json.loads(b"".join(m.get("body", b"") for m in messages[1:]))
+
+
+@pytest.mark.parametrize("path", ["/api/chat", "/api/chat/stream", "/api/chat/batch"])
+def test_slots_are_taken_before_the_body_is_read(monkeypatch, path):
+    monkeypatch.setattr(esom_simple_rag, "rag_system", object())
+    app = esom_asgi.ChatApp(max_in_flight=2)
+
+    async def scenario():
+        body_sent = asyncio.Event()
+
+        async def slow_receive():
+            # The body arrives only after every request has been admitted or shed
+            await body_sent.wait()
+            return {"type": "http.request", "body": b"not json"}
+
+        requests = [asyncio.ensure_future(call(app, path, slow_receive)) for _ in range(5)]
+        await asyncio.sleep(0)
+        assert app.in_flight == 2
+        body_sent.set()
+        return [status for status, _ in await asyncio.gather(*requests)]
+
+    statuses = asyncio.run(scenario())
+    assert sorted(statuses) == [400, 400, 503, 503, 503]
+    # Requests that fail while reading or parsing the body release their slot
+    assert app.in_flight == 0
+    app.executor.shutdown()
+
+
+def body_receiver(body):
+    """ASGI receive callable that delivers ``body`` and then never reports a disconnect."""
+    messages = [{"type": "http.request", "body": body}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.Event().wait()
+    return receive
+
+
+class BlockingRAG:
+    """Stands in for SimpleRAG with retrieval that runs until ``release`` is set."""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def parse_filters(self, sources=None, date_from=None, date_to=None):
+        return {}
+
+    async def agenerate_response(self, message, chat_history, executor=None, filters=None, user_id=None):
+        await asyncio.get_running_loop().run_in_executor(executor, self.release.wait)
+
+
+def test_timed_out_work_keeps_its_slot_until_it_finishes(monkeypatch):
+    rag = BlockingRAG()
+    monkeypatch.setattr(esom_simple_rag, "rag_system", rag)
+    app = esom_asgi.ChatApp(request_timeout=0.05, max_in_flight=1)
+
+    async def scenario():
+        body = json.dumps({"message": "repo rate?"}).encode()
+        assert (await call(app, "/api/chat", body_receiver(body)))[0] == 504
+        # The retrieval job still runs in the executor, so new requests are shed
+        assert app.in_flight == 1
+        assert (await call(app, "/api/chat", body_receiver(body)))[0] == 503
+
+        rag.release.set()
+        for _ in range(100):
+            if not app.in_flight:
+                break
+            await asyncio.sleep(0.01)
+        assert app.in_flight == 0
+
+    asyncio.run(scenario())
+    app.executor.shutdown()
+
+
+@pytest.mark.parametrize("path", ["/api/chat", "/api/chat/stream", "/api/chat/batch"])
+@pytest.mark.parametrize("body", [b"[]", b'"x"', b"1", b'[{"message": "hi"}]', b'{"message": ["hi"]}'])
+def test_non_object_bodies_are_rejected(monkeypatch, path, body):
+    monkeypatch.setattr(esom_simple_rag, "rag_system", BlockingRAG())
+    app = esom_asgi.ChatApp()
+    status, payload = asyncio.run(call(app, path, body_receiver(body)))
+    assert status == 400
+    assert "error" in payload
+    assert app.in_flight == 0
+    app.executor.shutdown()
@@ -0,0 +1,55 @@
+"""Coalescing concurrent query encodes into batches."""
+
+import threading
+
+import numpy as np
+import pytest
+
+from esom_simple_rag import EmbeddingBatcher, build_arg_parser
+
+
+class RecordingEncoder:
+    """Encodes each text to [len(text)] and records the batches it was called with."""
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        return np.array([[len(text)] for text in texts], dtype=np.float32)
+
+
+def test_batching_is_opt_in():
+    assert build_arg_parser().parse_args([]).batch_window_ms == 0
+
+
+def test_concurrent_encodes_share_one_call():
+    encoder = RecordingEncoder()
+    batcher = EmbeddingBatcher(encoder, window_ms=10000, max_batch_size=4)
+    texts = ["a", "bb", "ccc", "dddd"]
+    results = {}
+    threads = [threading.Thread(target=lambda t=t: results.__setitem__(t, batcher.encode(t, timeout=10)))
+               for t in texts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batcher.close()
+
+    # A full batch is encoded without waiting for the window to close
+    assert [sorted(batch) for batch in encoder.batches] == [sorted(texts)]
+    assert {text: embedding.tolist() for text, embedding in results.items()} == {t: [len(t)] for t in texts}
+    metrics = batcher.metrics()
+    assert metrics["batches"] == 1 and metrics["requests"] == 4
+    assert metrics["batch_size_histogram"]["4"] == 1
+
+
+def test_encode_errors_reach_every_caller():
+    def fail(texts):
+        raise RuntimeError("model unavailable")
+    batcher = EmbeddingBatcher(fail, window_ms=0)
+    with pytest.raises(RuntimeError, match="model unavailable"):
+        batcher.encode("repo rate", timeout=10)
+    batcher.close()
+    with pytest.raises(RuntimeError, match="closed"):
+        batcher.encode("repo rate")
@@ -0,0 +1,122 @@
+"""BM25Index against a brute-force scorer."""
+
+import math
+import random
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from esom_simple_rag import BM25Index, tokenize
+
+VOCABULARY = [f"w{i}" for i in range(60)]
+
+
+def random_texts(count, rng):
+    # Skewed word frequencies so that some terms occur in most texts
+    return [" ".join(rng.choice(VOCABULARY[:rng.choice([5, 60])]) for _ in range(rng.randint(1, 30)))
+            for _ in range(count)]
+
+
+def brute_force_scores(texts, query, k1=1.2, b=0.75, max_df_fraction=None):
+    """Score every text with Okapi BM25 directly from its tokens."""
+    counts = [Counter(tokenize(text)) for text in texts]
+    lengths = [sum(c.values()) for c in counts]
+    average_length = sum(lengths) / len(lengths)
+    scores = {}
+    for term in set(tokenize(query)):
+        df = sum(1 for c in counts if term in c)
+        if not df or (max_df_fraction is not None and df > max_df_fraction * len(texts)):
+            continue
+        idf = math.log1p((len(texts) - df + 0.5) / (df + 0.5))
+        for row, c in enumerate(counts):
+            if term in c:
+                norm = k1 * (1 - b + b * lengths[row] / average_length)
+                scores[row] = scores.get(row, 0.0) + idf * c[term] * (k1 + 1) / (c[term] + norm)
+    return scores
+
+
+def assert_matches_brute_force(index, texts, queries, top_k=10):
+    for query in queries:
+        expected = brute_force_scores(texts, query, max_df_fraction=index.max_df_fraction)
+        rows, scores = index.search(query, top_k)
+        assert len(rows) == min(top_k, len(expected))
+        # Scores are exact up to float32 rounding; ties may come back in either order
+        assert np.allclose(scores, [expected[row] for row in rows.tolist()], rtol=1e-5)
+        assert np.allclose(scores, sorted(expected.values(), reverse=True)[:top_k], rtol=1e-5)
+
+
+def extend(index, texts):
+    return index.extend([index.postings(texts)])
+
+
+@pytest.fixture
+def rng():
+    return random.Random(0)
+
+
+def test_search_matches_brute_force(rng):
+    texts = random_texts(300, rng)
+    index = extend(BM25Index(), texts).rebuild()
+    assert_matches_brute_force(index, texts, random_texts(50, rng))
+
+
+def test_common_terms_scored_unless_capped(rng):
+    texts = ["repo rate held", "repo rate cut", "bond yields rise"]
+    index = extend(BM25Index(), texts).rebuild()
+    assert sorted(index.search("rate", 10)[0].tolist()) == [0, 1]
+
+    texts = random_texts(300, rng)
+    capped = extend(BM25Index(max_df_fraction=0.5), texts).rebuild()
+    assert_matches_brute_force(capped, texts, random_texts(50, rng))
+    # w0 to w4 occur in well over half of the texts
+    assert not len(capped.search("w0 w1", 10)[0])
+
+
+def test_search_matches_brute_force_after_extend(rng):
+    texts = random_texts(300, rng)
+    queries = random_texts(50, rng)
+    index = extend(BM25Index(), texts).rebuild()
+
+    # The new rows stay in the unsorted tail until the index is rebuilt
+    added = random_texts(20, rng) + ["w59 unseen1 unseen2", "unseen1"]
+    extended = extend(index, added)
+    assert not extended.needs_rebuild()
+    assert len(extended.tail_terms)
+    assert_matches_brute_force(extended, texts + added, queries + ["unseen1", "unseen2 w3"])
+    assert_matches_brute_force(extended.rebuild(), texts + added, queries + ["unseen1", "unseen2 w3"])
+
+    # The original index is unaffected by the extend
+    assert_matches_brute_force(index, texts, queries)
+
+
+def test_rebuild_threshold(rng):
+    texts = random_texts(100, rng)
+    index = extend(BM25Index(), texts).rebuild()
+    extended = extend(index, random_texts(100, rng))
+    assert extended.needs_rebuild()
+
+    rebuilt = extended.rebuild()
+    assert not rebuilt.needs_rebuild()
+    assert not len(rebuilt.tail_terms)
+    assert np.all(np.diff(rebuilt.offsets) >= 0)
+
+
+def test_search_restricted_to_rows(rng):
+    texts = random_texts(200, rng)
+    index = extend(extend(BM25Index(), texts[:150]).rebuild(), texts[150:])
+    allowed = np.arange(0, 200, 3)
+    for query in random_texts(20, rng):
+        expected = {row: score for row, score in brute_force_scores(texts, query).items() if row % 3 == 0}
+        rows, scores = index.search(query, 5, rows=allowed)
+        assert set(rows.tolist()) <= set(expected)
+        assert np.allclose(scores, sorted(expected.values(), reverse=True)[:5], rtol=1e-5)
+
+
+def test_save_load_round_trip(tmp_path, rng):
+    texts = random_texts(100, rng)
+    index = extend(extend(BM25Index(max_df_fraction=0.5), texts[:80]).rebuild(), texts[80:])
+    index.save(str(tmp_path / "bm25"))
+    loaded = BM25Index.load(str(tmp_path / "bm25"))
+    assert loaded.max_df_fraction == 0.5
+    assert_matches_brute_force(loaded, texts, random_texts(20, rng))
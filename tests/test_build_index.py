@@ -0,0 +1,58 @@
+"""Offline index builds and serving the published artifact."""
+
+import json
+import os
+
+import pytest
+
+from esom_benchmark import HashingEmbeddingModel
+from esom_build_index import SOURCE_FILES, build_index
+from esom_simple_rag import DOCUMENT_TYPES, SimpleRAG, resolve_index_path
+
+RAG_KWARGS = {"use_embedding_cache": False, "embeddings_model": HashingEmbeddingModel(64)}
+
+
+def write_sources(data_path, documents_per_source=2):
+    for doc_type in DOCUMENT_TYPES:
+        with open(data_path / f"{doc_type}.jsonl", 'w', encoding='utf-8') as f:
+            for i in range(documents_per_source):
+                f.write(json.dumps({"id": f"{doc_type}-{i}", "content": f"{doc_type} report {i}"}) + "\n")
+    with open(data_path / "finance_glossary.jsonl", 'w', encoding='utf-8') as f:
+        f.write(json.dumps({"term": "gdp", "definition": "Gross domestic product"}) + "\n")
+
+
+def test_build_and_serve_artifact(tmp_path):
+    write_sources(tmp_path)
+    manifest = build_index(str(tmp_path), str(tmp_path / "indexes"), RAG_KWARGS)
+    assert manifest["documents"] == 2 * len(DOCUMENT_TYPES)
+
+    artifact = resolve_index_path(str(tmp_path / "indexes"))
+    assert os.path.basename(artifact) == manifest["version"]
+    rag = SimpleRAG(data_path=str(tmp_path), snapshot_path=artifact, **RAG_KWARGS)
+    assert rag.document_count() == 2 * len(DOCUMENT_TYPES)
+    assert rag.retrieve_relevant_documents("financial news report", top_k=2)
+
+
+@pytest.mark.parametrize("missing", SOURCE_FILES)
+def test_build_fails_on_missing_source(tmp_path, missing):
+    write_sources(tmp_path)
+    os.remove(tmp_path / missing)
+    with pytest.raises(FileNotFoundError, match=missing):
+        build_index(str(tmp_path), str(tmp_path / "indexes"), RAG_KWARGS)
+    # No dummy data is written in place of the missing file
+    assert not os.path.exists(tmp_path / missing)
+    assert not os.path.exists(tmp_path / "indexes")
+
+
+def test_build_fails_on_empty_corpus(tmp_path):
+    write_sources(tmp_path, documents_per_source=0)
+    with pytest.raises(ValueError):
+        build_index(str(tmp_path), str(tmp_path / "indexes"), RAG_KWARGS)
+    assert not os.path.exists(tmp_path / "indexes")
+
+
+def test_save_snapshot_rejects_empty_corpus(tmp_path):
+    write_sources(tmp_path, documents_per_source=0)
+    rag = SimpleRAG(data_path=str(tmp_path), **RAG_KWARGS)
+    with pytest.raises(ValueError):
+        rag.save_snapshot(str(tmp_path / "snapshot"))
@@ -0,0 +1,90 @@
+"""Query embedding and response caches."""
+
+import json
+
+import pytest
+
+import esom_simple_rag
+from esom_benchmark import HashingEmbeddingModel
+from esom_simple_rag import DOCUMENT_TYPES, LRUCache, SimpleRAG, TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(esom_simple_rag.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def rag(tmp_path):
+    for doc_type in DOCUMENT_TYPES:
+        with open(tmp_path / f"{doc_type}.jsonl", 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"id": doc_type, "content": f"Notes on the repo rate from {doc_type}"}) + "\n")
+    return SimpleRAG(data_path=str(tmp_path), use_embedding_cache=False, embeddings_model=HashingEmbeddingModel(64))
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats() == {"size": 2, "maxsize": 2, "hits": 3, "misses": 1, "hit_rate": 0.75, "evictions": 1}
+
+
+def test_zero_size_caches_store_nothing():
+    cache = LRUCache(0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+    cache = TTLCache(10, ttl=0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+
+
+def test_ttl_entries_expire(clock):
+    cache = TTLCache(10, ttl=60)
+    cache.put("a", 1)
+    clock.now += 59
+    assert cache.get("a") == 1
+    clock.now += 2
+    assert cache.get("a") is None
+    assert len(cache) == 0
+    assert cache.stats()["expirations"] == 1
+
+
+def test_ttl_discard_sees_values(clock):
+    cache = TTLCache(10, ttl=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.discard_where(lambda value: value == 2) == 1
+    assert (cache.get("a"), cache.get("b")) == (1, None)
+
+
+def test_equivalent_queries_share_one_encode(rag, monkeypatch):
+    calls = []
+    encode = rag.embeddings_model.encode
+    monkeypatch.setattr(rag.embeddings_model, "encode", lambda texts, **kw: calls.append(texts) or encode(texts))
+    first = rag.encode_query("What is the repo rate?")
+    assert rag.encode_query("  what is the REPO rate ") is first
+    assert len(calls) == 1
+
+
+def test_repeated_questions_are_answered_from_cache(rag):
+    response = rag.generate_response("What is the repo rate?")
+    assert rag.generate_response("what is the repo rate") is response
+
+    # Filters are part of the key, and writes invalidate every cached response
+    assert rag.generate_response("What is the repo rate?", filters={"sources": ("financial_news",)}) is not response
+    rag.delete_document("financial_news")
+    assert rag.generate_response("What is the repo rate?") is not response
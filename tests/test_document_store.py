@@ -0,0 +1,68 @@
+"""The columnar document store and its document views."""
+
+import numpy as np
+import pytest
+
+from esom_simple_rag import DocumentStore, RetrievedDocument
+
+DOCUMENTS = [
+    {"id": "news-1", "source": "financial_news", "date": "2024-03-05", "title": "Rates",
+     "content": "Central bank holds the repo rate steady"},
+    {"id": "paper-1", "source": "research_papers", "content": "Rupee ₹ and euro € exchange rates",
+     "authors": ["A. Rao"]},
+    {"id": "news-2", "source": "financial_news", "date": "March 2024", "content": ""},
+]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = DocumentStore(str(tmp_path / "store"))
+    assert store.append(DOCUMENTS[:2]) == 0
+    assert store.append(DOCUMENTS[2:]) == 2
+    return store
+
+
+def test_fields_round_trip(store):
+    assert len(store) == 3
+    for row, doc in enumerate(DOCUMENTS):
+        assert store.view(row).to_dict() == doc
+        assert store.source(row) == doc["source"]
+    assert store.metadata(1) == {"id": "paper-1", "authors": ["A. Rao"]}
+    assert store.dates[0] == np.datetime64("2024-03-05")
+    # Dates that do not parse are stored as NaT
+    assert np.isnat(store.dates[1]) and np.isnat(store.dates[2])
+
+
+def test_content_ranges_are_utf8_byte_offsets(store):
+    content = DOCUMENTS[1]["content"]
+    start = content.encode("utf-8").index("₹".encode("utf-8"))
+    assert store.content(1, start, start + len("₹".encode("utf-8"))) == "₹"
+    hit = RetrievedDocument(store.view(1), start, len(content.encode("utf-8")), 0.5)
+    assert hit.chunk == content[content.index("₹"):]
+    assert hit["similarity_score"] == 0.5 and hit["authors"] == ["A. Rao"]
+    assert "title" not in hit and hit.get("title") is None
+
+
+def test_find_returns_rows_oldest_first(store):
+    store.append([dict(DOCUMENTS[0], content="Repo rate cut")])
+    assert store.find("news-1") == [0, 3]
+    assert store.find("missing") == []
+
+
+def test_saved_store_reopens_read_only(store, tmp_path):
+    store.save(str(tmp_path / "saved"))
+    # Appends after the save do not reach the saved copy
+    store.append([dict(DOCUMENTS[0], id="news-3")])
+    reopened = DocumentStore(str(tmp_path / "saved"), read_only=True)
+    assert len(reopened) == 3
+    assert [reopened.view(row).to_dict() for row in range(3)] == DOCUMENTS
+    assert isinstance(reopened.offsets, np.memmap)
+    with pytest.raises(RuntimeError):
+        reopened.append([DOCUMENTS[0]])
+
+
+def test_views_of_a_replaced_store_stay_readable(store, tmp_path):
+    view = store.view(0)
+    # A new writable store in the same directory unlinks the blob instead of truncating it
+    DocumentStore(str(tmp_path / "store")).append([dict(DOCUMENTS[0], content="x" * 1000)])
+    assert view["content"] == DOCUMENTS[0]["content"]
@@ -0,0 +1,75 @@
+"""EmbeddingMatrix storage dtypes and score scaling."""
+
+import numpy as np
+import pytest
+
+from esom_simple_rag import EMBEDDING_DTYPES, EmbeddingMatrix, _top_k, l2_normalize
+
+
+@pytest.fixture
+def raw():
+    # Unnormalized rows with very different norms and value ranges
+    rng = np.random.default_rng(0)
+    return rng.standard_normal((500, 48)) * rng.uniform(0.01, 100, size=(500, 1))
+
+
+@pytest.fixture
+def queries():
+    return l2_normalize(np.random.default_rng(1).standard_normal((20, 48)))
+
+
+@pytest.mark.parametrize("dtype, tolerance", [("float32", 1e-6), ("float16", 2e-3), ("int8", 2e-2)])
+def test_scores_approximate_cosine_similarity(raw, queries, dtype, tolerance):
+    matrix = EmbeddingMatrix.from_embeddings(raw, dtype)
+    assert matrix.dtype == dtype
+    expected = queries @ l2_normalize(raw).T
+    for query, expected_scores in zip(queries, expected):
+        assert np.abs(matrix.scores(query) - expected_scores).max() < tolerance
+        assert np.abs(matrix.scores(query, 100, 300) - expected_scores[100:300]).max() < tolerance
+    assert np.abs(matrix.batch_scores(queries) - expected).max() < tolerance
+    assert np.abs(matrix.batch_scores(queries, 100, 300) - expected[:, 100:300]).max() < tolerance
+
+
+def test_int8_rows_use_full_range_with_per_row_scales(raw):
+    matrix = EmbeddingMatrix.from_embeddings(raw, "int8")
+    assert matrix.vectors.dtype == np.int8
+    assert matrix.scales.shape == (len(raw),)
+    assert matrix.nbytes == raw.shape[0] * (raw.shape[1] + 4)
+    # Each row's largest component maps to +-127, whatever the row's norm
+    assert np.all(np.abs(matrix.vectors).max(axis=1) == 127)
+    assert np.allclose(np.linalg.norm(matrix[np.arange(len(raw))], axis=1), 1, atol=1e-2)
+
+
+def test_int8_scores_scaled_across_blocks(raw, queries, monkeypatch):
+    matrix = EmbeddingMatrix.from_embeddings(raw, "int8")
+    expected = matrix.batch_scores(queries)
+    # Blocks smaller than the requested range must scale every row by its own scale
+    monkeypatch.setattr(EmbeddingMatrix, "BLOCK_ROWS", 7)
+    assert np.allclose(matrix.batch_scores(queries), expected, atol=1e-6)
+    assert np.allclose(matrix.scores(queries[0], 3, 250), expected[0, 3:250], atol=1e-6)
+
+
+def test_int8_ranking_matches_float32(raw, queries):
+    exact = EmbeddingMatrix.from_embeddings(raw)
+    quantized = EmbeddingMatrix.from_embeddings(raw, "int8")
+    for query in queries:
+        expected = set(_top_k(exact.scores(query), 10).tolist())
+        overlap = len(expected & set(_top_k(quantized.scores(query), 10).tolist()))
+        assert overlap >= 8
+
+
+@pytest.mark.parametrize("dtype", EMBEDDING_DTYPES)
+def test_append_and_take_keep_scales(raw, queries, dtype):
+    full = EmbeddingMatrix.from_embeddings(raw, dtype)
+    grown = EmbeddingMatrix.from_embeddings(raw[:300], dtype).append(raw[300:])
+    assert np.allclose(grown.scores(queries[0]), full.scores(queries[0]), atol=1e-6)
+
+    rows = np.array([5, 17, 400])
+    taken = full.take(rows)
+    assert taken.dtype == dtype
+    assert np.allclose(taken.scores(queries[0]), full.scores(queries[0])[rows], atol=1e-6)
+
+
+def test_unsupported_dtype():
+    with pytest.raises(ValueError):
+        EmbeddingMatrix.from_embeddings(np.ones((2, 4)), "int4")
@@ -0,0 +1,75 @@
+"""The on-disk embedding cache across restarts and model changes."""
+
+import json
+
+import numpy as np
+
+from esom_benchmark import HashingEmbeddingModel
+from esom_simple_rag import DOCUMENT_TYPES, EMBEDDING_CACHE_DIR, EmbeddingStore, SimpleRAG
+
+
+class CountingModel(HashingEmbeddingModel):
+    """Hashing embeddings that count the texts they were asked to encode."""
+
+    def __init__(self, dim=32):
+        super().__init__(dim)
+        self.encoded = 0
+
+    def encode(self, texts, **kwargs):
+        self.encoded += len(texts)
+        return super().encode(texts, **kwargs)
+
+
+def test_only_uncached_content_is_encoded(tmp_path):
+    model = CountingModel()
+    store = EmbeddingStore(str(tmp_path), model.model_name, model.dim)
+    first = store.get_embeddings(["repo rate", "gdp growth", "repo rate"], model.encode)
+    assert model.encoded == 2
+    assert np.array_equal(first[0], first[2])
+    store.sync()
+
+    store = EmbeddingStore(str(tmp_path), model.model_name, model.dim)
+    second = store.get_embeddings(["gdp growth", "bond yields"], model.encode)
+    assert model.encoded == 3
+    assert np.array_equal(second[0], first[1])
+
+
+def test_sync_drops_entries_not_requested(tmp_path):
+    model = CountingModel()
+    store = EmbeddingStore(str(tmp_path), model.model_name, model.dim)
+    store.get_embeddings(["repo rate", "gdp growth"], model.encode)
+    store.sync()
+
+    store = EmbeddingStore(str(tmp_path), model.model_name, model.dim)
+    store.get_embeddings(["gdp growth"], model.encode)
+    store.sync()
+    with open(tmp_path / EmbeddingStore.MANIFEST_FILE, 'r', encoding='utf-8') as f:
+        assert json.load(f)["hashes"] == [EmbeddingStore.content_hash("gdp growth")]
+
+
+def test_cache_of_another_model_is_discarded(tmp_path):
+    model = CountingModel()
+    store = EmbeddingStore(str(tmp_path), model.model_name, model.dim)
+    store.get_embeddings(["repo rate"], model.encode)
+    store.sync()
+
+    store = EmbeddingStore(str(tmp_path), "another-model", model.dim)
+    store.get_embeddings(["repo rate"], model.encode)
+    assert model.encoded == 2
+
+
+def test_restart_reuses_cached_chunks(tmp_path):
+    for doc_type in DOCUMENT_TYPES:
+        with open(tmp_path / f"{doc_type}.jsonl", 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"id": doc_type, "content": f"Latest {doc_type} on the repo rate"}) + "\n")
+    model = CountingModel()
+    SimpleRAG(data_path=str(tmp_path), embeddings_model=model)
+    assert model.encoded == len(DOCUMENT_TYPES)
+    assert (tmp_path / EMBEDDING_CACHE_DIR / EmbeddingStore.MATRIX_FILE).exists()
+
+    # Only the changed document is encoded again
+    with open(tmp_path / "financial_news.jsonl", 'w', encoding='utf-8') as f:
+        f.write(json.dumps({"id": "financial_news", "content": "Bond yields fall"}) + "\n")
+    rag = SimpleRAG(data_path=str(tmp_path), embeddings_model=model)
+    assert model.encoded == len(DOCUMENT_TYPES) + 1
+    assert rag.document_count() == len(DOCUMENT_TYPES)
@@ -0,0 +1,50 @@
+"""Detection of follow-up questions that are retrieved with the chat history, and their sessions."""
+
+import pytest
+
+from esom_simple_rag import SimpleRAG, parse_chat_request
+
+HISTORY = [{"role": "user", "content": "What is the repo rate?"},
+           {"role": "assistant", "content": "The repo rate is 6.5%."}]
+
+
+@pytest.mark.parametrize("query", [
+    "And last quarter?",
+    "What about inflation?",
+    "How did it change?",
+    "Why did they raise it?",
+    "Is that good?",
+    "It fell last year, but how does the central bank decide where to set the rate?",
+    "Compared to the US Federal Reserve policy rate over the last decade?",
+])
+def test_follow_ups_use_history(query):
+    assert SimpleRAG.follow_up_history(query, HISTORY) == ("What is the repo rate?",)
+
+
+@pytest.mark.parametrize("query", [
+    "What is the inflation outlook for this year in India?",
+    "How do central banks decide that interest rates should rise?",
+    "Explain how bond prices and yields move relative to each other in these markets",
+    "What is GDP?",
+])
+def test_standalone_questions_ignore_history(query):
+    assert SimpleRAG.follow_up_history(query, HISTORY) == ()
+
+
+def test_follow_up_skips_assistant_and_repeated_turns():
+    history = HISTORY + [{"role": "user", "content": "and inflation?"}, {"role": "user", "content": " "}]
+    assert SimpleRAG.follow_up_history("And inflation?", history) == ("What is the repo rate?",)
+    assert SimpleRAG.follow_up_history("And inflation?", []) == ()
+
+
+class NoFilters:
+    def parse_filters(self, sources=None, date_from=None, date_to=None):
+        return {}
+
+
+def test_requests_without_user_id_have_no_session():
+    # A shared default ID would give every anonymous client the same session
+    assert parse_chat_request(NoFilters(), {"message": "And inflation?"})[1] is None
+    assert parse_chat_request(NoFilters(), {"message": "And inflation?", "user_id": "u1"})[1] == "u1"
+    with pytest.raises(ValueError):
+        parse_chat_request(NoFilters(), {"message": "And inflation?", "user_id": {"id": 1}})
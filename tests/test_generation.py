@@ -0,0 +1,130 @@
+"""Answer generators, prompt budgeting and streamed chat responses."""
+
+import http.server
+import json
+import threading
+
+import pytest
+
+import esom_simple_rag
+from esom_benchmark import HashingEmbeddingModel
+from esom_simple_rag import (CHARS_PER_TOKEN, DOCUMENT_TYPES, CompletionServerGenerator, PromptContext,
+                             SimpleRAG, TemplateGenerator, estimate_tokens, truncate_text)
+
+
+@pytest.fixture
+def rag(tmp_path):
+    for doc_type in DOCUMENT_TYPES:
+        with open(tmp_path / f"{doc_type}.jsonl", 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"id": doc_type, "title": f"{doc_type} notes",
+                                "content": f"Notes on the repo rate from {doc_type}. " * 40}) + "\n")
+    return SimpleRAG(data_path=str(tmp_path), use_embedding_cache=False, context_tokens=200,
+                     embeddings_model=HashingEmbeddingModel(64))
+
+
+def parse_sse(text):
+    """Split a server-sent event stream into (event, data) pairs."""
+    events = []
+    for block in text.split("\n\n"):
+        if block:
+            event, data = block.split("\n")
+            events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def test_truncate_text_cuts_at_a_word_boundary():
+    assert truncate_text("short", 10) == "short"
+    assert truncate_text("the repo rate was held", 15) == "the repo..."
+    assert len(truncate_text("x" * 50, 20)) == 20
+    assert estimate_tokens("x" * (CHARS_PER_TOKEN + 1)) == 2
+
+
+def test_prompt_context_fits_the_budget(rag):
+    docs = rag.retrieve_relevant_documents("repo rate", top_k=3)
+    history = [{"role": "user", "content": "Tell me about rates " * 50},
+               {"role": "assistant", "content": "Rates are set by the central bank."}]
+    context = rag.build_prompt_context("repo rate", docs, {"repo rate": "The policy rate"}, {}, history)
+    assert context.passages and " notes (" in context.passages[0][0]
+    used = sum(estimate_tokens(label) + estimate_tokens(text) for label, text in context.passages)
+    used += sum(estimate_tokens(text) for _, text in context.history)
+    assert used <= rag.context_tokens
+    # Passages come first; history only gets what they leave over
+    assert len(context.passages) < len(docs) or not context.history
+    prompt = context.prompt()
+    assert prompt.startswith(PromptContext.INSTRUCTIONS) and prompt.endswith("Question: repo rate\nAnswer:")
+
+
+def test_template_generator_streams_its_answer():
+    generator = TemplateGenerator()
+    context = PromptContext("repo rate", [("News", "The repo rate was held at 6.5%")], {}, {"Repo rate": "6.5%"}, [])
+    pieces = list(generator.stream(context))
+    assert len(pieces) > 1
+    assert "".join(pieces) == generator.generate(context)
+    assert generator.generate(context).startswith("The repo rate was held at 6.5%")
+    assert "- Repo rate: 6.5%" in generator.generate(context)
+
+    empty = PromptContext("repo rate", [], {"repo rate": "The policy rate"}, {}, [])
+    assert generator.generate(empty) == "I see you're asking about 'repo rate'. The policy rate"
+
+
+def test_completion_server_generator_reads_streamed_completions():
+    requests = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_POST(self):
+            requests.append((self.path, json.loads(self.rfile.read(int(self.headers["Content-Length"])))))
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for text in ("The repo", " rate", ""):
+                self.wfile.write(f"data: {json.dumps({'choices': [{'text': text}]})}\n\n".encode())
+            self.wfile.write(b"data: [DONE]\n\n")
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        generator = CompletionServerGenerator(url=f"http://127.0.0.1:{server.server_port}", model="stub",
+                                              max_new_tokens=16)
+        context = PromptContext("repo rate", [], {}, {}, [])
+        assert list(generator.stream(context)) == ["The repo", " rate"]
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+    path, body = requests[0]
+    assert path == "/v1/completions"
+    assert body["stream"] and body["model"] == "stub" and body["max_tokens"] == 16
+    assert body["prompt"] == context.prompt()
+
+
+def test_stream_response_matches_generate_response(rag):
+    events = list(rag.stream_response("What is the repo rate?"))
+    assert [event for event, _ in events[:1] + events[-1:]] == ["context", "done"]
+    assert {event for event, _ in events[1:-1]} == {"token"}
+    answer = "".join(data["text"] for _, data in events[1:-1])
+    assert events[-1][1]["response"] == answer
+    assert len(events[0][1]["sources"]) == 3
+
+    # The streamed answer was cached and is replayed in one token
+    cached = rag.generate_response("what is the repo rate")
+    assert cached["answer"] == answer
+    assert [event for event, _ in rag.stream_response("What is the repo rate?")] == ["context", "token", "done"]
+
+
+def test_chat_stream_endpoint_sends_server_sent_events(rag, monkeypatch):
+    monkeypatch.setattr(esom_simple_rag, "rag_system", rag)
+    client = esom_simple_rag.app.test_client()
+    response = client.post('/api/chat/stream', json={"message": "What is the repo rate?"})
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    assert response.headers["Cache-Control"] == "no-cache"
+    events = parse_sse(response.get_data(as_text=True))
+    assert events[0][0] == "context" and events[-1][0] == "done"
+    assert "timestamp" in events[-1][1]
+    assert events[-1][1]["response"] == "".join(data["text"] for event, data in events if event == "token")
+
+    assert client.post('/api/chat/stream', json={"message": ""}).status_code == 400
@@ -0,0 +1,177 @@
+"""Live ingest, replace and delete, and their persistence across restarts."""
+
+import json
+
+import pytest
+
+import esom_simple_rag
+from esom_benchmark import HashingEmbeddingModel
+from esom_simple_rag import DOCUMENT_TYPES, TOMBSTONE_KEY, SimpleRAG
+
+CORPUS = {
+    "financial_news": [{"id": "news-1", "content": "Central bank holds the repo rate steady"},
+                       {"id": "news-2", "content": "Equity markets rally on strong earnings"}],
+    "research_papers": [{"id": "paper-1", "content": "Monetary transmission and bank lending channels"}],
+    "textbook_excerpts": [{"id": "book-1", "content": "Inflation erodes the purchasing power of money"}],
+    "economic_indicators": [{"id": "ind-1", "content": "GDP growth reached six percent this quarter"}]
+}
+
+
+@pytest.fixture
+def data_path(tmp_path):
+    for doc_type in DOCUMENT_TYPES:
+        with open(tmp_path / f"{doc_type}.jsonl", 'w', encoding='utf-8') as f:
+            for doc in CORPUS[doc_type]:
+                f.write(json.dumps(doc) + "\n")
+    return tmp_path
+
+
+def open_rag(data_path):
+    return SimpleRAG(data_path=str(data_path), use_embedding_cache=False,
+                     embeddings_model=HashingEmbeddingModel(64))
+
+
+def contents(rag, query, doc_id):
+    return [doc["content"] for doc in rag.retrieve_relevant_documents(query, top_k=10) if doc["id"] == doc_id]
+
+
+def jsonl_ids(data_path, doc_type):
+    """IDs of a source file's lines in order, tombstones prefixed with '-'."""
+    with open(data_path / f"{doc_type}.jsonl", 'r', encoding='utf-8') as f:
+        docs = [json.loads(line) for line in f if line.strip()]
+    return [("-" if doc.get(TOMBSTONE_KEY) else "") + doc["id"] for doc in docs]
+
+
+def test_ingest_survives_restart(data_path):
+    rag = open_rag(data_path)
+    assert rag.document_count() == 5
+    ids = rag.ingest_documents([{"id": "news-3", "content": "Zebra bonds price in a rate cut",
+                                 "source": "financial_news"}])
+    assert ids == ["news-3"]
+    assert rag.document_count() == 6
+    assert contents(rag, "zebra bonds", "news-3") == ["Zebra bonds price in a rate cut"]
+
+    rag = open_rag(data_path)
+    assert rag.document_count() == 6
+    assert contents(rag, "zebra bonds", "news-3") == ["Zebra bonds price in a rate cut"]
+    assert jsonl_ids(data_path, "financial_news") == ["news-1", "news-2", "news-3"]
+
+
+def test_replace_survives_restart(data_path):
+    rag = open_rag(data_path)
+    rag.ingest_documents([{"id": "news-1", "content": "Zebra rate hike surprises markets",
+                           "source": "research_papers"}])
+    assert rag.document_count() == 5
+    assert contents(rag, "zebra rate", "news-1") == ["Zebra rate hike surprises markets"]
+
+    # Files are only appended to: the old source gets a tombstone, the new one the document
+    assert jsonl_ids(data_path, "financial_news") == ["news-1", "news-2", "-news-1"]
+    assert jsonl_ids(data_path, "research_papers") == ["paper-1", "news-1"]
+
+    rag = open_rag(data_path)
+    assert rag.document_count() == 5
+    assert contents(rag, "zebra rate", "news-1") == ["Zebra rate hike surprises markets"]
+
+
+def test_repeated_id_in_one_batch_keeps_the_last(data_path):
+    rag = open_rag(data_path)
+    rag.ingest_documents([{"id": "dup", "content": "Ibis draft one", "source": "financial_news"},
+                          {"id": "dup", "content": "Ibis draft two", "source": "financial_news"}])
+    assert rag.document_count() == 6
+    assert contents(rag, "ibis draft", "dup") == ["Ibis draft two"]
+    assert jsonl_ids(data_path, "financial_news").count("dup") == 1
+
+    rag = open_rag(data_path)
+    assert contents(rag, "ibis draft", "dup") == ["Ibis draft two"]
+
+
+def test_duplicate_lines_keep_the_last_on_load(data_path):
+    with open(data_path / "financial_news.jsonl", 'a', encoding='utf-8') as f:
+        f.write(json.dumps({"id": "news-1", "content": "Yak rate cut announced"}) + "\n")
+    rag = open_rag(data_path)
+    assert rag.document_count() == 5
+    assert contents(rag, "yak rate cut", "news-1") == ["Yak rate cut announced"]
+
+
+def test_delete_survives_restart(data_path):
+    rag = open_rag(data_path)
+    assert rag.delete_document("news-2")
+    assert not rag.delete_document("news-2")
+    assert not rag.delete_document("missing")
+    assert rag.document_count() == 4
+    assert contents(rag, "equity markets rally", "news-2") == []
+    assert jsonl_ids(data_path, "financial_news") == ["news-1", "news-2", "-news-2"]
+
+    rag = open_rag(data_path)
+    assert rag.document_count() == 4
+    assert contents(rag, "equity markets rally", "news-2") == []
+
+
+def test_same_source_replace_appends_without_tombstone(data_path):
+    rag = open_rag(data_path)
+    rag.ingest_documents([{"id": "news-1", "content": "Walrus rate pause", "source": "financial_news"}])
+    assert jsonl_ids(data_path, "financial_news") == ["news-1", "news-2", "news-1"]
+    rag = open_rag(data_path)
+    assert rag.document_count() == 5
+    assert contents(rag, "walrus rate", "news-1") == ["Walrus rate pause"]
+
+
+def test_tombstones_only_drop_earlier_lines(data_path):
+    rag = open_rag(data_path)
+    # research_papers loads before financial_news, so its rows come first on restart
+    rag.ingest_documents([{"id": "news-1", "content": "Gecko rate moves", "source": "research_papers"}])
+    rag.ingest_documents([{"id": "news-1", "content": "Gecko rate returns", "source": "financial_news"}])
+    rag.delete_document("paper-1")
+    rag.ingest_documents([{"id": "paper-1", "content": "Gecko lending revisited", "source": "research_papers"}])
+    assert jsonl_ids(data_path, "research_papers") == ["paper-1", "news-1", "-news-1", "-paper-1", "paper-1"]
+
+    rag = open_rag(data_path)
+    assert rag.document_count() == 5
+    assert contents(rag, "gecko rate", "news-1") == ["Gecko rate returns"]
+    assert contents(rag, "gecko lending", "paper-1") == ["Gecko lending revisited"]
+
+
+def test_ingest_without_persist_is_not_written(data_path):
+    rag = open_rag(data_path)
+    rag.ingest_documents([{"id": "tmp", "content": "Okapi yields", "source": "financial_news"}], persist=False)
+    assert contents(rag, "okapi yields", "tmp") == ["Okapi yields"]
+    assert open_rag(data_path).document_count() == 5
+
+
+def test_ingest_rejects_unknown_source(data_path):
+    rag = open_rag(data_path)
+    with pytest.raises(ValueError):
+        rag.ingest_documents([{"id": "x", "content": "text", "source": "blog_posts"}])
+    assert rag.document_count() == 5
+
+
+def test_admin_endpoints_require_token(data_path, monkeypatch):
+    monkeypatch.setattr(esom_simple_rag, "rag_system", open_rag(data_path))
+    client = esom_simple_rag.app.test_client()
+    documents = {"documents": [{"id": "news-3", "content": "Heron bond auction", "source": "financial_news"}]}
+
+    monkeypatch.setattr(esom_simple_rag, "admin_token", None)
+    assert client.post('/api/ingest', json=documents).status_code == 403
+    assert client.delete('/api/documents/news-1').status_code == 403
+
+    monkeypatch.setattr(esom_simple_rag, "admin_token", "secret")
+    assert client.post('/api/ingest', json=documents,
+                       headers={"Authorization": "Bearer wrong"}).status_code == 401
+    headers = {"Authorization": "Bearer secret"}
+    response = client.post('/api/ingest', json=documents, headers=headers)
+    assert response.status_code == 200
+    assert response.get_json() == {"ingested": 1, "ids": ["news-3"]}
+    assert client.delete('/api/documents/news-1', headers=headers).status_code == 200
+    assert client.delete('/api/documents/news-1', headers=headers).status_code == 404
+    assert jsonl_ids(data_path, "financial_news") == ["news-1", "news-2", "news-3", "-news-1"]
+
+
+def test_chunks_missing_from_content_are_skipped(data_path, monkeypatch):
+    rag = open_rag(data_path)
+
+    class RewritingSplitter:
+        def split_text(self, text):
+            return [text[:10], text[10:].upper()]
+    monkeypatch.setattr(rag, "text_splitter", RewritingSplitter())
+    chunks = list(rag._iter_chunks([{"id": "x", "content": "Quokka rate outlook"}], base_row=7))
+    assert chunks == [(7, 0, 10, "Quokka rat")]
@@ -0,0 +1,69 @@
+"""KeywordMatcher against a regular expression reference."""
+
+import random
+import re
+
+import pytest
+
+from esom_simple_rag import KeywordMatcher
+
+PATTERNS = ["gdp", "gdp growth", "growth", "growth rate", "rate", "interest rate", "interest",
+            "real interest rate", "s&p", "u.s.", "repo"]
+WORDS = ["gdp", "gdpr", "growth", "rate", "rates", "interest", "real", "repo", "repos", "s&p",
+         "u.s.", "the", "and", "_gdp", "gdp_", "ratex", ",", ".", "-"]
+
+
+def reference_pattern(patterns, plurals=False):
+    """Whole-word alternation of the patterns, longest first."""
+    alternation = "|".join(re.escape(p) for p in sorted(patterns, key=len, reverse=True))
+    return re.compile(rf"(?<!\w)({alternation}){'s?' if plurals else ''}(?!\w)")
+
+
+def reference_find(patterns, text, plurals=False):
+    found = []
+    for match in reference_pattern(patterns, plurals).finditer(text):
+        if match.group(1) not in found:
+            found.append(match.group(1))
+    return sorted(found, key=len, reverse=True)
+
+
+def random_texts(count, seed=0):
+    rng = random.Random(seed)
+    # Some texts are joined without spaces to produce matches inside words
+    return [rng.choice([" ", " ", " ", ""]).join(rng.choice(WORDS) for _ in range(rng.randint(0, 12)))
+            for _ in range(count)]
+
+
+@pytest.mark.parametrize("plurals", [False, True])
+def test_find_all_matches_every_whole_word_occurrence(plurals):
+    matcher = KeywordMatcher(PATTERNS, plurals=plurals)
+    suffix = "s?" if plurals else ""
+    for text in random_texts(500):
+        expected = set()
+        for pattern in PATTERNS:
+            # A lookahead finds overlapping occurrences of the same pattern
+            for match in re.finditer(rf"(?<!\w)(?=({re.escape(pattern)}{suffix})(?!\w))", text):
+                expected.add((match.start(), match.start() + len(match.group(1)), pattern))
+        assert set(matcher.find_all(text)) == expected, text
+
+
+@pytest.mark.parametrize("plurals", [False, True])
+def test_find_is_leftmost_longest(plurals):
+    matcher = KeywordMatcher(PATTERNS, plurals=plurals)
+    for text in random_texts(500, seed=1):
+        expected = reference_find(PATTERNS, text, plurals)
+        assert matcher.find(text) == expected, text
+        assert matcher.find(text, limit=2) == expected[:2], text
+
+
+def test_find_batch_matches_find():
+    matcher = KeywordMatcher(PATTERNS)
+    texts = random_texts(200, seed=2)
+    assert matcher.find_batch(texts) == [matcher.find(text) for text in texts]
+
+
+def test_from_dict_round_trip():
+    matcher = KeywordMatcher(PATTERNS, plurals=True)
+    restored = KeywordMatcher.from_dict(matcher.to_dict())
+    for text in random_texts(100, seed=3):
+        assert restored.find_all(text) == matcher.find_all(text)
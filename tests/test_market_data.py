@@ -0,0 +1,99 @@
+"""Keyword routing of market data lookups, and hot reloads of market_data.json."""
+
+import json
+import os
+import threading
+
+import pytest
+
+from esom_benchmark import HashingEmbeddingModel
+from esom_simple_rag import DOCUMENT_TYPES, MarketDataWatcher, MarketSnapshot, SimpleRAG
+
+MARKET_DATA = {
+    "indices": {"SENSEX": "74,000", "NIFTY": "22,500"},
+    "commodities": {"Gold": "72,000/10g", "Crude Oil": "82/bbl"}
+}
+TRENDS = {"inflation_rate": "3.8%", "repo_rate": "6.5%", "gdp_growth": "6.1%"}
+
+
+@pytest.fixture
+def snapshot():
+    return MarketSnapshot(1, MARKET_DATA, TRENDS)
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("What is the inflation rate?", {"inflation"}),
+    ("What are current interest rates?", {"repo_rate"}),
+    ("How are stock markets doing?", {"SENSEX"}),
+    ("How is the share market and the NIFTY?", {"SENSEX", "NIFTY"}),
+    ("Gold and oil prices", {"Gold", "Crude Oil"}),
+    ("Explain repo rates and CPI", {"repo_rate", "inflation"}),
+])
+def test_lookup_routes_singular_and_plural_forms(snapshot, query, expected):
+    assert set(snapshot.lookup(query)) == expected
+
+
+@pytest.mark.parametrize("query", ["GDPR compliance", "the goldsmith's shop", "interest rateses"])
+def test_lookup_requires_whole_words(snapshot, query):
+    assert snapshot.lookup(query) == {}
+
+
+def test_lookup_batch_matches_lookup(snapshot):
+    queries = ["interest rates", "stock markets and gold", "", "nothing relevant", "crude oil\nsensex"]
+    assert snapshot.lookup_batch(queries) == [snapshot.lookup(query) for query in queries]
+
+
+def write_market_data(path, repo_rate):
+    # Write then rename, as feeds publishing the file atomically do
+    with open(str(path) + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump({"market_data": MARKET_DATA, "trends": dict(TRENDS, repo_rate=repo_rate)}, f)
+    os.replace(str(path) + ".tmp", path)
+
+
+def test_snapshots_are_read_only(snapshot):
+    with pytest.raises(TypeError):
+        snapshot.trends["repo_rate"] = "9%"
+    with pytest.raises(TypeError):
+        snapshot.market_data["indices"]["NIFTY"] = "0"
+
+
+def test_reload_swaps_snapshot_and_invalidates_market_answers(tmp_path):
+    for doc_type in DOCUMENT_TYPES:
+        with open(tmp_path / f"{doc_type}.jsonl", 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"id": doc_type, "content": f"Commentary on monetary policy from {doc_type}"}) + "\n")
+    write_market_data(tmp_path / "market_data.json", "6.5%")
+    rag = SimpleRAG(data_path=str(tmp_path), use_embedding_cache=False, embeddings_model=HashingEmbeddingModel(64))
+    old = rag.market
+    with_figures = rag.generate_response("What is the repo rate?")
+    without_figures = rag.generate_response("Explain monetary policy")
+    assert with_figures["market_data"] == {"repo_rate": "6.5%"}
+    assert not without_figures["market_data"]
+
+    write_market_data(tmp_path / "market_data.json", "6.25%")
+    assert rag.reload_market_data() == old.version + 1
+    # Requests holding the previous snapshot keep reading consistent figures
+    assert old.lookup("repo rate") == {"repo_rate": "6.5%"}
+    assert rag.generate_response("What is the repo rate?")["market_data"] == {"repo_rate": "6.25%"}
+    assert rag.generate_response("Explain monetary policy") is without_figures
+
+
+def test_watcher_calls_back_on_each_change(tmp_path):
+    path = tmp_path / "market_data.json"
+    write_market_data(path, "6.5%")
+    changes = threading.Semaphore(0)
+    calls = []
+
+    def on_change():
+        calls.append(json.loads(path.read_text())["trends"]["repo_rate"])
+        changes.release()
+        if len(calls) == 1:
+            raise ValueError("a failing reload does not stop the watcher")
+
+    watcher = MarketDataWatcher(str(path), on_change, interval=0.01)
+    try:
+        for repo_rate in ("6.25%", "6.0%"):
+            write_market_data(path, repo_rate)
+            assert changes.acquire(timeout=5)
+    finally:
+        watcher.close()
+    assert calls == ["6.25%", "6.0%"]
@@ -0,0 +1,106 @@
+"""Stage latency metrics and the sampling profiler."""
+
+import json
+import threading
+import time
+
+import pytest
+
+import esom_simple_rag
+from esom_benchmark import HashingEmbeddingModel
+from esom_simple_rag import DOCUMENT_TYPES, LatencyHistogram, SamplingProfiler, SimpleRAG
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    for doc_type in DOCUMENT_TYPES:
+        with open(tmp_path / f"{doc_type}.jsonl", 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"id": doc_type, "content": f"Notes on the repo rate from {doc_type}"}) + "\n")
+    rag = SimpleRAG(data_path=str(tmp_path), use_embedding_cache=False, embeddings_model=HashingEmbeddingModel(64))
+    monkeypatch.setattr(esom_simple_rag, "rag_system", rag)
+    return esom_simple_rag.app.test_client()
+
+
+def parse_metrics(text):
+    """Map each sample line's name and labels to its value."""
+    return {line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1])
+            for line in text.splitlines() if line and not line.startswith("#")}
+
+
+def test_histogram_counts_are_cumulative():
+    histogram = LatencyHistogram()
+    for seconds in (0.0002, 0.003, 0.003, 20.0):
+        histogram.observe(seconds)
+    cumulative, total, count = histogram.snapshot()
+    bounds = list(LatencyHistogram.BUCKETS)
+    assert cumulative[bounds.index(0.00025)] == 1
+    assert cumulative[bounds.index(0.005)] == 3
+    assert cumulative[-2] == 3 and cumulative[-1] == count == 4
+    assert total == pytest.approx(20.0062)
+
+
+def test_chat_request_is_timed_per_stage(client):
+    assert client.post('/api/chat', json={"message": "What is the repo rate?"}).status_code == 200
+    response = client.get('/api/metrics')
+    assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    text = response.get_data(as_text=True)
+    assert "# TYPE esom_stage_latency_seconds histogram" in text
+    samples = parse_metrics(text)
+    for stage in ("encode", "search", "glossary", "market", "synthesis", "serialization", "request"):
+        assert samples[f'esom_stage_latency_seconds_count{{stage="{stage}"}}'] == 1
+        assert samples[f'esom_stage_latency_seconds_bucket{{stage="{stage}",le="+Inf"}}'] == 1
+    assert samples["esom_ready"] == 1
+    assert samples["esom_documents"] == len(DOCUMENT_TYPES)
+    assert samples['esom_cache_misses_total{cache="responses"}'] == 1
+
+    client.post('/api/chat', json={"message": "what is the repo rate"})
+    samples = parse_metrics(client.get('/api/metrics').get_data(as_text=True))
+    assert samples['esom_cache_hits_total{cache="responses"}'] == 1
+    # A cached answer skips retrieval but is still a timed request
+    assert samples['esom_stage_latency_seconds_count{stage="search"}'] == 1
+    assert samples['esom_stage_latency_seconds_count{stage="request"}'] == 2
+
+
+def test_metrics_before_the_system_is_ready(monkeypatch):
+    monkeypatch.setattr(esom_simple_rag, "rag_system", None)
+    samples = parse_metrics(esom_simple_rag.app.test_client().get('/api/metrics').get_data(as_text=True))
+    assert samples == {"esom_ready": 0, "esom_profiler_running": 0}
+
+
+def test_profiler_samples_other_threads():
+    stop = threading.Event()
+
+    def busy_wait():
+        while not stop.is_set():
+            sum(range(1000))
+
+    worker = threading.Thread(target=busy_wait, name="busy-worker")
+    worker.start()
+    profiler = SamplingProfiler()
+    profiler.start(0.001)
+    try:
+        deadline = time.monotonic() + 5
+        while profiler.samples < 20 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        profiler.stop()
+        stop.set()
+        worker.join()
+    assert not profiler.running
+    stacks = profiler.folded()
+    assert any(line.startswith("busy-worker;") and "test_metrics.busy_wait" in line for line in stacks.splitlines())
+    assert "sampling-profiler" not in stacks
+
+
+def test_profiler_endpoint_requires_admin(client, monkeypatch):
+    monkeypatch.setattr(esom_simple_rag, "admin_token", None)
+    assert client.post('/api/profiler', json={"enabled": True}).status_code == 403
+    monkeypatch.setattr(esom_simple_rag, "admin_token", "secret")
+    headers = {"Authorization": "Bearer secret"}
+    assert client.post('/api/profiler', json={"interval_ms": 0}, headers=headers).status_code == 400
+    try:
+        response = client.post('/api/profiler', json={"interval_ms": 1}, headers=headers)
+        assert response.get_json()["running"]
+    finally:
+        esom_simple_rag.profiler.stop()
+    assert client.get('/api/profiler', headers=headers).status_code == 200
@@ -0,0 +1,77 @@
+"""Single-query and batch retrieval, with and without filters."""
+
+import json
+
+import pytest
+
+from esom_benchmark import HashingEmbeddingModel
+from esom_simple_rag import DOCUMENT_TYPES, RETRIEVAL_MODES, SimpleRAG
+
+TOPICS = ["repo rate", "equity markets", "inflation", "gdp growth", "bond yields", "crude oil"]
+
+
+@pytest.fixture(scope="module", params=RETRIEVAL_MODES)
+def rag(request, tmp_path_factory):
+    data_path = tmp_path_factory.mktemp("data")
+    for i, doc_type in enumerate(DOCUMENT_TYPES):
+        with open(data_path / f"{doc_type}.jsonl", 'w', encoding='utf-8') as f:
+            for j, topic in enumerate(TOPICS):
+                f.write(json.dumps({"id": f"{doc_type}-{j}", "date": f"2024-0{i + 1}-1{j}",
+                                    "content": f"Report {j} on {topic} from the {doc_type.replace('_', ' ')}"}) + "\n")
+    return SimpleRAG(data_path=str(data_path), use_embedding_cache=False, query_cache_size=0,
+                     embeddings_model=HashingEmbeddingModel(64), retrieval_mode=request.param)
+
+
+def test_batch_records_encode_and_search_latency(rag):
+    encode, search = rag.stage_latency.histograms["encode"], rag.stage_latency.histograms["search"]
+    encodes, searches = encode.snapshot()[2], search.snapshot()[2]
+    results = rag.retrieve_batch(["repo rate outlook", "crude oil supply"], top_k=2)
+    assert [len(docs) for docs in results] == [2, 2]
+    assert encode.snapshot()[2] == encodes + 1
+    assert search.snapshot()[2] == searches + 1
+
+    rag.retrieve_batch(["inflation"], top_k=2, sources=["financial_news"])
+    assert search.snapshot()[2] == searches + 2
+
+
+@pytest.mark.parametrize("sources", [[["financial_news"]], [{}], [1], {"financial_news": 1}, 5])
+def test_parse_filters_rejects_malformed_sources(rag, sources):
+    with pytest.raises(ValueError):
+        rag.parse_filters(sources)
+
+
+def test_parse_filters_canonical_form(rag):
+    assert rag.parse_filters("financial_news") == {"sources": ("financial_news",)}
+    assert rag.parse_filters(["research_papers", "financial_news", "research_papers"], "2024-01-05") == {
+        "sources": ("financial_news", "research_papers"), "date_from": "2024-01-05"}
+    with pytest.raises(ValueError):
+        rag.parse_filters(["blog_posts"])
+    with pytest.raises(ValueError):
+        rag.parse_filters(date_to="next week")
+
+
+@pytest.mark.parametrize("filters", [
+    {"sources": ["financial_news"]},
+    {"sources": ["research_papers", "economic_indicators"]},
+    {"date_from": "2024-02-01", "date_to": "2024-03-31"},
+    {"sources": ["financial_news", "textbook_excerpts"], "date_from": "2024-01-12"},
+])
+def test_filtered_retrieval_only_returns_matching_documents(rag, filters):
+    queries = ["repo rate outlook", "equity markets report", "inflation"]
+    batch = rag.retrieve_batch(queries, top_k=3, **filters)
+    for query, docs in zip(queries, batch):
+        single = rag.retrieve_relevant_documents(query, top_k=3, **filters)
+        # Documents with equal scores may come back in either order
+        assert [doc["similarity_score"] for doc in docs] == pytest.approx([doc["similarity_score"] for doc in single])
+        assert len(docs) == 3
+        for doc in docs:
+            assert doc["source"] in filters.get("sources", doc["source"])
+            assert filters.get("date_from", doc["date"]) <= doc["date"] <= filters.get("date_to", doc["date"])
+
+
+def test_source_filters_score_rows_in_place(rag, monkeypatch):
+    def take(*args):
+        raise AssertionError("source filters must not copy embedding rows")
+    monkeypatch.setattr(type(rag.document_embeddings), "take", take)
+    assert rag.retrieve_relevant_documents("crude oil", top_k=2, sources=["financial_news"])
+    assert all(rag.retrieve_batch(["crude oil", "gdp growth"], top_k=2, sources=["financial_news"]))
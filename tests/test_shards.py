@@ -0,0 +1,82 @@
+"""A coordinator retrieving through a shard server, and the shard search endpoint's checks."""
+
+import base64
+import json
+import threading
+
+import numpy as np
+import pytest
+from werkzeug.serving import make_server
+
+import esom_simple_rag
+from esom_benchmark import HashingEmbeddingModel
+from esom_simple_rag import DOCUMENT_TYPES, MAX_SHARD_TOP_K, SimpleRAG
+
+TOKEN = "shard-secret"
+TOPICS = ["repo rate", "equity markets", "inflation", "gdp growth", "bond yields", "crude oil"]
+
+
+def open_rag(data_path, **options):
+    return SimpleRAG(data_path=str(data_path), use_embedding_cache=False, query_cache_size=0,
+                     embeddings_model=HashingEmbeddingModel(64), **options)
+
+
+@pytest.fixture(scope="module")
+def shard(tmp_path_factory):
+    """A single-shard server on a free port, returning (its RAG system, its URL)."""
+    data_path = tmp_path_factory.mktemp("data")
+    for doc_type in DOCUMENT_TYPES:
+        with open(data_path / f"{doc_type}.jsonl", 'w', encoding='utf-8') as f:
+            for i, topic in enumerate(TOPICS):
+                f.write(json.dumps({"id": f"{doc_type}-{i}", "content": f"Report on {topic} from {doc_type}"}) + "\n")
+    rag = open_rag(data_path, shard=(0, 1))
+    patch = pytest.MonkeyPatch()
+    patch.setattr(esom_simple_rag, "rag_system", rag)
+    patch.setattr(esom_simple_rag, "admin_token", TOKEN)
+    server = make_server("127.0.0.1", 0, esom_simple_rag.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield rag, f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    thread.join()
+    patch.undo()
+
+
+def search_body(embeddings, top_k=3):
+    embeddings = np.ascontiguousarray(embeddings, dtype='<f4')
+    return {"embeddings": base64.b64encode(embeddings.tobytes()).decode("ascii"),
+            "shape": list(embeddings.shape), "queries": ["repo rate"] * len(embeddings), "top_k": top_k}
+
+
+def test_coordinator_round_trip(shard, tmp_path):
+    rag, url = shard
+    coordinator = open_rag(tmp_path, shards=[url], shard_token=TOKEN)
+    assert coordinator.read_only
+    assert coordinator.document_count() == rag.document_count()
+    for query in ["repo rate outlook", "crude oil supply"]:
+        hits = coordinator.retrieve_relevant_documents(query, top_k=3, sources=["financial_news"])
+        local = rag.retrieve_relevant_documents(query, top_k=3, sources=["financial_news"])
+        # Documents with equal scores may come back in either order
+        assert [hit["similarity_score"] for hit in hits] == pytest.approx([doc["similarity_score"] for doc in local])
+        assert len(hits) == 3 and all(hit["source"] == "financial_news" for hit in hits)
+
+
+def test_coordinator_without_token_gets_nothing(shard, tmp_path):
+    _, url = shard
+    coordinator = open_rag(tmp_path, shards=[url], shard_token="wrong", shard_timeout=5.0)
+    assert coordinator.retrieve_relevant_documents("repo rate", top_k=3) == []
+    assert coordinator.shard_client.failures == [1]
+
+
+def test_search_endpoint_checks(shard):
+    client = esom_simple_rag.app.test_client()
+    headers = {"Authorization": f"Bearer {TOKEN}"}
+    query = np.ones((1, 64)) / 8
+    assert client.post('/api/shard/search', json=search_body(query)).status_code == 401
+    assert client.post('/api/shard/search', json=search_body(query), headers=headers).status_code == 200
+
+    response = client.post('/api/shard/search', json=search_body(np.ones((1, 32))), headers=headers)
+    assert response.status_code == 400
+    assert "64 dimensions" in response.get_json()["error"]
+    for top_k in (0, MAX_SHARD_TOP_K + 1):
+        assert client.post('/api/shard/search', json=search_body(query, top_k), headers=headers).status_code == 400
@@ -0,0 +1,67 @@
+"""Snapshots shared read-only by pre-forked workers."""
+
+import json
+
+import numpy as np
+import pytest
+
+from esom_benchmark import HashingEmbeddingModel
+from esom_simple_rag import DOCUMENT_TYPES, SimpleRAG
+
+TOPICS = ["repo rate", "equity markets", "inflation", "gdp growth", "bond yields", "crude oil"]
+QUERIES = ["repo rate outlook", "crude oil supply", "inflation and bond yields"]
+
+
+def open_rag(data_path, **options):
+    return SimpleRAG(data_path=str(data_path), use_embedding_cache=False, query_cache_size=0,
+                     response_cache_size=0, embeddings_model=HashingEmbeddingModel(64), **options)
+
+
+@pytest.fixture
+def data_path(tmp_path):
+    for i, doc_type in enumerate(DOCUMENT_TYPES):
+        with open(tmp_path / f"{doc_type}.jsonl", 'w', encoding='utf-8') as f:
+            for j, topic in enumerate(TOPICS * 5):
+                f.write(json.dumps({"id": f"{doc_type}-{j}", "date": f"2024-0{i + 1}-1{j % 10}",
+                                    "content": f"Report {j} on {topic} from the {doc_type}"}) + "\n")
+    return tmp_path
+
+
+@pytest.mark.parametrize("options", [
+    {},
+    {"index_backend": "ivf", "embedding_dtype": "int8"},
+    {"retrieval_mode": "hybrid", "embedding_dtype": "float16"},
+])
+def test_snapshot_serves_the_same_results(data_path, options):
+    built = open_rag(data_path, **options)
+    built.delete_document("financial_news-3")
+    manifest = built.save_snapshot(str(data_path / "snapshot"))
+    assert manifest["documents"] == len(DOCUMENT_TYPES) * len(TOPICS) * 5
+
+    served = open_rag(data_path, snapshot_path=str(data_path / "snapshot"), **options)
+    assert served.read_only
+    assert served.document_count() == built.document_count()
+    # Every array is mapped from the snapshot rather than loaded into the worker
+    assert not served.document_embeddings.vectors.flags.owndata
+    assert isinstance(served.chunk_doc_rows, np.memmap)
+    for query in QUERIES:
+        for filters in ({}, {"sources": ["financial_news"]}, {"date_from": "2024-02-01"}):
+            expected = built.retrieve_relevant_documents(query, top_k=5, **filters)
+            docs = served.retrieve_relevant_documents(query, top_k=5, **filters)
+            assert [doc.to_dict() for doc in docs] == [doc.to_dict() for doc in expected]
+            assert "financial_news-3" not in [doc["id"] for doc in docs]
+
+
+def test_saving_replaces_a_served_snapshot(data_path):
+    built = open_rag(data_path)
+    built.save_snapshot(str(data_path / "snapshot"))
+    served = open_rag(data_path, snapshot_path=str(data_path / "snapshot"))
+    before = [doc.to_dict() for doc in served.retrieve_relevant_documents("repo rate", top_k=3)]
+
+    # A newer snapshot moved into place leaves the mapped files of the old one readable
+    built.ingest_documents([{"id": "new", "content": "Repo rate repo rate", "source": "financial_news"}],
+                           persist=False)
+    built.save_snapshot(str(data_path / "snapshot"))
+    assert [doc.to_dict() for doc in served.retrieve_relevant_documents("repo rate", top_k=3)] == before
+    assert open_rag(data_path, snapshot_path=str(data_path / "snapshot")).document_count() == \
+        served.document_count() + 1
@@ -0,0 +1,15 @@
+"""Importing the server module stays cheap enough to bind the port first."""
+
+import os
+import subprocess
+import sys
+
+
+def test_import_defers_heavy_dependencies():
+    code = ("import sys, esom_simple_rag; "
+            "print(sorted(m for m in ('langchain', 'sentence_transformers', 'torch') if m in sys.modules))")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root] + sys.path))
+    output = subprocess.run([sys.executable, "-c", code], env=env, cwd=root,
+                            capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "[]"
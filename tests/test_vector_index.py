@@ -0,0 +1,162 @@
+"""Vector index backends against exact search."""
+
+import os
+
+import numpy as np
+import pytest
+
+from esom_simple_rag import EmbeddingMatrix, ExactIndex, IVFIndex, VectorIndex, compare_index_backends, l2_normalize
+
+DIMENSION = 32
+
+
+def clustered_embeddings(n_rows, rng, n_clusters=40):
+    """Points scattered around random centres, like topical document embeddings."""
+    centres = rng.standard_normal((n_clusters, DIMENSION))
+    return centres[rng.integers(n_clusters, size=n_rows)] + 0.3 * rng.standard_normal((n_rows, DIMENSION))
+
+
+def recall_at_k(index, exact, queries, top_k=10):
+    hits = 0
+    for query in queries:
+        expected = set(exact.search(query, top_k)[0].tolist())
+        hits += len(expected & set(index.search(query, top_k)[0].tolist()))
+    return hits / (len(queries) * top_k)
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+@pytest.fixture
+def embeddings(rng):
+    return EmbeddingMatrix.from_embeddings(clustered_embeddings(4000, rng))
+
+
+@pytest.fixture
+def queries(rng):
+    return l2_normalize(clustered_embeddings(100, rng))
+
+
+def exact_index(embeddings):
+    index = ExactIndex()
+    index.build(embeddings)
+    return index
+
+
+def test_exact_search_returns_best_scores_first(embeddings, queries):
+    index = exact_index(embeddings)
+    for query in queries[:10]:
+        rows, scores = index.search(query, 10)
+        all_scores = embeddings[np.arange(len(embeddings))] @ query
+        assert np.allclose(scores, np.sort(all_scores)[::-1][:10], atol=1e-5)
+        assert np.allclose(scores, all_scores[rows], atol=1e-5)
+
+
+def test_exact_search_batch_matches_search(embeddings, queries):
+    index = exact_index(embeddings)
+    for (rows, scores), query in zip(index.search_batch(queries, 10), queries):
+        # Rows may differ only between ties, so compare scores
+        assert np.allclose(scores, index.search(query, 10)[1], atol=1e-5)
+        assert np.allclose(scores, embeddings[rows] @ query, atol=1e-5)
+
+
+def test_ivf_recall_against_exact(embeddings, queries):
+    index = IVFIndex()
+    index.build(embeddings)
+    assert len(index) == len(embeddings)
+    assert recall_at_k(index, exact_index(embeddings), queries) >= 0.9
+
+    # Probing every list is exhaustive
+    index.n_probe = len(index.centroids)
+    assert recall_at_k(index, exact_index(embeddings), queries) == 1.0
+
+
+def test_ivf_extend_searches_tail_until_rebuild(rng, embeddings, queries):
+    index = IVFIndex()
+    index.build(embeddings)
+
+    # Below the rebuild threshold the new rows are scanned exhaustively
+    added = clustered_embeddings(int(IVFIndex.REBUILD_TAIL_FRACTION * len(embeddings)), rng)
+    grown = embeddings.append(added)
+    extended = index.extend(grown)
+    assert len(extended) == len(grown)
+    assert not extended.needs_rebuild()
+    assert len(index) == len(embeddings)
+    tail_rows = np.arange(len(embeddings), len(grown))
+    for row in tail_rows[:20]:
+        assert extended.search(grown[row], 1)[0][0] == row
+    assert recall_at_k(extended, exact_index(grown), queries) >= 0.9
+
+    # One more row crosses the threshold; rebuilding clusters the tail
+    grown = grown.append(clustered_embeddings(1, rng))
+    extended = extended.extend(grown)
+    assert extended.needs_rebuild()
+    rebuilt = IVFIndex()
+    rebuilt.build(grown)
+    assert not rebuilt.needs_rebuild()
+    assert recall_at_k(rebuilt, exact_index(grown), queries) >= 0.9
+
+
+def test_ivf_shares_the_embedding_matrix(embeddings, tmp_path):
+    index = IVFIndex()
+    index.build(embeddings)
+    assert index.embeddings is embeddings
+    index.save(str(tmp_path / "index"))
+    assert sorted(name for name in os.listdir(tmp_path / "index") if name.endswith(".npy")) == [
+        "centroids.npy", "list_ids.npy", "list_offsets.npy"]
+
+
+def test_ivf_build_on_empty_matrix(rng):
+    index = IVFIndex()
+    index.build(EmbeddingMatrix.from_embeddings(np.empty((0, DIMENSION))))
+    assert len(index) == 0
+    assert len(index.search(l2_normalize(rng.standard_normal(DIMENSION)), 5)[0]) == 0
+
+    # Rows added later are searched exhaustively until the index is rebuilt
+    grown = EmbeddingMatrix.from_embeddings(clustered_embeddings(10, rng))
+    extended = index.extend(grown)
+    assert extended.needs_rebuild()
+    assert extended.search(grown[3], 1)[0].tolist() == [3]
+
+
+@pytest.mark.parametrize("backend", [ExactIndex, IVFIndex])
+def test_save_load_round_trip(tmp_path, backend, embeddings, queries):
+    index = backend()
+    index.build(embeddings)
+    index.fingerprint = VectorIndex.embeddings_fingerprint(embeddings)
+    index.save(str(tmp_path / "index"))
+    loaded = VectorIndex.load(str(tmp_path / "index"))
+    assert isinstance(loaded, backend)
+    assert loaded.fingerprint == index.fingerprint
+    loaded = loaded.extend(embeddings)
+    for query in queries[:10]:
+        rows, scores = index.search(query, 10)
+        loaded_rows, loaded_scores = loaded.search(query, 10)
+        assert np.array_equal(rows, loaded_rows)
+        assert np.array_equal(scores, loaded_scores)
+
+
+def test_exact_search_restricted_to_ranges(embeddings, queries, monkeypatch):
+    ranges = np.array([[10, 200], [700, 703], [1500, 2600]])
+    rows = np.concatenate([np.arange(start, end) for start, end in ranges])
+    index = ExactIndex()
+    index.build(embeddings, ranges)
+    assert len(index) == len(rows)
+    copied = exact_index(embeddings.take(rows))
+    # Blocks smaller than the ranges must keep positions aligned across range boundaries
+    monkeypatch.setattr(EmbeddingMatrix, "BLOCK_ROWS", 64)
+    for (positions, scores), query in zip(index.search_batch(queries, 10), queries):
+        expected_positions, expected_scores = copied.search(query, 10)
+        assert np.allclose(scores, expected_scores, atol=1e-5)
+        assert np.allclose(scores, embeddings[rows[positions]] @ query, atol=1e-5)
+        assert np.array_equal(index.search(query, 10)[0], expected_positions)
+
+
+def test_compare_recall_counts_existing_rows(rng, queries):
+    # With fewer rows than top_k, returning every row is perfect recall
+    embeddings = EmbeddingMatrix.from_embeddings(clustered_embeddings(5, rng))
+    results = compare_index_backends(embeddings, queries[:10], top_k=10)
+    assert results["exact"]["recall@10"] == 1.0
+    assert results["ivf"]["recall@10"] == 1.0